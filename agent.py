@@ -1,31 +1,64 @@
-from strands import Agent, tool
-from strands.models.openai import OpenAIModel
-from strands_tools import calculator, current_time
+# Heavy dependencies (strands, requests, boto3) are imported where they are used
+# so that importing this module for its helpers has no startup cost.
 import os
 from dotenv import load_dotenv
-import requests
-from typing import Optional, Dict
-import boto3
+from typing import Optional, Dict, Iterable, Iterator
+import re
+import json
+import time
+import hashlib
 import logging
+import threading
 import traceback
-# Add this import at the top
-from decimal import Decimal
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('insurance_agent.log'),
-        logging.StreamHandler()
-    ]
-)
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from checkpoint import load_checkpoint, save_checkpoint
+from logging_setup import setup_logging, PolicyErrorLog
+from throughput import get_controller, backoff_delay
+from store import get_dynamodb_table, convert_floats_to_decimals
+from memory import MemoryProfile, would_exceed, budget_note, estimate_json_mb
+import progress
 logger = logging.getLogger(__name__)
 # API KEYS
 load_dotenv()
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+# Content hashes from the last Federato sync, per DynamoDB table
+SYNC_STATE_DIR = os.getenv("SYNC_STATE_DIR", ".sync_state")
+# Federato endpoints; point them at benchmarks/standin_server.py for offline runs
+FEDERATO_AUTH_URL = os.getenv("FEDERATO_AUTH_URL", "https://product-federato.us.auth0.com")
+FEDERATO_API_URL = os.getenv("FEDERATO_API_URL", "https://product.federato.ai/integrations-api")
+POLICIES_URL = f"{FEDERATO_API_URL}/handlers/all-pollicies?outputOnly=true"
+# Paged fetching of the policy book (see PolicyFetcher)
+FEDERATO_PAGE_SIZE = int(os.getenv("FEDERATO_PAGE_SIZE", 1000))
+FEDERATO_FETCH_WORKERS = int(os.getenv("FEDERATO_FETCH_WORKERS", 4))
+FEDERATO_PAGE_RETRIES = int(os.getenv("FEDERATO_PAGE_RETRIES", 4))
+FEDERATO_TIMEOUT_SECONDS = float(os.getenv("FEDERATO_TIMEOUT_SECONDS", 300))
+# Responses worth retrying a page on; a 401 is retried once the token is renewed
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Start of the policies array in an all-pollicies response: {"output": [{"data": [
+POLICIES_ARRAY_START = re.compile(r'\s*\{\s*"output"\s*:\s*\[\s*\{\s*"data"\s*:\s*\[')
+
+_session = None
+_session_lock = threading.Lock()
+
+def _federato_session():
+    """Pooled HTTP session shared by all Federato requests, sized for the page workers"""
+    global _session
+    if _session is None:
+        import requests
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, FEDERATO_FETCH_WORKERS))
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
 
 def get_federato_token():
     """Get authentication token from Federato API"""
-    url = "https://product-federato.us.auth0.com/oauth/token"
+    import requests
+    url = f"{FEDERATO_AUTH_URL}/oauth/token"
     headers = {
         "Content-Type": "application/json"
     }
@@ -37,7 +70,7 @@ def get_federato_token():
     }
 
     try:
-        response = requests.post(url, headers=headers, json=data)
+        response = _federato_session().post(url, headers=headers, json=data, timeout=FEDERATO_TIMEOUT_SECONDS)
         
         if response.status_code == 200:
             token_data = response.json()
@@ -47,7 +80,6 @@ def get_federato_token():
     except requests.exceptions.RequestException as e:
         raise Exception(f"Network error getting token: {e}")
 
-@tool
 def read_underwriting_rules(file_path: str = "rules.txt") -> Optional[str]:
     """Read underwriting rules from a text file"""
     try:
@@ -64,43 +96,38 @@ def get_all_policies() -> Dict:
     Fetches policies from the Federato API and returns the first policy only.
     """
     try:
-        token = get_federato_token()
-        url = "https://product.federato.ai/integrations-api/handlers/all-pollicies?outputOnly=true"
-        headers = {"Authorization": f"Bearer {token}"}
-
-        response = requests.post(url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
+        # One policy is enough; handlers without paging still send the whole book
+        data = _post_all_policies(params={'limit': 1, 'offset': 0}).json()
 
-        print(f"Full API response structure: {list(data.keys()) if isinstance(data, dict) else type(data)}")
+        logger.debug(f"Full API response structure: {list(data.keys()) if isinstance(data, dict) else type(data)}")
         
         # Debug the response structure
         if "output" in data:
-            print(f" Output length: {len(data['output'])}")
+            logger.debug(f"Output length: {len(data['output'])}")
             if len(data["output"]) > 0:
                 first_item = data["output"][0]
-                print(f" First output item keys: {list(first_item.keys()) if isinstance(first_item, dict) else type(first_item)}")
+                logger.debug(f"First output item keys: {list(first_item.keys()) if isinstance(first_item, dict) else type(first_item)}")
                 
                 if "data" in first_item:
                     data_field = first_item["data"]
-                    print(f" Data field type: {type(data_field)}")
+                    logger.debug(f"Data field type: {type(data_field)}")
                     
                     # Check if data is an array of policies
                     if isinstance(data_field, list) and len(data_field) > 0:
                         policy = data_field[0]  # Get the first policy from the array
-                        print(f" First policy keys: {list(policy.keys()) if isinstance(policy, dict) else type(policy)}")
-                        print(f" Policy ID: {policy.get('id', 'NOT FOUND')}")
+                        logger.debug(f"First policy keys: {list(policy.keys()) if isinstance(policy, dict) else type(policy)}")
+                        logger.info(f"Fetched policy {policy.get('id', 'NOT FOUND')}")
                         return policy
                     elif isinstance(data_field, dict):
                         # If data is a single policy object
-                        print(f" Policy keys: {list(data_field.keys())}")
-                        print(f" Policy ID: {data_field.get('id', 'NOT FOUND')}")
+                        logger.debug(f"Policy keys: {list(data_field.keys())}")
+                        logger.info(f"Fetched policy {data_field.get('id', 'NOT FOUND')}")
                         return data_field
                     else:
                         return {"error": f"Unexpected data field type: {type(data_field)}"}
                 else:
                     # Maybe the policy data is directly in the output item
-                    print(f" No 'data' field, trying direct access")
+                    logger.debug("No 'data' field, using the output item as the policy")
                     return first_item
             else:
                 return {"error": "No policies found in API response - output array is empty"}
@@ -108,175 +135,430 @@ def get_all_policies() -> Dict:
             return {"error": "No 'output' field found in API response"}
             
     except Exception as e:
-        print(f"Exception in get_all_policies: {str(e)}")
+        logger.error(f"Error in get_all_policies: {str(e)}")
         return {"error": f"Failed to fetch policies: {str(e)}"}
      
-@tool
-def get_and_save_all_policies_to_db(table_name: str = 'unpolishedData') -> str:
-    """Fetch ALL policies from Federato API and save to DynamoDB"""
+def _post_all_policies(stream: bool = False, params: Optional[Dict] = None, token: Optional[str] = None):
+    """POST to the all-pollicies handler; with stream the body is left unread"""
+    token = token or get_federato_token()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = _federato_session().post(POLICIES_URL, headers=headers, params=params, stream=stream,
+                                        timeout=FEDERATO_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return response
+
+def _policies_from_response(data: dict) -> list:
+    """Extract all policies from the response"""
+    if "output" in data and len(data["output"]) > 0:
+        first_item = data["output"][0]
+        if "data" in first_item and isinstance(first_item["data"], list):
+            return first_item["data"]
+        raise ValueError("Could not find policies array in API response")
+    raise ValueError("No output found in API response")
+
+def _page_fields(data: dict) -> dict:
+    """Paging fields next to the policies array (total_count, next_cursor), if the handler sends any"""
+    output = data.get("output") if isinstance(data, dict) else None
+    if output and isinstance(output[0], dict):
+        return {key: value for key, value in output[0].items() if key != "data"}
+    return {}
+
+def _trailing_page_fields(rest: str) -> dict:
+    """Fields of output[0] that follow its data array, from the text after the array's ']'"""
     try:
-        token = get_federato_token()
-        url = "https://product.federato.ai/integrations-api/handlers/all-pollicies?outputOnly=true"
-        headers = {"Authorization": f"Bearer {token}"}
+        fields, _ = json.JSONDecoder().raw_decode("{" + rest.lstrip().lstrip(","))
+    except ValueError:
+        return {}
+    return fields if isinstance(fields, dict) else {}
+
+class PolicyFetcher:
+    """
+    Policies from the all-pollicies handler, fetched page by page.
+
+    The first request asks for page_size policies from offset 0 and its
+    response decides how the rest is fetched:
 
-        response = requests.post(url, headers=headers)
-        response.raise_for_status()
+        total_count   offset pages, fetched concurrently by workers threads
+                      over the pooled session, at most 2 * workers in flight
+        next_cursor   cursor pages, one after the other, the next one
+                      requested while the current one is being written
+        neither       the handler ignores paging and sent the whole book
+
+    Pages are handed to the consumer in book order. Each request is retried
+    on dropped connections, timeouts, 429 and 5xx responses (and, with a
+    renewed token, on 401), so one failed request no longer fails the ingest.
+    A first response too large for the memory budget is decoded as it
+    streams, as iter_streamed_policies does for the single-response book.
+    """
+
+    def __init__(self, page_size: int = FEDERATO_PAGE_SIZE, workers: int = FEDERATO_FETCH_WORKERS,
+                 retries: int = FEDERATO_PAGE_RETRIES, max_memory_mb: Optional[float] = None):
+        self.page_size = page_size
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.max_memory_mb = max_memory_mb
+        self.stats = {'mode': None, 'pages': 0, 'retries': 0, 'total': None}
+        self.budget_note = ""
+        self._token = None
+        self._lock = threading.Lock()
+
+    def _renew_token(self, stale: Optional[str]) -> str:
+        """A fresh token, fetched once however many pages found the old one stale"""
+        with self._lock:
+            if self._token == stale:
+                self._token = get_federato_token()
+            return self._token
+
+    def _request(self, params: Dict, stream: bool = False, parse: bool = True):
+        """One page: the decoded body (or the unread response with parse=False), retried with backoff"""
+        import requests
+        token = self._token or self._renew_token(None)
+        for attempt in range(self.retries + 1):
+            try:
+                response = _post_all_policies(stream, params, token)
+                data = response.json() if parse else response
+                with self._lock:
+                    self.stats['pages'] += 1
+                return data
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if attempt == self.retries or (status != 401 and status not in RETRYABLE_STATUSES):
+                    raise
+                if status == 401:
+                    token = self._renew_token(token)
+                error = e
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, ValueError) as e:
+                # ValueError: a body cut off mid-transfer that does not decode
+                if attempt == self.retries:
+                    raise
+                error = e
+            with self._lock:
+                self.stats['retries'] += 1
+            delay = backoff_delay(attempt)
+            logger.warning(f"Federato page {params} failed ({error}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _first_page(self) -> tuple:
+        """(policies of the first page, its paging fields); policies is a generator when streamed"""
+        response = self._request({'limit': self.page_size, 'offset': 0}, stream=True, parse=False)
+        content_length = int(response.headers.get('Content-Length') or 0)
+        estimated_mb = estimate_json_mb(content_length)
+        self.budget_note = budget_note(estimated_mb, self.max_memory_mb)
+        if would_exceed(estimated_mb, self.max_memory_mb):
+            logger.info("Streaming policies from the API response to stay within the memory budget")
+            fields = {}
+            return iter_streamed_policies(response, page_fields=fields), fields
         data = response.json()
+        return _policies_from_response(data), _page_fields(data)
 
-        # Extract all policies from the response
-        if "output" in data and len(data["output"]) > 0:
-            first_item = data["output"][0]
-            if "data" in first_item and isinstance(first_item["data"], list):
-                all_policies = first_item["data"]
-                print(f"Found {len(all_policies)} policies to process")
-            else:
-                return "Error: Could not find policies array in API response"
+    def __iter__(self) -> Iterator[dict]:
+        job_progress = progress.current()
+        first, fields = self._first_page()
+        streamed = not isinstance(first, list)
+        if streamed:
+            # The paging fields follow the array, so they are known once it is consumed
+            first_count = 0
+            for policy in first:
+                first_count += 1
+                yield policy
+            first = []
         else:
-            return "Error: No output found in API response"
+            first_count = len(first)
 
-        # Set up DynamoDB connection
-        session = boto3.Session(
-            aws_access_key_id='fakeMyKeyId',
-            aws_secret_access_key='fakeSecretAccessKey',
-            region_name="us-west-2"
-        )
-        dynamodb = session.resource(
-            'dynamodb',
-            endpoint_url='http://localhost:8123'
-        )
+        total = fields.get('total_count')
+        if total is not None and first_count and int(total) > first_count:
+            self.stats.update(mode='offset', total=int(total))
+            job_progress.expect(int(total), first_count if streamed else 0)
+            # The handler may cap the page size; step by what it actually returned
+            pages = iter(range(first_count, int(total), first_count))
+            yield from self._ordered_pages(first, ({'limit': first_count, 'offset': offset} for offset in pages))
+        elif fields.get('next_cursor'):
+            self.stats['mode'] = 'cursor'
+            yield from self._cursor_pages(first, fields['next_cursor'])
+        else:
+            self.stats.update(mode='single', total=first_count)
+            yield from first
+
+    def _ordered_pages(self, first: list, page_params: Iterator[Dict]) -> Iterator[dict]:
+        inflight = deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="federato") as executor:
+            def fill():
+                for params in page_params:
+                    inflight.append(executor.submit(self._request, params))
+                    if len(inflight) >= self.workers * 2:
+                        return
+            fill()
+            yield from first
+            while inflight:
+                data = inflight.popleft().result()
+                fill()
+                yield from _policies_from_response(data)
+
+    def _cursor_pages(self, first: list, cursor: str) -> Iterator[dict]:
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="federato") as executor:
+            pending = executor.submit(self._request, {'limit': self.page_size, 'cursor': cursor})
+            yield from first
+            while pending is not None:
+                data = pending.result()
+                cursor = _page_fields(data).get('next_cursor')
+                pending = executor.submit(self._request, {'limit': self.page_size, 'cursor': cursor}) if cursor else None
+                yield from _policies_from_response(data)
+
+    def summary_text(self) -> str:
+        stats = self.stats
+        if stats['mode'] == 'single':
+            how = "the whole book in one response"
+        else:
+            workers = f", {self.workers} workers" if stats['mode'] == 'offset' else ""
+            how = f"{stats['pages']} pages, {stats['mode']} paging{workers}"
+        return f"\nFetched from Federato: {how}; {stats['retries']} request(s) retried" + self.budget_note
+
+def fetch_all_policies() -> list:
+    """Fetch the full policy list from the Federato API"""
+    return list(PolicyFetcher())
+
+def iter_streamed_policies(response, chunk_size: int = 1 << 16, page_fields: Optional[dict] = None) -> Iterator[dict]:
+    """
+    Policies from a streamed all-pollicies response one at a time. The
+    output[0].data array is decoded incrementally, so the body is never held
+    whole; a body laid out any other way is read fully and parsed as usual.
+    page_fields, if given, receives the paging fields that follow the array.
+    """
+    decoder = json.JSONDecoder()
+    response.encoding = response.encoding or 'utf-8'
+    chunks = response.iter_content(chunk_size=chunk_size, decode_unicode=True)
+    buffer, match = "", None
+    for chunk in chunks:
+        buffer += chunk
+        match = POLICIES_ARRAY_START.match(buffer)
+        if match or len(buffer) > 4096:
+            break
+    if not match:
+        data = json.loads(buffer + "".join(chunks))
+        if page_fields is not None:
+            page_fields.update(_page_fields(data))
+        yield from _policies_from_response(data)
+        return
 
-        # Check if table exists, create if not
+    buffer = buffer[match.end():]
+    exhausted = False
+    while True:
+        buffer = buffer.lstrip(" \t\r\n,")
+        if buffer.startswith("]"):
+            if page_fields is not None:
+                page_fields.update(_trailing_page_fields(buffer[1:] + "".join(chunks)))
+            return
+        if buffer:
+            try:
+                policy, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+            else:
+                yield policy
+                buffer = buffer[end:]
+                continue
+        elif exhausted:
+            raise ValueError("Policies array in API response ended unexpectedly")
+        # Incomplete policy: at least double the buffer before decoding again, so
+        # large policies spanning many chunks are not re-parsed once per chunk
+        target = max(2 * len(buffer), chunk_size)
+        exhausted = True
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= target:
+                exhausted = False
+                break
+
+def policy_content_hash(policy: dict) -> str:
+    """Stable hash of a policy as returned by the API, used to detect changes"""
+    payload = json.dumps(policy, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+def get_policies_table(table_name: str = 'unpolishedData'):
+    """Get the DynamoDB policies table, creating it if it does not exist"""
+    return get_dynamodb_table(table_name, key_name='id')
+
+def save_policies_to_db(all_policies: Iterable[dict], table_name: str = 'unpolishedData', full_refresh: bool = False) -> str:
+    """
+    Write policies to DynamoDB, skipping the ones that have not changed.
+
+    Each policy's content hash is remembered in a local sync state file, so
+    unchanged policies are skipped before conversion without touching
+    DynamoDB. Policies the sync state doesn't vouch for are written with a
+    conditional put that only succeeds if the stored content_hash differs.
+    full_refresh rewrites everything unconditionally. all_policies may be a
+    generator, so a streamed API response is written as it is decoded.
+    """
+    try:
+        table = get_policies_table(table_name)
+    except Exception as e:
+        return f"Error with DynamoDB table operations: {e}"
+
+    state_name = f"federato-sync-{table_name}"
+    sync_state = None if full_refresh else load_checkpoint(state_name, SYNC_STATE_DIR)
+    known_hashes = sync_state.get('hashes', {}) if sync_state else {}
+    synced_hashes = {}
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    total = 0
+
+    # Process each policy
+    errors = []
+    error_log = PolicyErrorLog(logger)
+    from botocore.exceptions import ClientError
+    # Paces puts to the table's write capacity and retries throttled ones
+    controller = get_controller(table)
+    job_progress = progress.current()
+    job_progress.expect(len(all_policies) if isinstance(all_policies, list) else None)
+    
+    for i, policy in enumerate(all_policies):
+        # Pauses and cancellations of a background job take effect between policies
+        job_progress.advance(1)
+        total += 1
         try:
-            existing_tables = [t.name for t in dynamodb.tables.all()]
-            if table_name not in existing_tables:
-                table = dynamodb.create_table(
-                    TableName=table_name,
-                    KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
-                    AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
-                    BillingMode='PAY_PER_REQUEST'
+            # Get policy ID
+            policy_id = str(policy.get('id', f'policy_{i}'))
+            content_hash = policy_content_hash(policy)
+            
+            if known_hashes.get(policy_id) == content_hash:
+                counts['unchanged'] += 1
+                synced_hashes[policy_id] = content_hash
+                continue
+            
+            # Convert data types
+            converted_policy = convert_floats_to_decimals(policy)
+            item = {"id": policy_id, **converted_policy, 'content_hash': content_hash}
+            
+            # Ensure ID is string and not duplicated
+            if 'id' in converted_policy:
+                item['id'] = policy_id
+            
+            # Save to DynamoDB
+            put_kwargs = {'Item': item, 'ReturnValues': 'ALL_OLD'}
+            if not full_refresh:
+                put_kwargs['ConditionExpression'] = (
+                    'attribute_not_exists(id) OR attribute_not_exists(content_hash) OR content_hash <> :hash'
                 )
-                table.wait_until_exists()
-            else:
-                table = dynamodb.Table(table_name)
+                put_kwargs['ExpressionAttributeValues'] = {':hash': content_hash}
+            try:
+                response = controller.put_item(table, **put_kwargs)
+                counts['updated' if response.get('Attributes') else 'inserted'] += 1
+                logger.debug(f"Saved policy {policy_id} ({i+1})")
+            except ClientError as e:
+                # Matched by code: each boto3 session has its own exception classes
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                counts['unchanged'] += 1
+            synced_hashes[policy_id] = content_hash
+            
         except Exception as e:
-            return f"Error with DynamoDB table operations: {e}"
-
-        # Conversion function for DynamoDB compatibility
-        def convert_floats_to_decimals(obj):
-            if isinstance(obj, dict):
-                return {k: convert_floats_to_decimals(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [convert_floats_to_decimals(v) for v in obj]
-            elif isinstance(obj, float):
-                return Decimal(str(obj))
-            elif isinstance(obj, str):
-                try:
-                    if '.' in obj and obj.replace('.', '').replace('-', '').isdigit():
-                        return Decimal(obj)
-                except:
-                    pass
-                return obj
-            else:
-                return obj
+            error_msg = f"Error saving policy {i+1}: {str(e)}"
+            errors.append(error_msg)
+            error_log.error(error_msg, e)
 
-        # Process each policy
-        saved_count = 0
-        errors = []
-        
-        for i, policy in enumerate(all_policies):
-            try:
-                # Get policy ID
-                policy_id = str(policy.get('id', f'policy_{i}'))
-                
-                # Convert data types
-                converted_policy = convert_floats_to_decimals(policy)
-                item = {"id": policy_id, **converted_policy}
-                
-                # Ensure ID is string and not duplicated
-                if 'id' in converted_policy:
-                    item['id'] = policy_id
-                
-                # Save to DynamoDB
-                table.put_item(Item=item)
-                saved_count += 1
-                print(f"Saved policy {policy_id} ({i+1}/{len(all_policies)})")
-                
-            except Exception as e:
-                error_msg = f"Error saving policy {i+1}: {str(e)}"
-                errors.append(error_msg)
-                print(error_msg)
-
-        # Return summary
-        result_msg = f"Successfully saved {saved_count}/{len(all_policies)} policies to {table_name}"
-        if errors:
-            result_msg += f"\nErrors encountered: {len(errors)}"
-            for error in errors[:3]:  # Show first 3 errors
-                result_msg += f"\n- {error}"
-            if len(errors) > 3:
-                result_msg += f"\n- ... and {len(errors)-3} more errors"
-        
-        return result_msg
+    error_log.log_summary()
+    save_checkpoint(state_name, {'hashes': synced_hashes, 'policy_count': total}, SYNC_STATE_DIR)
+    
+    # Return summary
+    saved_count = counts['inserted'] + counts['updated']
+    result_msg = f"Successfully saved {saved_count}/{total} policies to {table_name}"
+    result_msg += f"\nInserted: {counts['inserted']} | Updated: {counts['updated']} | Unchanged: {counts['unchanged']}"
+    if errors:
+        result_msg += f"\nErrors encountered: {len(errors)}"
+        for error in errors[:3]:  # Show first 3 errors
+            result_msg += f"\n- {error}"
+        if len(errors) > 3:
+            result_msg += f"\n- ... and {len(errors)-3} more errors"
+    
+    return result_msg
 
+def get_and_save_all_policies_to_db(table_name: str = 'unpolishedData', full_refresh: bool = False,
+                                    max_memory_mb: Optional[float] = None, profile_memory: bool = False) -> str:
+    """Fetch ALL policies from Federato API and save to DynamoDB.
+    Only new or changed policies are written; full_refresh rewrites all of them.
+    Pages are fetched concurrently when the API pages the book (see
+    PolicyFetcher) and written in order as they arrive. When a response
+    would not fit in max_memory_mb (default MAX_MEMORY_MB), policies are
+    decoded from the streamed body and saved one at a time. profile_memory
+    appends RSS and tracemalloc figures."""
+    profile = MemoryProfile(enabled=profile_memory, max_memory_mb=max_memory_mb)
+    try:
+        profile.start()
+        fetcher = PolicyFetcher(max_memory_mb=max_memory_mb)
+        with profile.stage('fetch and save'):
+            result = save_policies_to_db(fetcher, table_name, full_refresh)
+        profile.stop()
+        return result + fetcher.summary_text() + profile.format_summary()
     except Exception as e:
+        profile.stop()
         return f"Error processing policies: {str(e)}"
 
-# Check if required environment variable is set
-if not COHERE_API_KEY:
-    logger.error("COHERE_API_KEY not found in environment variables")
-    print(" Error: COHERE_API_KEY not found in environment variables")
-    print("Please set your Cohere API key in your .env file")
-    exit(1)
-
-try:
-    logger.info(" Initializing OpenAI model with Cohere API...")
-    model = OpenAIModel(
-        client_args={
-            "api_key": COHERE_API_KEY,
-            "base_url": "https://api.cohere.ai/compatibility/v1"
-        },
-        model_id="command-a-03-2025",
-        params={
-            "max_tokens": 1000
-        }
-    )
-
-    logger.info(" Creating agent with tools...")
-    agent = Agent(model=model, tools=[read_underwriting_rules, get_and_save_all_policies_to_db])
-
-    print(" Insurance Underwriting Agent Ready!")
-    print("Available tools:")
-    print("- read_underwriting_rules: Read rules from a text file")
-    print("- get_and_save_policies_to_db: Fetch and save policies from Federato API")
-    print("\nYou can ask me to:")
-    print("- Read underwriting rules from a file")
-    print("- Fetch and save policy data")
-    print("- Answer questions about insurance policies")
-    print(f"\n Logs are being saved to: insurance_agent.log")
-    
-    logger.info(" Agent ready for user interaction")
-    
-    while True:
-        user_input = input("\n Ask me something (or 'quit' to exit): ")
-        if user_input.lower() in ['quit', 'exit', 'q']:
-            logger.info(" User requested exit")
-            print(" Goodbye!")
-            break
+# Functions exposed to the agent; wrapped with strands' tool() when the agent is built
+TOOLS = [
+    read_underwriting_rules,
+    get_and_save_all_policies_to_db
+]
+# Started as background jobs by the REPL, so the console stays responsive
+BACKGROUND_TOOLS = [get_and_save_all_policies_to_db]
+
+def main():
+    """Start the interactive insurance agent"""
+    import asyncio
+    from strands import Agent, tool
+    from strands.models.openai import OpenAIModel
+    from repl import JobManager, agent_tools, run_repl
+    from review import LLM_BASE_URL, LLM_MODEL_ID
+
+    setup_logging('insurance_agent.log')
+
+    # Check if required environment variable is set
+    if not COHERE_API_KEY:
+        logger.error("COHERE_API_KEY not found in environment variables")
+        print(" Error: COHERE_API_KEY not found in environment variables")
+        print("Please set your Cohere API key in your .env file")
+        exit(1)
+
+    try:
+        logger.info(" Initializing OpenAI model with Cohere API...")
+        model = OpenAIModel(
+            client_args={
+                "api_key": COHERE_API_KEY,
+                "base_url": LLM_BASE_URL
+            },
+            model_id=LLM_MODEL_ID,
+            params={
+                "max_tokens": 1000
+            }
+        )
+
+        logger.info(" Creating agent with tools...")
+        jobs = JobManager()
+        tools = agent_tools(TOOLS, jobs, BACKGROUND_TOOLS)
+        agent = Agent(model=model, tools=[tool(f) for f in tools])
+
+        print(" Insurance Underwriting Agent Ready!")
+        print("Available tools:")
+        print("- read_underwriting_rules: Read rules from a text file")
+        print("- get_and_save_policies_to_db: Fetch and save policies from Federato API")
+        print("\nYou can ask me to:")
+        print("- Read underwriting rules from a file")
+        print("- Fetch and save policy data")
+        print("- Answer questions about insurance policies")
+        print("\nFetching policies runs as a background job; type /help for job commands")
+        print(f"\n Logs are being saved to: insurance_agent.log")
         
-        try:
-            logger.info(f"  User input: {user_input}")
-            response = agent(user_input)
-            logger.info(f" Agent response length: {len(str(response))} characters")
-            logger.debug(f"Agent response: {response}")
-            print(f" {response}")
-        except Exception as e:
-            error_msg = f"Error processing request: {e}"
-            logger.error(f"{error_msg}")
-            logger.error(f"Stack trace: {traceback.format_exc()}")
-            print(f"{error_msg}")
-
-except Exception as e:
-    error_msg = f"Error initializing agent: {e}"
-    logger.error(f" {error_msg}")
-    logger.error(f"Stack trace: {traceback.format_exc()}")
-    print(f" {error_msg}")
-    print("Please check your API key and dependencies")
\ No newline at end of file
+        logger.info(" Agent ready for user interaction")
+        
+        asyncio.run(run_repl(agent, jobs, tools, "\n Ask me something (or 'quit' to exit): "))
+
+    except Exception as e:
+        error_msg = f"Error initializing agent: {e}"
+        logger.error(f" {error_msg}")
+        logger.error(f"Stack trace: {traceback.format_exc()}")
+        print(f" {error_msg}")
+        print("Please check your API key and dependencies")
+
+if __name__ == "__main__":
+    main()
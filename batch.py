@@ -0,0 +1,459 @@
+"""
+Headless batch entry point for underwriting, migration and summaries.
+
+Runs the same rule engines as the agents without going through the LLM and
+prints machine-readable JSON stats, so it can be scheduled from cron:
+
+    python batch.py run --source dynamo --workers 8 --batch-size 500
+    python batch.py run --source postgres --workers 4
+    python batch.py migrate --batch-size 500
+    python batch.py summary --source postgres
+    python batch.py whatif --rule-sets proposals.json
+    python batch.py retention --months 24
+    python batch.py shard --source postgres --by state --run-id nightly-2026-10-19
+    python batch.py shard-summary --source postgres --run-id nightly-2026-10-19
+    python batch.py stream --source dynamo
+
+`python -m underwriter run ...` is an alias for `python batch.py run ...`.
+Runs checkpoint after every batch and resume from the last completed batch
+unless --restart is given. Sharded runs (see sharding.py) keep their progress
+in lease rows instead, so any number of hosts can work on the same run id.
+Edits to rules.txt during a run are picked up from the next batch on (see
+rulebook.py); the stats list the rules versions used.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from checkpoint import load_checkpoint, save_checkpoint, clear_checkpoint
+from logging_setup import setup_logging
+from throughput import get_controller
+from memory import MemoryProfile
+from rulebook import get_rules
+from store import DynamoPolicyStore, PostgresPolicyStore
+
+logger = logging.getLogger(__name__)
+
+
+def _new_stats(command: str, source: str) -> dict:
+    return {
+        'command': command,
+        'source': source,
+        'total_processed': 0,
+        'safe_count': 0,
+        'not_safe_count': 0,
+        'error_count': 0,
+        'errors': [],
+        'batches': 0,
+        'resumed': False
+    }
+
+
+def _merge_batch_stats(stats: dict, batch_stats: dict):
+    for key in ('total_processed', 'safe_count', 'not_safe_count', 'error_count'):
+        stats[key] += batch_stats.get(key, 0)
+    # Keep the first few errors only, like the agent summaries do
+    stats['errors'].extend(batch_stats.get('errors', [])[:max(0, 3 - len(stats['errors']))])
+    stats['batches'] += 1
+    # Versions of rules.txt the batches ran on, more than one if it was reloaded mid-run
+    version = batch_stats.get('rules_version')
+    if version and version not in stats.setdefault('rules_versions', []):
+        stats['rules_versions'].append(version)
+
+
+def _run_ordered(batches, process_batch, on_batch_done, workers: int):
+    """
+    Process batches on a thread pool with bounded in-flight work. on_batch_done
+    is called in submission order, so a checkpoint written there never skips
+    over a batch that has not finished yet.
+    """
+    inflight = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch, position in batches:
+            inflight.append((executor.submit(process_batch, batch), position))
+            while len(inflight) >= workers * 2:
+                future, done_position = inflight.popleft()
+                on_batch_done(future.result(), done_position)
+        while inflight:
+            future, done_position = inflight.popleft()
+            on_batch_done(future.result(), done_position)
+
+
+def underwrite_dynamodb(table_name: str, results_table: str, workers: int, batch_size: int,
+                        restart: bool = False) -> dict:
+    """Underwrite the DynamoDB book page by page with the underwriter.py rule engine"""
+    import underwriter
+
+    job = f"underwrite-dynamo-{table_name}"
+    stats = _new_stats('run', 'dynamo')
+    store = DynamoPolicyStore(table_name, results_table)
+    store.results  # creates the results table up front
+
+    checkpoint = None if restart else load_checkpoint(job)
+    if checkpoint:
+        stats['resumed'] = True
+        for key in ('total_processed', 'safe_count', 'not_safe_count', 'error_count'):
+            stats[key] = checkpoint['stats'].get(key, 0)
+
+    def process_batch(items):
+        # The rules current when the batch starts apply to all of it
+        rules_content, version = underwriter.current_rules()
+        batch_stats = {'total_processed': 0, 'safe_count': 0, 'not_safe_count': 0,
+                       'error_count': 0, 'errors': [], 'rules_version': version}
+        results = []
+        for policy in items:
+            try:
+                decision, reasoning = underwriter.apply_underwriting_rules(policy, rules_content)
+                results.append({'policy': policy, 'decision': decision, 'reasoning': reasoning,
+                                'rules_version': version})
+                batch_stats['total_processed'] += 1
+                batch_stats['safe_count' if decision == 'SAFE' else 'not_safe_count'] += 1
+            except Exception as e:
+                batch_stats['error_count'] += 1
+                batch_stats['errors'].append(f"Error processing policy {policy.get('id', 'unknown')}: {str(e)}")
+        # All workers share one write budget for the results table
+        store.bulk_write_results(results)
+        return batch_stats
+
+    def pages():
+        # Typed scan of the rule engine's attributes only, already in native types
+        start_key = checkpoint.get('last_evaluated_key') if checkpoint else None
+        for items, last_key in store.iter_policies(batch_size, underwriter.POLICY_FIELDS, start_key):
+            if items:
+                yield items, last_key
+
+    def on_batch_done(batch_stats, last_key):
+        _merge_batch_stats(stats, batch_stats)
+        if last_key:
+            save_checkpoint(job, {'last_evaluated_key': last_key, 'stats': stats})
+
+    _run_ordered(pages(), process_batch, on_batch_done, workers)
+    clear_checkpoint(job)
+    stats['results_table'] = results_table
+    stats['capacity'] = store.capacity_stats()
+    return stats
+
+
+def underwrite_postgres(workers: int, batch_size: int, restart: bool = False) -> dict:
+    """Underwrite the PostgreSQL book in id order with the render_underwriter.py rule engine"""
+    import render_underwriter
+
+    job = "underwrite-postgres"
+    stats = _new_stats('run', 'postgres')
+    # One pooled connection per worker plus one for reading the next batch
+    store = PostgresPolicyStore(max_connections=workers + 1)
+    if not store.setup():
+        raise RuntimeError("Failed to setup database tables")
+    # Fails early on a missing or broken rules.txt; batches then take the current version
+    get_rules()
+
+    checkpoint = None if restart else load_checkpoint(job)
+    last_id = None
+    if checkpoint:
+        stats['resumed'] = True
+        last_id = checkpoint.get('last_policy_id')
+        for key in ('total_processed', 'safe_count', 'not_safe_count', 'error_count'):
+            stats[key] = checkpoint['stats'].get(key, 0)
+
+    def process_batch(policies):
+        # The rules current when the batch starts apply to all of it
+        rules = get_rules()
+        batch_stats = {'total_processed': 0, 'safe_count': 0, 'not_safe_count': 0,
+                       'error_count': 0, 'errors': [], 'rules_version': rules.version}
+        results = []
+        for policy in policies:
+            try:
+                decision, reasoning = render_underwriter.apply_underwriting_rules(policy, rules.content, rules.rule_set)
+                results.append({'policy': policy, 'decision': decision, 'reasoning': reasoning,
+                                'rules_version': rules.version})
+                batch_stats['total_processed'] += 1
+                batch_stats['safe_count' if decision == 'SAFE' else 'not_safe_count'] += 1
+            except Exception as e:
+                batch_stats['error_count'] += 1
+                batch_stats['errors'].append(f"Error processing policy {policy.get('id', 'unknown')}: {str(e)}")
+        store.bulk_write_results(results)
+        return batch_stats
+
+    def on_batch_done(batch_stats, batch_last_id):
+        _merge_batch_stats(stats, batch_stats)
+        save_checkpoint(job, {'last_policy_id': batch_last_id, 'stats': stats})
+
+    # Keyset pages in id order, so a checkpointed id resumes exactly after its batch
+    _run_ordered(store.iter_policies(batch_size, start_after=last_id), process_batch, on_batch_done, workers)
+    clear_checkpoint(job)
+    return stats
+
+
+def migrate(dynamo_table: str, workers: int, batch_size: int, restart: bool = False,
+            columns_only: bool = False) -> dict:
+    """Copy policies from DynamoDB into PostgreSQL in committed batches"""
+    import render_underwriter
+
+    job = f"migrate-{dynamo_table}"
+    stats = {'command': 'migrate', 'source': 'dynamo', 'migrated_count': 0,
+             'error_count': 0, 'errors': [], 'batches': 0, 'resumed': False}
+    source = DynamoPolicyStore(dynamo_table)
+    target = PostgresPolicyStore(max_connections=workers)
+    if not target.setup():
+        raise RuntimeError("Failed to setup database tables")
+
+    checkpoint = None if restart else load_checkpoint(job)
+    if checkpoint:
+        stats['resumed'] = True
+        stats['migrated_count'] = checkpoint['stats'].get('migrated_count', 0)
+
+    def process_batch(items):
+        migrated_count, errors = target.bulk_upsert(items)
+        return {'migrated_count': migrated_count, 'error_count': len(errors), 'errors': errors}
+
+    def pages():
+        # Whole items by default, since raw_data keeps them; deserialized straight to native types
+        start_key = checkpoint.get('last_evaluated_key') if checkpoint else None
+        fields = render_underwriter.POLICY_COLUMNS if columns_only else None
+        for items, last_key in source.iter_policies(batch_size, fields, start_key):
+            if items:
+                yield items, last_key
+
+    def on_batch_done(batch_stats, last_key):
+        stats['migrated_count'] += batch_stats['migrated_count']
+        stats['error_count'] += batch_stats['error_count']
+        stats['errors'].extend(batch_stats['errors'][:max(0, 3 - len(stats['errors']))])
+        stats['batches'] += 1
+        if last_key:
+            save_checkpoint(job, {'last_evaluated_key': last_key, 'stats': stats})
+
+    _run_ordered(pages(), process_batch, on_batch_done, workers)
+    clear_checkpoint(job)
+    return stats
+
+
+def summarize(source: str, results_table: str) -> dict:
+    """Classification counts for the stored underwriting results"""
+    stats = {'command': 'summary', 'source': source, 'classifications': {}}
+    if source == 'postgres':
+        import render_underwriter
+        conn = render_underwriter.get_postgres_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT classification, COUNT(*), AVG(tiv), AVG(total_premium)
+                    FROM underwriting_results
+                    GROUP BY classification
+                    ORDER BY classification
+                """)
+                for classification, count, avg_tiv, avg_premium in cursor.fetchall():
+                    stats['classifications'][classification] = {
+                        'count': count,
+                        'avg_tiv': float(avg_tiv) if avg_tiv is not None else None,
+                        'avg_premium': float(avg_premium) if avg_premium is not None else None
+                    }
+        finally:
+            conn.close()
+    else:
+        import underwriter
+        table = underwriter.get_dynamodb_table(results_table)
+        scan_kwargs = {'ProjectionExpression': 'classification'}
+        while True:
+            response = get_controller(table).scan(table, **scan_kwargs)
+            for item in response['Items']:
+                classification = item.get('classification', 'UNKNOWN')
+                entry = stats['classifications'].setdefault(classification, {'count': 0})
+                entry['count'] += 1
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    stats['total'] = sum(entry['count'] for entry in stats['classifications'].values())
+    return stats
+
+
+def what_if(source: str, rule_sets_arg: str, table_name: str) -> dict:
+    """Compare rule sets over the snapshot; rule_sets_arg is a JSON string or a path to a JSON file"""
+    import os
+    from snapshot import (load_snapshot, refresh_snapshot_from_dynamodb, refresh_snapshot_from_postgres,
+                          dynamodb_source, POSTGRES_SOURCE)
+    from whatif import build_rule_sets, evaluate_rule_sets
+
+    if os.path.exists(rule_sets_arg):
+        with open(rule_sets_arg, "r", encoding="utf-8") as f:
+            overrides = json.load(f)
+    else:
+        overrides = json.loads(rule_sets_arg)
+    if isinstance(overrides, dict):
+        overrides = [overrides]
+
+    # snapshot: whichever source was refreshed last, as it is
+    snapshot_source = None
+    if source == 'postgres':
+        import render_underwriter
+        conn = render_underwriter.get_postgres_connection()
+        try:
+            refresh_snapshot_from_postgres(conn)
+        finally:
+            conn.close()
+        snapshot_source = POSTGRES_SOURCE
+    elif source == 'dynamo':
+        import underwriter
+        refresh_snapshot_from_dynamodb(underwriter.get_dynamodb_table(table_name))
+        snapshot_source = dynamodb_source(table_name)
+
+    snapshot = load_snapshot(source=snapshot_source)
+    if snapshot is None:
+        raise RuntimeError("No policy snapshot found; run with --source dynamo or postgres first")
+
+    result = evaluate_rule_sets(snapshot, build_rule_sets(overrides))
+    return {
+        'command': 'whatif',
+        'source': source,
+        'total_processed': result['row_count'],
+        'snapshot_version': result['snapshot_version'],
+        'rule_sets': result['rule_sets'],
+        'diff_matrix': result['diff_matrix'].tolist(),
+        'summary': result['summary']
+    }
+
+
+def retention(months: int, drop: bool) -> dict:
+    """Detach (or drop) underwriting_results partitions older than months"""
+    import render_underwriter
+    conn = render_underwriter.get_postgres_connection()
+    try:
+        expired = render_underwriter.apply_result_retention(conn, months, drop)
+    finally:
+        conn.close()
+    return {'command': 'retention', 'source': 'postgres', 'retention_months': months,
+            'dropped' if drop else 'detached': expired}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="LLM-free batch underwriting")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Underwrite the whole book")
+    run_parser.add_argument('--source', choices=['dynamo', 'postgres'], default='dynamo')
+    run_parser.add_argument('--table', default='unpolishedData', help="DynamoDB policies table")
+    run_parser.add_argument('--results-table', default='underwritingResults', help="DynamoDB results table")
+
+    migrate_parser = subparsers.add_parser('migrate', help="Copy policies from DynamoDB to PostgreSQL")
+    migrate_parser.add_argument('--table', default='unpolishedData', help="DynamoDB policies table")
+    migrate_parser.add_argument('--columns-only', action='store_true',
+                                help="Scan only the policies table columns; raw_data then holds just those")
+
+    for sub in (run_parser, migrate_parser):
+        sub.add_argument('--workers', type=int, default=4)
+        sub.add_argument('--batch-size', type=int, default=500)
+        sub.add_argument('--restart', action='store_true', help="Ignore any saved checkpoint")
+
+    summary_parser = subparsers.add_parser('summary', help="Summarize stored results")
+    summary_parser.add_argument('--source', choices=['dynamo', 'postgres'], default='dynamo')
+    summary_parser.add_argument('--results-table', default='underwritingResults', help="DynamoDB results table")
+
+    whatif_parser = subparsers.add_parser('whatif', help="Compare rule sets without writing results")
+    whatif_parser.add_argument('--rule-sets', required=True,
+                               help="JSON list of CURRENT_RULE_SET overrides, or a path to a JSON file")
+    whatif_parser.add_argument('--source', choices=['snapshot', 'dynamo', 'postgres'], default='snapshot',
+                               help="Refresh the snapshot of this source first (default: use the last one refreshed as it is)")
+    whatif_parser.add_argument('--table', default='unpolishedData', help="DynamoDB policies table")
+
+    retention_parser = subparsers.add_parser('retention', help="Detach old PostgreSQL results partitions")
+    retention_parser.add_argument('--months', type=int, default=None,
+                                  help="Months of results to keep (default: RESULTS_RETENTION_MONTHS)")
+    retention_parser.add_argument('--drop', action='store_true', help="Drop expired partitions instead of detaching")
+
+    shard_parser = subparsers.add_parser('shard', help="Claim and underwrite shards of a multi-host run")
+    shard_parser.add_argument('--run-id', required=True, help="Same id on every worker of the run")
+    shard_parser.add_argument('--source', choices=['dynamo', 'postgres'], default='postgres')
+    shard_parser.add_argument('--by', choices=['hash', 'state'], default='hash',
+                              help="Shard by a hash of id (DynamoDB: scan segments) or by primary_risk_state")
+    shard_parser.add_argument('--shards', type=int, default=16, help="Number of hash shards")
+    shard_parser.add_argument('--workers', type=int, default=1, help="Shards worked on at once by this process")
+    shard_parser.add_argument('--batch-size', type=int, default=500)
+    shard_parser.add_argument('--lease-seconds', type=int, default=None,
+                              help="Lease length; a shard is reclaimed this long after its worker stops")
+    shard_parser.add_argument('--table', default='unpolishedData', help="DynamoDB policies table")
+    shard_parser.add_argument('--results-table', default='underwritingResults', help="DynamoDB results table")
+
+    shard_summary_parser = subparsers.add_parser('shard-summary', help="Merged summary of a sharded run")
+    shard_summary_parser.add_argument('--run-id', required=True)
+    shard_summary_parser.add_argument('--source', choices=['dynamo', 'postgres'], default='postgres')
+
+    stream_parser = subparsers.add_parser('stream', help="Underwrite new and changed policies as they arrive")
+    stream_parser.add_argument('--source', choices=['dynamo', 'postgres'], default='dynamo')
+    stream_parser.add_argument('--table', default='unpolishedData', help="DynamoDB policies table")
+    stream_parser.add_argument('--results-table', default='underwritingResults', help="DynamoDB results table")
+    stream_parser.add_argument('--flush-size', type=int, default=100, help="Write decisions once this many are pending")
+    stream_parser.add_argument('--flush-ms', type=int, default=200, help="...or once the oldest has waited this long")
+    stream_parser.add_argument('--from-start', action='store_true',
+                               help="DynamoDB: replay the stream's retained records first")
+    stream_parser.add_argument('--max-events', type=int, default=None, help="Stop after scoring this many policies")
+    stream_parser.add_argument('--duration', type=float, default=None, help="Stop after this many seconds")
+
+    for sub in subparsers.choices.values():
+        sub.add_argument('--profile-memory', action='store_true',
+                         help="Add RSS samples and tracemalloc figures to the stats under 'memory'")
+    return parser
+
+
+def run_command(args) -> dict:
+    """Run the parsed subcommand and return its stats"""
+    if args.command == 'run' and args.source == 'dynamo':
+        stats = underwrite_dynamodb(args.table, args.results_table, args.workers, args.batch_size, args.restart)
+    elif args.command == 'run':
+        stats = underwrite_postgres(args.workers, args.batch_size, args.restart)
+    elif args.command == 'migrate':
+        stats = migrate(args.table, args.workers, args.batch_size, args.restart, args.columns_only)
+    elif args.command == 'whatif':
+        stats = what_if(args.source, args.rule_sets, args.table)
+    elif args.command == 'shard':
+        import sharding
+        stats = sharding.run_shard_worker(args.source, args.run_id, args.by, args.shards, args.workers,
+                                          args.batch_size, args.lease_seconds or sharding.LEASE_SECONDS,
+                                          args.table, args.results_table)
+        stats.update(command='shard', source=args.source)
+    elif args.command == 'shard-summary':
+        import sharding
+        stats = {'command': 'shard-summary', 'source': args.source,
+                 **sharding.run_summary(args.source, args.run_id)}
+    elif args.command == 'stream':
+        from streaming import run_stream
+        stats = run_stream(args.source, args.table, args.results_table, args.flush_size, args.flush_ms,
+                           args.from_start, args.max_events, args.duration)
+    elif args.command == 'retention':
+        import render_underwriter
+        stats = retention(args.months if args.months is not None else render_underwriter.RESULTS_RETENTION_MONTHS, args.drop)
+    else:
+        stats = summarize(args.source, args.results_table)
+    return stats
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    setup_logging(None, console_stream=sys.stderr)
+
+    profile = MemoryProfile(enabled=args.profile_memory)
+    started = time.perf_counter()
+    try:
+        with profile, profile.stage(args.command):
+            stats = run_command(args)
+    except Exception as e:
+        logger.error(f"Batch {args.command} failed: {e}")
+        print(json.dumps({'command': args.command, 'error': str(e)}))
+        return 1
+
+    elapsed = time.perf_counter() - started
+    stats['elapsed_seconds'] = round(elapsed, 3)
+    processed = stats.get('total_processed', stats.get('migrated_count'))
+    if processed is not None and elapsed > 0:
+        stats['policies_per_second'] = round(processed / elapsed, 1)
+    if profile.enabled:
+        stats['memory'] = profile.summary()
+    print(json.dumps(stats, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
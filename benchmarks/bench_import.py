@@ -0,0 +1,66 @@
+"""
+Import-time benchmark for the agent entry points.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter for
+each entry point and reports the cumulative import time, plus which heavy
+dependencies ended up loaded. Compare against the heavy dependencies alone to
+see what the lazy imports save:
+
+    python benchmarks/bench_import.py
+"""
+import os
+import re
+import subprocess
+import sys
+import json
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = ['agent', 'underwriter', 'render_underwriter', 'read', 'store']
+HEAVY_DEPENDENCIES = ['strands', 'strands_tools', 'strands.models.openai', 'boto3', 'psycopg2', 'requests']
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_import(module: str, runs: int = 5) -> dict:
+    """Best-of-N cumulative import time (microseconds) for a module in a clean interpreter"""
+    best = None
+    loaded = []
+    for _ in range(runs):
+        check = ("import sys, json; import {m}; "
+                 "print(json.dumps([d for d in {deps!r} if d in sys.modules]))").format(
+                     m=module, deps=HEAVY_DEPENDENCIES)
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", check],
+            cwd=REPO_ROOT, capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            return {'module': module, 'error': proc.stderr.strip().splitlines()[-1]}
+
+        cumulative = None
+        for line in proc.stderr.splitlines():
+            match = IMPORTTIME_LINE.match(line)
+            # The top-level entry for the module has no leading indentation
+            if match and match.group(4) == module and len(match.group(3)) == 1:
+                cumulative = int(match.group(2))
+        loaded = json.loads(proc.stdout.strip().splitlines()[-1])
+        if cumulative is not None and (best is None or cumulative < best):
+            best = cumulative
+
+    return {'module': module, 'cumulative_us': best, 'heavy_loaded': loaded}
+
+
+def main():
+    print(f"{'module':<24}{'import (ms)':>12}  heavy dependencies loaded")
+    print("-" * 72)
+    for module in ENTRY_POINTS + HEAVY_DEPENDENCIES:
+        result = measure_import(module)
+        if 'error' in result:
+            print(f"{module:<24}{'n/a':>12}  {result['error']}")
+            continue
+        heavy = ", ".join(d for d in result['heavy_loaded'] if d != module) or "-"
+        print(f"{module:<24}{result['cumulative_us'] / 1000:>12.1f}  {heavy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+End-to-end ingest and chat benchmark against the offline stand-in server.
+
+Starts benchmarks/standin_server.py in a subprocess, points the Federato and
+LLM base URLs at it, then times:
+
+    fetch    agent.fetch_all_policies (token plus the policy book)
+    ingest   agent.get_and_save_all_policies_to_db into DynamoDB, full refresh
+    resync   the same again, where every policy is unchanged
+    chat     --chat-calls chat completions, --chat-concurrency at a time
+
+Runs are reproducible: the book is generated from --seed and no request
+leaves the machine. DynamoDB is the one at DYNAMODB_ENDPOINT_URL.
+
+    python benchmarks/bench_ingest.py --policies 20000 --latency-ms 200 --latency-per-1000-ms 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def start_standin(args) -> subprocess.Popen:
+    command = [sys.executable, os.path.join(ROOT, 'benchmarks', 'standin_server.py'),
+               '--port', str(args.port), '--policies', str(args.policies), '--seed', str(args.seed),
+               '--pagination', args.pagination, '--max-page-size', str(args.max_page_size),
+               '--latency-ms', str(args.latency_ms), '--latency-per-1000-ms', str(args.latency_per_1000_ms),
+               '--error-rate', str(args.error_rate), '--llm-latency-ms', str(args.llm_latency_ms)]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    # The server prints its base URL once the book is generated and it is listening
+    line = server.stdout.readline()
+    if not line.startswith("Stand-in serving"):
+        server.kill()
+        raise RuntimeError(f"Stand-in server did not start: {line}")
+    return server
+
+
+def percentile(values: list, share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def bench_chat(base_url: str, calls: int, concurrency: int) -> dict:
+    import requests
+
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    request = {
+        'model': 'standin',
+        'messages': [{'role': 'user', 'content': "Underwrite all policies"}],
+        'tools': [{'type': 'function', 'function': {'name': 'auto_underwrite_all_policies', 'parameters': {}}}]
+    }
+
+    def call(_):
+        started = time.perf_counter()
+        response = session.post(f"{base_url}/chat/completions", json=request)
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(call, range(calls)))
+    elapsed = time.perf_counter() - started
+    return {'seconds': elapsed, 'calls_per_second': calls / elapsed,
+            'p50_ms': percentile(latencies, 0.5) * 1000, 'p95_ms': percentile(latencies, 0.95) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest and chat against the stand-in server")
+    parser.add_argument('--port', type=int, default=8124)
+    parser.add_argument('--policies', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--pagination', choices=['none', 'offset', 'cursor'], default='none')
+    parser.add_argument('--max-page-size', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--latency-per-1000-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0)
+    parser.add_argument('--table', default='benchIngest', help="DynamoDB policies table")
+    parser.add_argument('--chat-calls', type=int, default=200)
+    parser.add_argument('--chat-concurrency', type=int, default=8)
+    parser.add_argument('--skip', nargs='*', choices=['fetch', 'ingest', 'resync', 'chat'], default=[])
+    args = parser.parse_args()
+
+    base = f"http://127.0.0.1:{args.port}"
+    # agent.py reads its endpoints at import time
+    os.environ['FEDERATO_AUTH_URL'] = base
+    os.environ['FEDERATO_API_URL'] = f"{base}/integrations-api"
+    os.environ['LLM_BASE_URL'] = f"{base}/v1"
+    os.environ['SYNC_STATE_DIR'] = tempfile.mkdtemp(prefix='bench_ingest_')
+    import requests
+    import agent
+
+    server = start_standin(args)
+    try:
+        print(f"policies={args.policies} pagination={args.pagination} latency_ms={args.latency_ms} "
+              f"latency_per_1000_ms={args.latency_per_1000_ms} error_rate={args.error_rate}")
+        print(f"{'operation':<10}{'seconds':>10}{'policies/s':>14}")
+        if 'fetch' not in args.skip:
+            started = time.perf_counter()
+            fetched = len(agent.fetch_all_policies())
+            elapsed = time.perf_counter() - started
+            print(f"{'fetch':<10}{elapsed:>10.3f}{fetched / elapsed:>14,.0f}")
+        for operation, full_refresh in (('ingest', True), ('resync', False)):
+            if operation in args.skip:
+                continue
+            started = time.perf_counter()
+            result = agent.get_and_save_all_policies_to_db(args.table, full_refresh=full_refresh)
+            elapsed = time.perf_counter() - started
+            if result.startswith("Error"):
+                print(f"{operation:<10} {result}")
+                continue
+            print(f"{operation:<10}{elapsed:>10.3f}{args.policies / elapsed:>14,.0f}")
+        if 'chat' not in args.skip:
+            chat = bench_chat(os.environ['LLM_BASE_URL'], args.chat_calls, args.chat_concurrency)
+            print(f"{'chat':<10}{chat['seconds']:>10.3f}{chat['calls_per_second']:>11,.0f} calls/s "
+                  f"| p50 {chat['p50_ms']:.1f} ms | p95 {chat['p95_ms']:.1f} ms")
+        print("server:", json.dumps(requests.get(f"{base}/stats").json()))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
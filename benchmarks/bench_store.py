@@ -0,0 +1,97 @@
+"""
+PolicyStore backend benchmark.
+
+Times the same workload against each store.py backend: bulk_upsert of a
+generated book, a full iter_policies pass, and bulk_write_results of one
+decision per policy. Backends are swappable, so this is the place to
+measure a change to pooling, batching or retries:
+
+    python benchmarks/bench_store.py --backends dynamo postgres --policies 5000
+
+The DynamoDB backend writes to the --table / --results-table tables (created
+if needed); the PostgreSQL backend needs POSTGRES_URL and writes to the
+policies and underwriting_results tables.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import store  # noqa: E402
+
+
+def generate_policies(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    return [{
+        'id': f"BENCH{i:07d}",
+        'line_of_business': rng.choice(['Property', 'Auto', 'Casualty']),
+        'primary_risk_state': rng.choice(['OH', 'PA', 'MD', 'CO', 'CA', 'TX']),
+        'construction_type': rng.choice(['JM', 'Frame', 'Non Combustible', 'Masonry']),
+        'renewal_or_new_business': rng.choice(['NEW BUSINESS', 'RENEWAL']),
+        'tiv': rng.randint(1000000, 200000000),
+        'total_premium': round(rng.uniform(10000, 250000), 2),
+        'oldest_building': rng.randint(1900, 2023),
+        'winnability': rng.randint(0, 100),
+        'loss_value': round(rng.uniform(0, 150000), 2)
+    } for i in range(count)]
+
+
+def bench_backend(policy_store: store.PolicyStore, policies: list, batch_size: int) -> dict:
+    timings = {}
+
+    started = time.perf_counter()
+    errors = []
+    for start in range(0, len(policies), batch_size):
+        errors += policy_store.bulk_upsert(policies[start:start + batch_size])[1]
+    timings['bulk_upsert'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    read = 0
+    for batch, _ in policy_store.iter_policies(batch_size):
+        read += len(batch)
+    timings['iter_policies'] = time.perf_counter() - started
+
+    results = [{'policy': p, 'decision': 'SAFE' if p['winnability'] >= 50 else 'NOT SAFE',
+                'reasoning': 'benchmark', 'rules_version': 'benchmark'} for p in policies]
+    started = time.perf_counter()
+    for start in range(0, len(results), batch_size):
+        policy_store.bulk_write_results(results[start:start + batch_size])
+    timings['bulk_write_results'] = time.perf_counter() - started
+
+    return {'timings': timings, 'read': read, 'errors': len(errors)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PolicyStore backends")
+    parser.add_argument('--backends', nargs='+', choices=['dynamo', 'postgres'], default=['dynamo'])
+    parser.add_argument('--policies', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--table', default='benchPolicies', help="DynamoDB policies table")
+    parser.add_argument('--results-table', default='benchResults', help="DynamoDB results table")
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    policies = generate_policies(args.policies, args.seed)
+    print(f"{'backend':<10}{'operation':<22}{'seconds':>10}{'policies/s':>14}")
+    for backend in args.backends:
+        if backend == 'dynamo':
+            policy_store = store.DynamoPolicyStore(args.table, args.results_table)
+        else:
+            policy_store = store.PostgresPolicyStore()
+            if not policy_store.setup():
+                print(f"{backend:<10}could not set up the database tables")
+                continue
+        with policy_store:
+            result = bench_backend(policy_store, policies, args.batch_size)
+        for operation, elapsed in result['timings'].items():
+            rate = args.policies / elapsed if elapsed else float('inf')
+            print(f"{backend:<10}{operation:<22}{elapsed:>10.3f}{rate:>14,.0f}")
+        print(f"{backend:<10}read back {result['read']} policies, {result['errors']} upsert errors")
+    store.close_postgres_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+Rule-engine fuzzer and benchmark.
+
+Generates random policies clustered around every threshold in rules.txt
+(plus random rule sets around CURRENT_RULE_SET) and runs them through each
+evaluation backend of the rules.txt engine:
+
+    scalar      render_underwriter.apply_underwriting_rules, one dict at a time
+    vectorized  whatif.rule_set_mask over NumPy columns
+    snapshot    the same policies written to and read back from a snapshot,
+                through both the scalar and vectorized paths
+    sqlite      whatif.rule_set_sql_condition on an in-memory SQLite table
+    postgres    the same condition on a temp table (with --postgres and POSTGRES_URL)
+
+Some policies carry a building schedule in raw_data, with construction
+shares around the 50% threshold. The SQL backends get the parsed schedules
+in a side table (see whatif.rule_set_sql_condition), so every policy is
+compared on every backend.
+
+Every backend must return identical decisions; the first mismatches are
+printed and the exit status is 1. Per-backend throughput is reported.
+tests/test_fuzz_rules.py runs the same comparison with a fixed seed.
+
+underwriter.py's engine implements different (older) heuristics rather than
+rules.txt, so it is reported as an agreement rate only, not asserted.
+
+    python benchmarks/fuzz_rules.py --cases 20000 --rule-sets 5 --seed 7
+"""
+import argparse
+import copy
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import render_underwriter  # noqa: E402
+import underwriter  # noqa: E402
+import snapshot  # noqa: E402
+import whatif  # noqa: E402
+from construction import policy_schedule  # noqa: E402
+
+SUBMISSION_TYPES = ['NEW BUSINESS', 'New Business', 'RENEWAL', 'renewal', 'Renewal ', '', 'Unknown']
+LINES_OF_BUSINESS = ['Property', 'PROPERTY', 'Commercial Property', 'property package', 'Auto', 'Casualty', '']
+STATES = ['OH', 'PA', 'MD', 'CO', 'CA', 'FL', 'NC', 'SC', 'GA', 'VA', 'UT', 'TX', 'NY', 'oh', '']
+CONSTRUCTION_TYPES = ['JM', 'Non Combustible', 'Masonry Non Combustible', 'Steel', 'Masonry', 'Concrete',
+                      'Frame', 'Joisted Masonry', 'Wood Frame', 'jm/frame', '']
+
+
+def around(rng: random.Random, bound: float, spread: float, step: float = 1.0) -> float:
+    """A value on, just off, or somewhere near a threshold"""
+    choice = rng.random()
+    if choice < 0.3:
+        return bound
+    if choice < 0.6:
+        return bound + rng.choice([-step, step])
+    return bound + rng.uniform(-spread, spread)
+
+
+def random_policy(rng: random.Random, i: int, rules: dict) -> dict:
+    min_premium, max_premium = rules['premium_range']
+    policy = {
+        'id': f"P{i:07d}",
+        'renewal_or_new_business': rng.choice(SUBMISSION_TYPES),
+        'line_of_business': rng.choice(LINES_OF_BUSINESS),
+        'primary_risk_state': rng.choice(STATES),
+        'construction_type': rng.choice(CONSTRUCTION_TYPES),
+        'tiv': int(max(0, around(rng, rules['max_tiv'], rules['max_tiv'] * 0.5))),
+        'total_premium': round(max(0.0, around(rng, rng.choice([min_premium, max_premium]), 40000, 0.01)), 2),
+        'oldest_building': int(around(rng, rules['min_building_year'], 40)),
+        'winnability': rng.randint(0, 100),
+        'loss_value': round(max(0.0, around(rng, rules['max_loss_value'], 80000, 0.01)), 2)
+    }
+    if rng.random() < 0.2:
+        policy['raw_data'] = {'buildings': random_schedule(rng)}
+    # Sparse items exercise the engines' defaults for missing attributes
+    for field in ('tiv', 'total_premium', 'oldest_building', 'loss_value', 'construction_type'):
+        if rng.random() < 0.03:
+            del policy[field]
+    return policy
+
+
+def random_schedule(rng: random.Random) -> list:
+    """Buildings whose acceptable share lands on, just off, or around 50%"""
+    if rng.random() < 0.2:
+        # Two equal halves: exactly 50%, which is not acceptable
+        tiv = rng.randint(1000000, 5000000)
+        return [{'construction_type': 'JM', 'tiv': tiv}, {'construction_type': 'Frame', 'tiv': tiv}]
+    buildings = []
+    for _ in range(rng.randint(1, 40)):
+        building = {'construction_type': rng.choice(CONSTRUCTION_TYPES), 'tiv': rng.randint(100000, 5000000)}
+        if rng.random() < 0.05:
+            building['tiv'] = None
+        buildings.append(building)
+    if rng.random() < 0.1:
+        # No TIVs at all: weighted by building count
+        for building in buildings:
+            building['tiv'] = 0
+    return buildings
+
+
+def random_rule_set(rng: random.Random, i: int) -> dict:
+    rules = copy.deepcopy(render_underwriter.CURRENT_RULE_SET)
+    rules['name'] = f"fuzz-{i}"
+    rules['max_tiv'] = rng.choice([100000000, 150000000, 200000000])
+    rules['premium_range'] = [rng.choice([40000, 50000, 60000]), rng.choice([150000, 175000, 200000])]
+    rules['min_building_year'] = rng.choice([1980, 1990, 2000])
+    rules['max_loss_value'] = rng.choice([50000, 100000, 150000])
+    rules['acceptable_states'] = rng.sample(STATES[:13], rng.randint(1, 13))
+    rules['acceptable_construction_types'] = rng.sample(
+        render_underwriter.CURRENT_RULE_SET['acceptable_construction_types'], rng.randint(1, 6))
+    rules['declined_submission_types'] = rng.choice([['RENEWAL'], [], ['RENEWAL', 'UNKNOWN']])
+    return rules
+
+
+def to_columns(policies: list) -> dict:
+    """The same columnar layout the snapshot uses"""
+    rows = [snapshot._normalize_row(p) for p in policies]
+    columns = {}
+    for name in snapshot.STRING_COLUMNS:
+        columns[name] = np.array([r[name] for r in rows])
+    for name in snapshot.NUMERIC_COLUMNS:
+        columns[name] = np.array([r[name] for r in rows], dtype=np.float64)
+    return columns
+
+
+def run_scalar(policies, rules):
+    return np.array([render_underwriter.apply_underwriting_rules(p, '', rules)[0] == 'SAFE' for p in policies])
+
+
+def run_vectorized(columns, rule_sets):
+    """Features are extracted once and shared by every rule set, as in whatif.evaluate_rule_sets"""
+    features = whatif.extract_features(columns, len(columns['id']))
+    return [whatif.rule_set_mask(features, rules) for rules in rule_sets]
+
+
+def run_snapshot(policies, rule_sets):
+    """Write the book to a snapshot, then evaluate both paths against the memory map"""
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        snapshot.refresh_snapshot(policies, snapshot_dir, source='fuzz')
+        snap = snapshot.load_snapshot(snapshot_dir)
+        restored = list(snapshot.iter_snapshot_policies(snap))
+        results = {}
+        started = time.perf_counter()
+        results['snapshot-scalar'] = [run_scalar(restored, rules) for rules in rule_sets]
+        scalar_time = time.perf_counter() - started
+        started = time.perf_counter()
+        results['snapshot-vectorized'] = run_vectorized(snap['columns'], rule_sets)
+        vector_time = time.perf_counter() - started
+        del snap
+    return results, {'snapshot-scalar': scalar_time, 'snapshot-vectorized': vector_time}
+
+
+def run_sql(conn, placeholder, policies, rule_sets, table):
+    cursor = conn.cursor()
+    columns = snapshot.SOURCE_COLUMNS
+    schedule_table = f"{table}_schedules"
+    temp = 'TEMP ' if placeholder == '%s' else ''
+    cursor.execute(f"DROP TABLE IF EXISTS {schedule_table}")
+    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute(f"""
+        CREATE {temp}TABLE {table} (
+            id VARCHAR(50) PRIMARY KEY, line_of_business VARCHAR(100), construction_type VARCHAR(50),
+            primary_risk_state VARCHAR(10), renewal_or_new_business VARCHAR(20), tiv BIGINT,
+            total_premium DECIMAL(15,2), oldest_building INTEGER, winnability INTEGER, loss_value DECIMAL(15,2)
+        )
+    """)
+    cursor.execute(f"CREATE {temp}TABLE {schedule_table} (policy_id VARCHAR(50), construction_type TEXT, "
+                   f"weight DOUBLE PRECISION)")
+    cursor.execute(f"CREATE INDEX {schedule_table}_policy ON {schedule_table} (policy_id)")
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join([placeholder] * len(columns))})"
+    cursor.executemany(insert, [tuple(p.get(c) for c in columns) for p in policies])
+    schedule_rows = []
+    for p in policies:
+        schedule = policy_schedule(p)
+        if schedule is not None:
+            schedule_rows += [(p['id'], str(t), float(w)) for t, w in zip(schedule['types'], schedule['weights'])]
+    cursor.executemany(f"INSERT INTO {schedule_table} VALUES ({placeholder}, {placeholder}, {placeholder})",
+                       schedule_rows)
+
+    order = {p['id']: i for i, p in enumerate(policies)}
+    results = []
+    started = time.perf_counter()
+    for rules in rule_sets:
+        condition, params = whatif.rule_set_sql_condition(rules, placeholder, schedule_table)
+        cursor.execute(f"SELECT id, CASE WHEN {condition} THEN 1 ELSE 0 END FROM {table}", params)
+        decisions = np.zeros(len(policies), dtype=bool)
+        for policy_id, safe in cursor.fetchall():
+            decisions[order[policy_id]] = bool(safe)
+        results.append(decisions)
+    elapsed = time.perf_counter() - started
+    cursor.close()
+    return results, elapsed
+
+
+def compare_backends(cases: int, rule_set_count: int, seed: int, postgres: bool = False) -> dict:
+    """
+    Run the fuzz cases through every backend. Returns the policies, rule
+    sets, per-backend decisions and timings, and the mismatches against the
+    scalar engine as (backend, rule set name, policy index, expected, actual).
+    """
+    rng = random.Random(seed)
+    rule_sets = [copy.deepcopy(render_underwriter.CURRENT_RULE_SET)]
+    rule_sets += [random_rule_set(rng, i + 1) for i in range(rule_set_count)]
+    policies = [random_policy(rng, i, rule_sets[0]) for i in range(cases)]
+
+    results, timings = {}, {}
+
+    started = time.perf_counter()
+    results['scalar'] = [run_scalar(policies, rules) for rules in rule_sets]
+    timings['scalar'] = time.perf_counter() - started
+
+    columns = to_columns(policies)
+    started = time.perf_counter()
+    results['vectorized'] = run_vectorized(columns, rule_sets)
+    timings['vectorized'] = time.perf_counter() - started
+
+    snapshot_results, snapshot_timings = run_snapshot(policies, rule_sets)
+    results.update(snapshot_results)
+    timings.update(snapshot_timings)
+
+    conn = sqlite3.connect(":memory:")
+    results['sqlite'], timings['sqlite'] = run_sql(conn, '?', policies, rule_sets, 'fuzz_policies')
+    conn.close()
+
+    if postgres:
+        conn = render_underwriter.get_postgres_connection()
+        try:
+            results['postgres'], timings['postgres'] = run_sql(conn, '%s', policies, rule_sets, 'fuzz_policies')
+        finally:
+            conn.rollback()
+            conn.close()
+
+    mismatches = []
+    for backend, decisions in results.items():
+        if backend == 'scalar':
+            continue
+        for rules, expected, actual in zip(rule_sets, results['scalar'], decisions):
+            for i in np.flatnonzero(expected != actual):
+                mismatches.append((backend, rules['name'], int(i), bool(expected[i]), bool(actual[i])))
+    return {'policies': policies, 'rule_sets': rule_sets, 'results': results, 'timings': timings,
+            'mismatches': mismatches}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzz and benchmark the rule-engine backends")
+    parser.add_argument('--cases', type=int, default=20000)
+    parser.add_argument('--rule-sets', type=int, default=5, help="Random rule sets besides the current one")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--postgres', action='store_true', help="Also run the SQL backend on POSTGRES_URL")
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+    evaluations = args.cases * (args.rule_sets + 1)
+    print(f"seed={seed} cases={args.cases} rule_sets={args.rule_sets + 1}")
+    run = compare_backends(args.cases, args.rule_sets, seed, args.postgres)
+    policies = run['policies']
+
+    print(f"\n{'backend':<22}{'seconds':>10}{'policies/s':>14}")
+    for backend, elapsed in run['timings'].items():
+        print(f"{backend:<22}{elapsed:>10.3f}{evaluations / elapsed if elapsed else float('inf'):>14,.0f}")
+
+    shown = {}
+    for backend, rule_set_name, i, expected, actual in run['mismatches']:
+        shown[backend, rule_set_name] = shown.get((backend, rule_set_name), 0) + 1
+        if shown[backend, rule_set_name] > 3:
+            continue
+        print(f"\nMISMATCH {backend} vs scalar on rule set {rule_set_name}: "
+              f"scalar={'SAFE' if expected else 'NOT SAFE'} {backend}={'SAFE' if actual else 'NOT SAFE'}")
+        print(f"  policy: {policies[i]}")
+
+    # Legacy heuristics engine: informational only
+    legacy = np.array([underwriter.apply_underwriting_rules(underwriter.convert_decimals(p), '')[0] == 'SAFE'
+                       for p in policies])
+    agreement = (legacy == run['results']['scalar'][0]).mean() * 100
+    print(f"\nunderwriter.py (legacy heuristics) agrees with rules.txt engine on {agreement:.1f}% of policies")
+
+    if run['mismatches']:
+        print(f"\nFAILED: {len(run['mismatches'])} mismatched decisions (seed={seed})")
+        return 1
+    print(f"\nOK: all backends agree on {evaluations:,} decisions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
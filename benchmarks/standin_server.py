@@ -0,0 +1,341 @@
+"""
+Offline stand-in for the external services the agents call.
+
+Serves the three endpoints with generated data, so ingest and the agent loops
+can be load tested without the network:
+
+    POST /oauth/token                                  Auth0 client credentials
+    POST /integrations-api/handlers/all-pollicies      Federato policy book
+    POST .../chat/completions                          OpenAI-compatible chat (Cohere)
+    GET  /stats                                        requests served so far
+
+The book is --policies generated policies (deterministic for a --seed). With
+--pagination none the whole book comes back in one response, as from the
+live API; with offset or cursor, limit/offset/cursor parameters (query
+string or JSON body) select a page, capped at --max-page-size:
+
+    {"output": [{"data": [...], "total_count": 100000, "next_cursor": "500"}]}
+
+offset mode reports total_count, cursor mode only next_cursor (null on the
+last page). --latency-ms delays every response, --latency-per-1000-ms adds
+transfer time per 1000 policies returned and --error-rate fails that share of
+policy requests with a 503.
+
+Chat completions answer with canned tool calls: a user message gets a call
+to the offered tool whose name best matches its words, a tool result gets a
+short text answer, and second-opinion review prompts get AGREE for every
+policy. Both plain and streamed (SSE) responses are supported.
+
+    python benchmarks/standin_server.py --port 8124 --policies 20000 --pagination offset
+
+then, for the agents and batch jobs:
+
+    FEDERATO_AUTH_URL=http://localhost:8124
+    FEDERATO_API_URL=http://localhost:8124/integrations-api
+    LLM_BASE_URL=http://localhost:8124/v1
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+POLICIES_PATH = '/integrations-api/handlers/all-pollicies'
+PAGINATION_MODES = ['none', 'offset', 'cursor']
+POLICY_ID_PATTERN = re.compile(r'"policy_id"\s*:\s*"([^"]+)"')
+
+
+def generate_policy(index: int, seed: int) -> dict:
+    """Policy number index of the book; the same for a given seed on every call"""
+    rng = random.Random(seed * 1000003 + index)
+    year = rng.randint(2023, 2026)
+    policy = {
+        'id': f"POL{index:08d}",
+        'account_name': f"Account {index}",
+        'line_of_business': rng.choice(['Property', 'Property', 'Property', 'Auto', 'Casualty']),
+        'primary_risk_state': rng.choice(['OH', 'PA', 'MD', 'CO', 'CA', 'FL', 'NC', 'GA', 'TX', 'NY']),
+        'construction_type': rng.choice(['JM', 'Frame', 'Non Combustible', 'Masonry', 'Steel']),
+        'renewal_or_new_business': rng.choice(['NEW BUSINESS', 'NEW BUSINESS', 'RENEWAL']),
+        'tiv': rng.randint(1000000, 200000000),
+        'total_premium': round(rng.uniform(20000, 250000), 2),
+        'oldest_building': rng.randint(1950, 2023),
+        'winnability': rng.randint(0, 100),
+        'loss_value': round(rng.uniform(0, 150000), 2),
+        'created_at': f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T00:00:00Z",
+        'effective_date': f"{year}-{rng.randint(1, 12):02d}-01",
+        'expiration_date': f"{year + 1}-{rng.randint(1, 12):02d}-01"
+    }
+    if rng.random() < 0.2:
+        policy['buildings'] = [{'construction_type': rng.choice(['JM', 'Frame', 'Masonry', 'Steel']),
+                                'tiv': rng.randint(100000, 20000000)} for _ in range(rng.randint(2, 12))]
+    return policy
+
+
+class StandinState:
+    """The generated book, issued tokens and request counters, shared by all handler threads"""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.stats = {'token': 0, 'policies': 0, 'policy_rows': 0, 'policy_errors': 0, 'chat': 0,
+                      'unauthorized': 0, 'bytes': 0}
+        # Policies are serialized once, so a page costs a join, not a json.dumps per policy
+        self.policy_json = [json.dumps(generate_policy(i, args.seed)) for i in range(args.policies)]
+
+    def count(self, key: str, amount: int = 1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def issue_token(self) -> str:
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = time.time() + self.args.token_ttl
+        return token
+
+    def valid_token(self, header: str) -> bool:
+        token = header[len('Bearer '):] if header.startswith('Bearer ') else ''
+        with self.lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            return self.rng.random() < self.args.error_rate
+
+
+def _pick_tool(tools: list, text: str):
+    """Name of the offered tool sharing the most words with text, or None"""
+    words = set(re.findall(r'[a-z]+', text.lower()))
+    best, best_score = None, 0
+    for entry in tools:
+        name = (entry.get('function') or {}).get('name', '')
+        score = sum(1 for part in name.lower().split('_') if len(part) > 3 and part.rstrip('s') in
+                    {w.rstrip('s') for w in words})
+        if score > best_score:
+            best, best_score = name, score
+    return best
+
+
+def _message_text(message: dict) -> str:
+    content = message.get('content') or ''
+    if isinstance(content, list):
+        content = ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content
+
+
+def canned_reply(request: dict) -> dict:
+    """The assistant message for a chat request: {'content': ...} or {'tool_call': {...}}"""
+    messages = request.get('messages') or [{}]
+    last = messages[-1]
+    text = _message_text(last)
+    if last.get('role') == 'tool':
+        return {'content': f"Done. {text[:500]}"}
+    tool = _pick_tool(request.get('tools') or [], text)
+    if tool:
+        return {'tool_call': {'id': f"call_{uuid.uuid4().hex[:12]}", 'name': tool, 'arguments': '{}'}}
+    policy_ids = POLICY_ID_PATTERN.findall(text)
+    if policy_ids:
+        return {'content': json.dumps([{'policy_id': policy_id, 'opinion': 'AGREE', 'note': 'Stand-in review'}
+                                       for policy_id in policy_ids])}
+    return {'content': "Stand-in answer: no tool matched the request."}
+
+
+def _usage(request: dict, reply: dict) -> dict:
+    prompt_tokens = sum(len(_message_text(m)) for m in request.get('messages') or []) // 4 + 1
+    completion_tokens = len(json.dumps(reply)) // 4 + 1
+    return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens}
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; without this, delayed ACKs add ~40ms per response
+    disable_nagle_algorithm = True
+    server_version = 'StandinServer/1.0'
+
+    @property
+    def state(self) -> StandinState:
+        return self.server.state
+
+    def log_message(self, format, *args):
+        if self.state.args.verbose:
+            super().log_message(format, *args)
+
+    def _body(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+        return body if isinstance(body, dict) else {}
+
+    def _send(self, status: int, payload: bytes, content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        self.state.count('bytes', len(payload))
+
+    def _send_json(self, status: int, data):
+        self._send(status, json.dumps(data).encode('utf-8'))
+
+    def _delay(self, extra_seconds: float = 0.0):
+        seconds = self.state.args.latency_ms / 1000 + extra_seconds
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/stats':
+            with self.state.lock:
+                self._send_json(200, dict(self.state.stats))
+        else:
+            self._send_json(404, {'error': f"No route {self.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self._body()
+        if url.path == '/oauth/token':
+            self._token(body)
+        elif url.path == POLICIES_PATH:
+            self._policies(parse_qs(url.query), body)
+        elif url.path.endswith('/chat/completions'):
+            self._chat(body)
+        else:
+            self._send_json(404, {'error': f"No route {url.path}"})
+
+    def _token(self, body: dict):
+        self.state.count('token')
+        self._delay()
+        if body.get('grant_type') != 'client_credentials' or not body.get('client_id'):
+            self._send_json(401, {'error': 'access_denied', 'error_description': 'Unauthorized'})
+            return
+        self._send_json(200, {'access_token': self.state.issue_token(), 'token_type': 'Bearer',
+                              'expires_in': self.state.args.token_ttl})
+
+    def _policies(self, query: dict, body: dict):
+        args = self.state.args
+        if not self.state.valid_token(self.headers.get('Authorization', '')):
+            self.state.count('unauthorized')
+            self._send_json(401, {'message': 'Unauthorized'})
+            return
+        if self.state.should_fail():
+            self.state.count('policy_errors')
+            self._delay()
+            self._send_json(503, {'message': 'Service Unavailable'})
+            return
+
+        def param(name):
+            value = body.get(name, query.get(name, [None])[0])
+            return None if value in (None, '') else str(value)
+
+        book = self.state.policy_json
+        page = {}
+        if args.pagination == 'none' or param('limit') is None:
+            start, end = 0, len(book)
+        else:
+            limit = max(1, min(int(param('limit')), args.max_page_size))
+            position = param('cursor') if args.pagination == 'cursor' else param('offset')
+            start = max(0, int(position or 0))
+            end = min(start + limit, len(book))
+            if args.pagination == 'offset':
+                page['total_count'] = len(book)
+            else:
+                page['next_cursor'] = str(end) if end < len(book) else None
+        self.state.count('policies')
+        self.state.count('policy_rows', end - start)
+        self._delay(args.latency_per_1000_ms / 1000 * (end - start) / 1000)
+        # The data array comes first, as agent.iter_streamed_policies expects
+        extra = ''.join(f', {json.dumps(key)}: {json.dumps(value)}' for key, value in page.items())
+        payload = f'{{"output": [{{"data": [{", ".join(book[start:end])}]{extra}}}]}}'
+        self._send(200, payload.encode('utf-8'))
+
+    def _chat(self, request: dict):
+        self.state.count('chat')
+        time.sleep(self.state.args.llm_latency_ms / 1000)
+        reply = canned_reply(request)
+        usage = _usage(request, reply)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:16]}"
+        model = request.get('model', 'standin')
+        created = int(time.time())
+        finish_reason = 'tool_calls' if 'tool_call' in reply else 'stop'
+        if 'tool_call' in reply:
+            call = reply['tool_call']
+            message = {'role': 'assistant', 'content': None, 'tool_calls': [{
+                'id': call['id'], 'type': 'function',
+                'function': {'name': call['name'], 'arguments': call['arguments']}}]}
+        else:
+            message = {'role': 'assistant', 'content': reply['content']}
+
+        if not request.get('stream'):
+            self._send_json(200, {'id': completion_id, 'object': 'chat.completion', 'created': created,
+                                  'model': model, 'usage': usage,
+                                  'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}]})
+            return
+
+        def chunk(choices, **fields):
+            return {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created,
+                    'model': model, 'choices': choices, **fields}
+
+        if 'tool_call' in reply:
+            delta = {'role': 'assistant', 'tool_calls': [{'index': 0, **message['tool_calls'][0]}]}
+        else:
+            delta = {'role': 'assistant', 'content': reply['content']}
+        events = [chunk([{'index': 0, 'delta': delta, 'finish_reason': None}]),
+                  chunk([{'index': 0, 'delta': {}, 'finish_reason': finish_reason}])]
+        if (request.get('stream_options') or {}).get('include_usage'):
+            events.append(chunk([], usage=usage))
+        payload = ''.join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+        self._send(200, payload.encode('utf-8'), 'text/event-stream')
+
+
+def make_server(args) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((args.host, args.port), StandinHandler)
+    server.daemon_threads = True
+    server.state = StandinState(args)
+    return server
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Offline stand-in for Auth0, Federato and the chat completions API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8124)
+    parser.add_argument('--policies', type=int, default=10000, help="book size")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--pagination', choices=PAGINATION_MODES, default='none')
+    parser.add_argument('--max-page-size', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="added to every Auth0/Federato response")
+    parser.add_argument('--latency-per-1000-ms', type=float, default=0.0,
+                        help="transfer time per 1000 policies returned")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of policy requests failing with 503")
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0)
+    parser.add_argument('--token-ttl', type=int, default=86400, help="seconds an issued token stays valid")
+    parser.add_argument('--verbose', action='store_true', help="log every request")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    server = make_server(args)
+    base = f"http://{args.host}:{server.server_address[1]}"
+    print(f"Stand-in serving {args.policies} policies ({args.pagination} pagination) on {base}")
+    print(f"FEDERATO_AUTH_URL={base}")
+    print(f"FEDERATO_API_URL={base}/integrations-api")
+    print(f"LLM_BASE_URL={base}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import os
+import json
+import logging
+from datetime import datetime
+from typing import Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+# Progress of long-running jobs, one JSON file per job name
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", ".checkpoints")
+
+
+def _checkpoint_path(job: str, checkpoint_dir: str) -> str:
+    safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in job)
+    return os.path.join(checkpoint_dir, f"{safe_name}.json")
+
+
+def load_checkpoint(job: str, checkpoint_dir: str = CHECKPOINT_DIR) -> Optional[Dict]:
+    """Return the saved state for a job, or None if it has no checkpoint"""
+    path = _checkpoint_path(job, checkpoint_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(job: str, state: Dict, checkpoint_dir: str = CHECKPOINT_DIR):
+    """Atomically persist the state for a job"""
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = _checkpoint_path(job, checkpoint_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({**state, 'saved_at': datetime.now().isoformat()}, f, default=str)
+    os.replace(tmp_path, path)
+
+
+def clear_checkpoint(job: str, checkpoint_dir: str = CHECKPOINT_DIR):
+    """Remove a job's checkpoint once it has completed"""
+    path = _checkpoint_path(job, checkpoint_dir)
+    if os.path.exists(path):
+        os.remove(path)
+        logger.info(f"Cleared checkpoint for {job}")
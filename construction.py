@@ -0,0 +1,209 @@
+"""
+Construction mix of a policy from its building schedule.
+
+rules.txt accepts a policy when more than 50% of its construction is JM, Non
+Combustible/Steel or Masonry Non Combustible. Policies carry a building (or
+location) schedule in raw_data; the single construction_type column only
+describes one of the buildings.
+
+The schedule is reduced to one weight per distinct construction type: the
+construction and TIV of every building are pulled into NumPy arrays, the
+types are factorized with np.unique and the TIVs summed per type with
+np.bincount. The acceptable share for a rule set then only looks at the
+distinct types, so accounts with thousands of locations cost one pass over
+the schedule. Schedules whose buildings carry no TIV are weighted by
+building count instead.
+
+Parsed schedules are cached per policy version (id plus updated_at, or a
+digest of raw_data when it is a JSON string), so scoring the same policy
+against several rule sets, or again in a later run of the same process,
+does not walk the schedule again.
+
+Accepted layouts, under any of SCHEDULE_KEYS in raw_data or in the item
+itself:
+
+    [{"construction_type": "JM", "tiv": 1200000}, ...]       one record per building
+    [{"buildings": [{...}, ...]}, ...]                         locations holding buildings
+    {"construction_type": ["JM", ...], "tiv": [1200000, ...]}  parallel arrays
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_KEYS = ['buildings', 'locations', 'building_schedule', 'schedule_of_values', 'sov']
+CONSTRUCTION_KEYS = ['construction_type', 'construction', 'construction_class']
+TIV_KEYS = ['tiv', 'total_insured_value', 'building_tiv', 'insured_value']
+# Pre-aggregated schedule, as stored in the snapshot's construction_mix column
+MIX_FIELD = 'construction_mix'
+SCHEDULE_CACHE_SIZE = int(os.getenv("SCHEDULE_CACHE_SIZE", 4096))
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _first_key(record: dict, keys: Iterable[str]) -> Optional[str]:
+    return next((key for key in keys if key in record), None)
+
+
+def _as_float_array(values: list) -> np.ndarray:
+    """TIVs as float64, missing or unparseable ones as 0"""
+    try:
+        tivs = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        tivs = np.empty(len(values), dtype=np.float64)
+        for i, value in enumerate(values):
+            try:
+                tivs[i] = float(str(value).replace(',', '').replace('$', ''))
+            except (TypeError, ValueError):
+                tivs[i] = np.nan
+    return np.where(np.isfinite(tivs) & (tivs > 0), tivs, 0.0)
+
+
+def _schedule_arrays(raw_schedule) -> Optional[tuple]:
+    """(construction labels, TIVs) of every building, or None if raw_schedule is not a schedule"""
+    if isinstance(raw_schedule, dict):
+        construction_key = _first_key(raw_schedule, CONSTRUCTION_KEYS)
+        constructions = raw_schedule.get(construction_key) if construction_key else None
+        if not isinstance(constructions, list):
+            return None
+        tiv_key = _first_key(raw_schedule, TIV_KEYS)
+        tivs = raw_schedule.get(tiv_key) if tiv_key else None
+        if not isinstance(tivs, list) or len(tivs) != len(constructions):
+            tivs = [0] * len(constructions)
+        return constructions, tivs
+
+    if not isinstance(raw_schedule, list):
+        return None
+    records = [record for record in raw_schedule if isinstance(record, dict)]
+    if records and 'buildings' in records[0]:
+        # Locations holding their buildings
+        records = [building for location in records for building in location.get('buildings') or []
+                   if isinstance(building, dict)]
+    if not records:
+        return None
+    construction_key = _first_key(records[0], CONSTRUCTION_KEYS)
+    if construction_key is None:
+        return None
+    tiv_key = _first_key(records[0], TIV_KEYS) or TIV_KEYS[0]
+    return [record.get(construction_key) for record in records], [record.get(tiv_key) for record in records]
+
+
+def parse_schedule(raw_schedule) -> Optional[Dict]:
+    """
+    Aggregate a building schedule into {'types', 'weights', 'buildings',
+    'weighting'}: the distinct lowercased construction types, the TIV (or
+    building count) of each, the number of buildings and which of the two
+    the weights are. None if raw_schedule holds no buildings.
+    """
+    arrays = _schedule_arrays(raw_schedule)
+    if arrays is None or not arrays[0]:
+        return None
+    constructions, tivs = arrays
+    # Factorize the raw labels first, so lowercasing and stripping only touch the distinct ones
+    raw_types, raw_inverse = np.unique(np.array(['' if c is None else str(c) for c in constructions]),
+                                       return_inverse=True)
+    types, type_inverse = np.unique(np.char.lower(np.char.strip(raw_types)), return_inverse=True)
+    inverse = type_inverse[raw_inverse]
+    tiv_values = _as_float_array(tivs)
+    weighting = 'tiv' if tiv_values.sum() > 0 else 'count'
+    weights = np.bincount(inverse, weights=tiv_values if weighting == 'tiv' else None,
+                          minlength=len(types)).astype(np.float64)
+    return {'types': types, 'weights': weights, 'buildings': len(inverse), 'weighting': weighting}
+
+
+def schedule_from_mix(mix) -> Optional[Dict]:
+    """Schedule from its mix_json form (a JSON string or the decoded dict)"""
+    if isinstance(mix, str):
+        mix = json.loads(mix) if mix else None
+    if not mix or not mix.get('types'):
+        return None
+    types = sorted(mix['types'])
+    return {
+        'types': np.array(types),
+        'weights': np.array([mix['types'][t] for t in types], dtype=np.float64),
+        'buildings': int(mix.get('buildings', 0)),
+        'weighting': mix.get('weighting', 'tiv')
+    }
+
+
+def mix_json(schedule: Optional[Dict]) -> str:
+    """Compact, deterministic form of a parsed schedule; '' when there is none"""
+    if schedule is None:
+        return ''
+    return json.dumps({
+        'types': {str(t): float(w) for t, w in zip(schedule['types'], schedule['weights'])},
+        'buildings': schedule['buildings'],
+        'weighting': schedule['weighting']
+    }, sort_keys=True, separators=(',', ':'))
+
+
+def _raw_source(policy: dict):
+    """raw_data decoded when needed, falling back to the item itself (DynamoDB items are the raw policy)"""
+    raw_data = policy.get('raw_data')
+    if isinstance(raw_data, str):
+        try:
+            raw_data = json.loads(raw_data)
+        except ValueError:
+            raw_data = None
+    return raw_data if isinstance(raw_data, dict) else policy
+
+
+def _cache_key(policy: dict) -> Optional[tuple]:
+    policy_id = policy.get('id')
+    if policy_id is None:
+        return None
+    if policy.get('updated_at') is not None:
+        return str(policy_id), str(policy['updated_at'])
+    raw_data = policy.get('raw_data') or policy.get(MIX_FIELD)
+    if isinstance(raw_data, str) and raw_data:
+        return str(policy_id), hashlib.blake2b(raw_data.encode('utf-8'), digest_size=16).hexdigest()
+    # Items without a version cannot be told apart from a changed copy, so they are not cached
+    return None
+
+
+def _parse_policy(policy: dict) -> Optional[Dict]:
+    if policy.get(MIX_FIELD):
+        return schedule_from_mix(policy[MIX_FIELD])
+    source = _raw_source(policy)
+    for key in SCHEDULE_KEYS:
+        if key in source:
+            schedule = parse_schedule(source[key])
+            if schedule is not None:
+                return schedule
+    return None
+
+
+def policy_schedule(policy: dict) -> Optional[Dict]:
+    """Parsed schedule of a policy (cached per policy version), or None if it carries none"""
+    key = _cache_key(policy)
+    if key is not None:
+        with _cache_lock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                return _cache[key]
+    schedule = _parse_policy(policy)
+    if key is not None:
+        with _cache_lock:
+            _cache[key] = schedule
+            while len(_cache) > SCHEDULE_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return schedule
+
+
+def acceptable_share(schedule: Dict, acceptable_types: Iterable[str]) -> float:
+    """Share of the schedule's weight whose construction matches one of acceptable_types"""
+    total = schedule['weights'].sum()
+    if total <= 0:
+        return 0.0
+    acceptable_types = [t.lower() for t in acceptable_types]
+    acceptable = np.fromiter((any(t in str(label) for t in acceptable_types) for label in schedule['types']),
+                             dtype=bool, count=len(schedule['types']))
+    return float(schedule['weights'][acceptable].sum() / total)
@@ -0,0 +1,109 @@
+"""
+Lean DynamoDB scans for the rule engines.
+
+The boto3 resource API turns every number into a Decimal, which
+convert_decimals then walks again. Here scans go through the low-level
+client and typed attribute values are converted straight into the native
+types the engines use: numbers become floats, as convert_decimals would
+produce, except integral ones, which stay ints so that a numeric id reads
+back as "5" and not "5.0". A ProjectionExpression limits the scan to the attributes a
+caller needs, so less is sent over the wire and deserialized.
+
+Scans are paced by the table's CapacityController (see throughput.py).
+"""
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from throughput import get_controller
+from store import get_dynamodb_client
+
+logger = logging.getLogger(__name__)
+
+
+def deserialize_number(raw: str):
+    """A DynamoDB number string as an int when it is integral, else a float"""
+    if '.' in raw or 'e' in raw or 'E' in raw:
+        return float(raw)
+    return int(raw)
+
+
+def deserialize_value(value: dict):
+    """One typed attribute value ({'N': '12'}, {'S': 'x'}, ...) as a native Python value"""
+    (type_code, raw), = value.items()
+    if type_code == 'S':
+        return raw
+    if type_code == 'N':
+        return deserialize_number(raw)
+    if type_code == 'BOOL':
+        return raw
+    if type_code == 'NULL':
+        return None
+    if type_code == 'M':
+        return {k: deserialize_value(v) for k, v in raw.items()}
+    if type_code == 'L':
+        return [deserialize_value(v) for v in raw]
+    if type_code == 'SS':
+        return set(raw)
+    if type_code == 'NS':
+        return {deserialize_number(v) for v in raw}
+    if type_code == 'B':
+        return raw
+    if type_code == 'BS':
+        return set(raw)
+    raise ValueError(f"Unknown DynamoDB attribute type: {type_code}")
+
+
+def deserialize_item(item: dict) -> dict:
+    return {k: deserialize_value(v) for k, v in item.items()}
+
+
+def typed_key(key: Optional[dict]) -> Optional[dict]:
+    """
+    ExclusiveStartKey for the low-level client. Checkpoints written by the
+    resource API hold plain values; those are converted to typed ones.
+    """
+    if not key:
+        return key
+    typed = {}
+    for name, value in key.items():
+        if isinstance(value, dict) and len(value) == 1 and next(iter(value)) in ('S', 'N', 'B'):
+            typed[name] = value
+        elif isinstance(value, str):
+            typed[name] = {'S': value}
+        elif isinstance(value, float) and value.is_integer():
+            typed[name] = {'N': str(int(value))}
+        else:
+            typed[name] = {'N': str(value)}
+    return typed
+
+
+def projection_kwargs(fields: Optional[List[str]]) -> Dict:
+    """ProjectionExpression for fields, with name placeholders so reserved words are safe"""
+    if not fields:
+        return {}
+    names = {f"#f{i}": field for i, field in enumerate(fields)}
+    return {'ProjectionExpression': ", ".join(names), 'ExpressionAttributeNames': names}
+
+
+def scan_pages(table, fields: Optional[List[str]] = None, batch_size: int = 500,
+               start_key: Optional[dict] = None, segment: Optional[int] = None, total_segments: int = 1,
+               client=None) -> Iterator[Tuple[List[dict], Optional[dict]]]:
+    """
+    Yield (items, last_evaluated_key) one scan page at a time, items as native
+    dicts limited to fields (all attributes when fields is None). The keys are
+    typed and JSON-serializable, ready to be checkpointed.
+    """
+    client = client or get_dynamodb_client()
+    controller = get_controller(table)
+    scan_kwargs = {'Limit': batch_size, **projection_kwargs(fields)}
+    if total_segments > 1:
+        scan_kwargs.update(Segment=segment, TotalSegments=total_segments)
+    if start_key:
+        scan_kwargs['ExclusiveStartKey'] = typed_key(start_key)
+    while True:
+        response = controller.scan_client(client, **scan_kwargs)
+        last_key = response.get('LastEvaluatedKey')
+        yield [deserialize_item(item) for item in response['Items']], last_key
+        if not last_key:
+            break
+        scan_kwargs['ExclusiveStartKey'] = last_key
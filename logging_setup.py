@@ -0,0 +1,120 @@
+"""
+Shared logging setup for the agents and batch jobs.
+
+Records are handed to a QueueHandler and written by a background
+QueueListener, so the per-policy loops never block on console or disk I/O.
+Log files rotate at a fixed size instead of growing without bound.
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+
+_listener = None
+
+
+def setup_logging(log_file: Optional[str] = None, level: int = logging.INFO, console: bool = True,
+                  console_stream=None) -> logging.handlers.QueueListener:
+    """
+    Route the root logger through a queue to a rotating file and the console.
+    Safe to call more than once; later calls replace the previous setup.
+    """
+    global _listener
+    stop_logging()
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+    if log_file:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    if console:
+        stream_handler = logging.StreamHandler(console_stream or sys.stderr)
+        stream_handler.setFormatter(formatter)
+        handlers.append(stream_handler)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the background writer"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+class PolicyErrorLog:
+    """
+    Rate-limited logging for per-policy errors. At most max_per_interval errors
+    are logged per interval_seconds; the rest are only counted. log_summary()
+    reports the totals per error type at the end of the run.
+    """
+
+    def __init__(self, logger: logging.Logger, max_per_interval: int = 10, interval_seconds: float = 10.0):
+        self.logger = logger
+        self.max_per_interval = max_per_interval
+        self.interval_seconds = interval_seconds
+        self.window_start = time.monotonic()
+        self.logged_in_window = 0
+        self.suppressed = 0
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def error(self, message: str, exc: Optional[BaseException] = None):
+        with self.lock:
+            self.counts[type(exc).__name__ if exc is not None else 'Error'] += 1
+
+            now = time.monotonic()
+            if now - self.window_start >= self.interval_seconds:
+                if self.suppressed:
+                    self.logger.warning(f"{self.suppressed} policy errors suppressed in the last "
+                                        f"{self.interval_seconds:.0f}s")
+                self.window_start = now
+                self.logged_in_window = 0
+                self.suppressed = 0
+
+            if self.logged_in_window < self.max_per_interval:
+                self.logged_in_window += 1
+                log = True
+            else:
+                self.suppressed += 1
+                log = False
+        if log:
+            self.logger.error(message)
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def log_summary(self):
+        if not self.counts:
+            return
+        breakdown = ", ".join(f"{name}: {count}" for name, count in self.counts.most_common())
+        self.logger.error(f"{self.total} policy errors in this run ({breakdown})")
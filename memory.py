@@ -0,0 +1,298 @@
+"""
+Memory instrumentation and the memory budget for large book runs.
+
+MemoryProfile samples the process RSS on a background thread and, with
+trace=True, takes tracemalloc snapshots around named stages, recording each
+stage's traced peak and the source lines that grew the most. Its summary is
+appended to the run summaries:
+
+    with MemoryProfile() as profile:
+        with profile.stage('underwrite'):
+            ...
+    summary += profile.format_summary()
+
+max_memory_mb (or MAX_MEMORY_MB in the environment) is the budget for a
+run. Paths that would hold the whole book in memory estimate its size first
+and switch to their streaming or chunked variant when the current RSS plus
+the estimate would exceed the budget. When the size cannot be estimated
+they stream as well, and budget_note gives the line their summary reports
+it with.
+"""
+import os
+import time
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_MEMORY_MB = float(os.environ["MAX_MEMORY_MB"]) if os.getenv("MAX_MEMORY_MB") else None
+# Rough in-memory size of Python dicts and strings relative to their stored
+# or JSON-encoded size
+PYTHON_EXPANSION = 4.0
+DEFAULT_ITEM_BYTES = 2048
+SAMPLE_SECONDS = 0.5
+TOP_ALLOCATIONS = 3
+
+# tracemalloc is process-wide while profiles are per job: tracing is
+# reference-counted across profiles, and the traced peak is only reset by
+# a stage that starts while no other stage is open
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_owns_tracing = False
+_open_stages = 0
+_stage_starts = 0
+
+
+def _start_tracing():
+    global _tracing_users, _owns_tracing
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _owns_tracing = True
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    global _tracing_users, _owns_tracing
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _owns_tracing:
+            tracemalloc.stop()
+            _owns_tracing = False
+
+
+def _open_stage() -> tuple:
+    """(starts so far, whether this stage reset the traced peak)"""
+    global _open_stages, _stage_starts
+    with _tracing_lock:
+        sole = _open_stages == 0
+        if sole:
+            tracemalloc.reset_peak()
+        _open_stages += 1
+        _stage_starts += 1
+        return _stage_starts, sole
+
+
+def _close_stage(starts: int, sole: bool) -> bool:
+    """True when the traced peak covers only this stage: it reset the peak and no stage started since"""
+    global _open_stages
+    with _tracing_lock:
+        _open_stages -= 1
+        return sole and _stage_starts == starts
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1048576
+    except (OSError, ValueError, IndexError):
+        # No /proc (macOS, Windows): fall back to the peak, which is what the budget cares about
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1048576 if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+def budget_mb(max_memory_mb: Optional[float] = None) -> Optional[float]:
+    return max_memory_mb if max_memory_mb is not None else MAX_MEMORY_MB
+
+
+def would_exceed(estimated_mb: Optional[float], max_memory_mb: Optional[float] = None) -> bool:
+    """
+    True when holding estimated_mb more would take the process over the
+    budget. An unknown estimate counts as exceeding whenever a budget is set.
+    """
+    budget = budget_mb(max_memory_mb)
+    if budget is None:
+        return False
+    if estimated_mb is None:
+        logger.warning(f"Size estimate unavailable, streaming to stay within the {budget:.0f} MB budget")
+        return True
+    exceeds = rss_mb() + estimated_mb > budget
+    if exceeds:
+        logger.info(f"Book of ~{estimated_mb:.0f} MB would exceed the {budget:.0f} MB budget, streaming instead")
+    return exceeds
+
+
+def budget_note(estimated_mb: Optional[float], max_memory_mb: Optional[float] = None) -> str:
+    """Summary line for a run that streamed only because its size could not be estimated"""
+    budget = budget_mb(max_memory_mb)
+    if budget is None or estimated_mb is not None:
+        return ""
+    return f"\nMemory budget: size estimate unavailable, streamed to stay within {budget:.0f} MB\n"
+
+
+def estimate_dynamodb_mb(table) -> Optional[float]:
+    """In-memory size of a table's items once loaded, from its (approximate) size in DynamoDB"""
+    try:
+        description = table.meta.client.describe_table(TableName=table.name)['Table']
+    except Exception as e:
+        logger.warning(f"Could not describe {table.name} to estimate its size: {e}")
+        return None
+    size_bytes = description.get('TableSizeBytes') or description.get('ItemCount', 0) * DEFAULT_ITEM_BYTES
+    return size_bytes * PYTHON_EXPANSION / 1048576
+
+
+def estimate_postgres_mb(conn, table: str = 'policies') -> Optional[float]:
+    """In-memory size of a table's rows once loaded, from its heap size"""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_table_size(to_regclass(%s))", (table,))
+            size_bytes = cursor.fetchone()[0]
+    except Exception as e:
+        logger.warning(f"Could not read the size of {table}: {e}")
+        conn.rollback()
+        return None
+    return None if size_bytes is None else size_bytes * PYTHON_EXPANSION / 1048576
+
+
+def estimate_snapshot_mb(snapshot: dict) -> float:
+    """In-memory size of a loaded snapshot's rows as policy dicts, from its row count and column widths"""
+    row_bytes = sum(column.dtype.itemsize for column in snapshot['columns'].values())
+    return snapshot['manifest']['row_count'] * row_bytes * PYTHON_EXPANSION / 1048576
+
+
+def estimate_json_mb(content_length: Optional[int]) -> Optional[float]:
+    """In-memory size of a decoded JSON body from its length; None if the length is unknown"""
+    return content_length * PYTHON_EXPANSION / 1048576 if content_length else None
+
+
+class MemoryProfile:
+    """
+    RSS samples for the whole run plus per-stage tracemalloc figures. With
+    enabled=False every method is a no-op, so callers can wrap their stages
+    unconditionally.
+    """
+
+    def __init__(self, enabled: bool = True, trace: bool = True, sample_seconds: float = SAMPLE_SECONDS,
+                 top: int = TOP_ALLOCATIONS, max_memory_mb: Optional[float] = None):
+        self.enabled = enabled
+        self.max_memory_mb = budget_mb(max_memory_mb)
+        self.trace = trace and enabled
+        self.sample_seconds = sample_seconds
+        self.top = top
+        self.stages = []
+        self.rss_start = self.rss_peak = self.rss_end = None
+        self.samples = 0
+        self._tracing = False
+        # Traced memory sampled for each open stage, the peak when another stage overlaps it
+        self._stage_peaks = []
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_seconds):
+            self.rss_peak = max(self.rss_peak, rss_mb())
+            self.samples += 1
+            if self._stage_peaks:
+                current = tracemalloc.get_traced_memory()[0]
+                for peak in list(self._stage_peaks):
+                    peak[0] = max(peak[0], current)
+
+    def start(self):
+        if not self.enabled:
+            return self
+        self.rss_start = self.rss_peak = rss_mb()
+        if self.trace:
+            _start_tracing()
+            self._tracing = True
+        self._sampler = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        if not self.enabled or self._sampler is None:
+            return
+        self._stop.set()
+        self._sampler.join()
+        self._sampler = None
+        self.rss_end = rss_mb()
+        self.rss_peak = max(self.rss_peak, self.rss_end)
+        if self._tracing:
+            _stop_tracing()
+            self._tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the memory growth, traced peak and top allocating lines of a block"""
+        if not self.enabled:
+            yield
+            return
+        rss_before = rss_mb()
+        before = None
+        if self.trace:
+            before = tracemalloc.take_snapshot()
+            starts, sole = _open_stage()
+            sampled_peak = [tracemalloc.get_traced_memory()[0]]
+            self._stage_peaks.append(sampled_peak)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = {'stage': name, 'seconds': round(time.perf_counter() - started, 3),
+                     'rss_mb': round(rss_mb(), 1), 'rss_growth_mb': round(rss_mb() - rss_before, 1)}
+            if self.trace:
+                current, peak = tracemalloc.get_traced_memory()
+                self._stage_peaks.remove(sampled_peak)
+                if not _close_stage(starts, sole):
+                    # Overlapped by another stage: the peak since the last reset is not this
+                    # stage's, so use the sampled one
+                    peak = max(sampled_peak[0], current)
+                    entry['peak_sampled'] = True
+                after = tracemalloc.take_snapshot()
+                entry['traced_mb'] = round(current / 1048576, 1)
+                entry['traced_peak_mb'] = round(peak / 1048576, 1)
+                entry['top_allocations'] = [
+                    f"{stat.traceback[0].filename.rsplit(os.sep, 1)[-1]}:{stat.traceback[0].lineno} "
+                    f"+{stat.size_diff / 1048576:.1f} MB"
+                    for stat in after.compare_to(before, 'lineno')[:self.top] if stat.size_diff > 0
+                ]
+            self.rss_peak = max(self.rss_peak or 0, entry['rss_mb'])
+            self.stages.append(entry)
+
+    def summary(self) -> Dict:
+        if not self.enabled:
+            return {}
+        rss_now = self.rss_end if self.rss_end is not None else rss_mb()
+        return {
+            'rss_start_mb': round(self.rss_start, 1),
+            'rss_peak_mb': round(max(self.rss_peak, rss_now), 1),
+            'rss_end_mb': round(rss_now, 1),
+            'rss_samples': self.samples,
+            'budget_mb': self.max_memory_mb,
+            'stages': self.stages
+        }
+
+    def format_summary(self) -> str:
+        """Text block in the style of the agent summaries; empty when disabled"""
+        if not self.enabled:
+            return ""
+        summary = self.summary()
+        text = f"""
+MEMORY PROFILE
+==============
+RSS: start {summary['rss_start_mb']} MB | peak {summary['rss_peak_mb']} MB | end {summary['rss_end_mb']} MB
+"""
+        if self.max_memory_mb is not None:
+            text += f"Budget: {self.max_memory_mb:.0f} MB\n"
+        for entry in summary['stages']:
+            text += f"- {entry['stage']}: {entry['seconds']}s, RSS {entry['rss_mb']} MB ({entry['rss_growth_mb']:+} MB)"
+            if 'traced_peak_mb' in entry:
+                text += f", traced peak {entry['traced_peak_mb']} MB"
+                if entry.get('peak_sampled'):
+                    text += " (sampled, overlapped another stage)"
+            text += "\n"
+            for allocation in entry.get('top_allocations', []):
+                text += f"    {allocation}\n"
+        return text
+
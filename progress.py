@@ -0,0 +1,163 @@
+"""
+Progress reporting and cooperative control for long-running tools.
+
+The agent REPLs (see repl.py) run long tools as background jobs. Each job
+gets a Progress bound to the thread it runs on; the tools report through
+progress.current(), which is a no-op outside a job, so batch.py and direct
+calls behave exactly as before:
+
+    job_progress = progress.current()
+    job_progress.expect(total_rows)
+    for batch in batches:
+        ...
+        job_progress.advance(len(batch))
+
+advance() is also where a job is paused or cancelled: a cancelled job raises
+JobCancelled at its next advance(), after its last batch was written and
+checkpointed, so rerunning the tool resumes from there. Progress objects are
+thread-safe; tools that fan out to worker threads pass the object captured
+with current() to them.
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+# Seconds between progress events of one job
+EVENT_SECONDS = 2.0
+# Weight of the latest interval in the smoothed rate
+RATE_SMOOTHING = 0.3
+
+_current = contextvars.ContextVar('job_progress', default=None)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's tool when the operator cancels it"""
+
+
+class Progress:
+    """Rows processed, rate and ETA of one job, plus its pause/cancel switches"""
+
+    def __init__(self, job_id: int, name: str, on_event: Optional[Callable[[Dict], None]] = None,
+                 event_seconds: float = EVENT_SECONDS):
+        self.job_id = job_id
+        self.name = name
+        self.on_event = on_event
+        self.event_seconds = event_seconds
+        self.total = None
+        self.done = 0
+        self.started = time.monotonic()
+        self.rate = None
+        self._rate_mark = (self.started, 0)
+        self._last_event = 0.0
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._running.set()
+        self.cancelled = False
+
+    def expect(self, total: Optional[int], done: int = 0):
+        """Total rows the job will process (None if unknown), and how many a resumed run already did"""
+        with self._lock:
+            self.total = total
+            self.done = done
+            self._rate_mark = (time.monotonic(), done)
+
+    def advance(self, rows: int = 1):
+        """Count processed rows; blocks while paused and raises JobCancelled once cancelled"""
+        if not self._running.is_set():
+            self._running.wait()
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.job_id} cancelled")
+        now = time.monotonic()
+        with self._lock:
+            self.done += rows
+            if now - self._last_event < self.event_seconds:
+                return
+            self._last_event = now
+            mark_time, mark_done = self._rate_mark
+            if now > mark_time:
+                rate = (self.done - mark_done) / (now - mark_time)
+                self.rate = rate if self.rate is None else (1 - RATE_SMOOTHING) * self.rate + RATE_SMOOTHING * rate
+            self._rate_mark = (now, self.done)
+        self.emit('progress')
+
+    def eta_seconds(self) -> Optional[float]:
+        if self.total is None or not self.rate:
+            return None
+        return max(0.0, (self.total - self.done) / self.rate)
+
+    def snapshot(self) -> Dict:
+        return {
+            'job_id': self.job_id,
+            'name': self.name,
+            'done': self.done,
+            'total': self.total,
+            'rate': self.rate,
+            'eta_seconds': self.eta_seconds(),
+            'elapsed_seconds': time.monotonic() - self.started,
+            'paused': not self._running.is_set()
+        }
+
+    def emit(self, kind: str, **fields):
+        if self.on_event:
+            self.on_event({'kind': kind, **self.snapshot(), **fields})
+
+    def pause(self):
+        self._running.clear()
+        self.emit('paused')
+
+    def resume(self):
+        self._running.set()
+        self.emit('resumed')
+
+    def cancel(self):
+        self.cancelled = True
+        # A paused job has to wake up to notice
+        self._running.set()
+
+
+class _NoProgress:
+    """Stand-in outside of jobs: reporting is ignored"""
+    cancelled = False
+
+    def expect(self, total: Optional[int], done: int = 0):
+        pass
+
+    def advance(self, rows: int = 1):
+        pass
+
+
+_NO_PROGRESS = _NoProgress()
+
+
+def current():
+    """Progress of the job running on this thread, or a no-op stand-in"""
+    return _current.get() or _NO_PROGRESS
+
+
+@contextmanager
+def bound(job_progress: Progress):
+    """Make job_progress what current() returns on this thread for the duration"""
+    token = _current.set(job_progress)
+    try:
+        yield job_progress
+    finally:
+        _current.reset(token)
+
+
+def format_progress(event: Dict) -> str:
+    """One line of job progress: rows, rate and ETA"""
+    text = f"[job {event['job_id']} {event['name']}] {event['done']:,}"
+    if event['total']:
+        text += f" / {event['total']:,} rows ({min(100.0, event['done'] / event['total'] * 100):.0f}%)"
+    else:
+        text += " rows"
+    if event['rate']:
+        text += f" | {event['rate']:,.0f} rows/s"
+    if event['eta_seconds'] is not None:
+        minutes, seconds = divmod(int(event['eta_seconds']), 60)
+        text += f" | ETA {minutes}:{seconds:02d}"
+    if event.get('paused'):
+        text += " | paused"
+    return text
@@ -1,18 +1,11 @@
-import boto3
+from store import DynamoPolicyStore
 
-session = boto3.Session(
-    aws_access_key_id='fakeMyKeyId',
-    aws_secret_access_key='fakeSecretAccessKey',
-    region_name='us-west-2'
-)
-dynamodb = session.resource(
-    'dynamodb',
-    endpoint_url='http://localhost:8123'
-)
 
+def main():
+    for policies, _ in DynamoPolicyStore("unpolishedData").iter_policies():
+        for item in policies:
+            print(item)
 
-table = dynamodb.Table("unpolishedData")
 
-response = table.scan()
-for item in response['Items']:
-    print(item)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+Non-blocking console for the underwriting agents.
+
+The agents used to block on agent(user_input), so a long underwriting run
+froze the console until it finished. run_repl reads input on asyncio and
+runs each agent turn on a worker thread. Tools listed in a script's
+BACKGROUND_TOOLS are wrapped so that calling them starts a background job
+and returns its id at once; the job runs on its own thread and streams
+progress events (rows processed, rate, ETA) to the console.
+
+While a job runs, the agent can still answer questions and run read-only
+tools such as the summaries, which use their own pooled connections. Jobs
+can also be monitored and controlled without the LLM, with the / commands
+in COMMANDS_HELP.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import inspect
+import logging
+import functools
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from progress import Progress, JobCancelled, bound, format_progress
+
+logger = logging.getLogger(__name__)
+
+MAX_JOBS = int(os.getenv("AGENT_MAX_JOBS", 2))
+QUIT_COMMANDS = ['quit', 'exit', 'q']
+RESULT_PREVIEW_CHARS = 2000
+COMMANDS_HELP = """
+/jobs                    list jobs with their progress
+/status <id>             progress, or the result once finished
+/pause <id>, /resume <id>
+/cancel <id>             stop after the current batch (checkpointed, rerun to resume)
+/run <tool> [json args]  call a tool directly, e.g. /run get_underwriting_summary_postgres
+/progress on|off         show or hide streamed progress events"""
+
+
+class JobConflict(RuntimeError):
+    """A job of the same tool is already queued or running"""
+
+
+class JobManager:
+    """Background jobs on a bounded thread pool, each with its own Progress"""
+
+    def __init__(self, max_jobs: int = MAX_JOBS):
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="job")
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self.jobs = {}
+
+    def subscribe(self, callback: Callable[[Dict], None]):
+        """callback(event) is called from the job threads for every progress event"""
+        self._subscribers.append(callback)
+
+    def _publish(self, event: Dict):
+        for callback in self._subscribers:
+            callback(event)
+
+    def start(self, function: Callable, kwargs: Optional[Dict] = None) -> int:
+        """Queue function(**kwargs). Raises JobConflict while a job of the same
+        tool is unfinished: both would write the same checkpoint."""
+        kwargs = kwargs or {}
+        with self._lock:
+            active = [job for job in self.running() if job['name'] == function.__name__]
+            if active:
+                raise JobConflict(f"{function.__name__} is already running as job {active[0]['id']}")
+            job_id = next(self._ids)
+            job = self.jobs[job_id] = {
+                'id': job_id,
+                'name': function.__name__,
+                'kwargs': kwargs,
+                'status': 'queued',
+                'progress': Progress(job_id, function.__name__, self._publish),
+                'result': None,
+                'started_at': time.time(),
+                'finished_at': None
+            }
+        logger.info(f"Job {job_id}: {function.__name__}({kwargs}) queued")
+
+        def run():
+            job['status'] = 'running'
+            job['progress'].emit('started')
+            with bound(job['progress']):
+                return function(**kwargs)
+
+        future = self._executor.submit(run)
+        future.add_done_callback(lambda done: self._finished(job, done))
+        return job_id
+
+    def _finished(self, job: Dict, future):
+        try:
+            job['result'] = future.result()
+            job['status'] = 'done'
+        except JobCancelled as e:
+            job['result'] = str(e)
+        except Exception as e:
+            job['result'] = f"Error: {e}"
+            job['status'] = 'failed'
+            logger.exception(f"Job {job['id']} failed")
+        if job['progress'].cancelled:
+            # Tools turn the cancellation into their usual error summary
+            job['status'] = 'cancelled'
+        job['finished_at'] = time.time()
+        logger.info(f"Job {job['id']} {job['status']}")
+        job['progress'].emit('finished', status=job['status'], result=str(job['result']))
+
+    def get(self, job_id) -> Optional[Dict]:
+        try:
+            return self.jobs.get(int(job_id))
+        except (TypeError, ValueError):
+            return None
+
+    def running(self) -> List[Dict]:
+        return [job for job in self.jobs.values() if job['status'] in ('queued', 'running')]
+
+    def describe(self, job: Dict) -> str:
+        if job['status'] == 'queued':
+            return f"[job {job['id']} {job['name']}] queued"
+        if job['status'] == 'running':
+            return format_progress(job['progress'].snapshot())
+        elapsed = job['finished_at'] - job['started_at']
+        return f"[job {job['id']} {job['name']}] {job['status']} after {elapsed:.0f}s"
+
+    def list_text(self) -> str:
+        if not self.jobs:
+            return "No background jobs"
+        return "\n".join(self.describe(job) for job in self.jobs.values())
+
+    def status_text(self, job_id) -> str:
+        job = self.get(job_id)
+        if job is None:
+            return f"No job {job_id}"
+        text = self.describe(job)
+        if job['result'] is not None:
+            text += "\n" + str(job['result'])[:RESULT_PREVIEW_CHARS]
+        return text
+
+    def control(self, job_id, action: str) -> str:
+        """Pause, resume or cancel a running job"""
+        job = self.get(job_id)
+        if job is None:
+            return f"No job {job_id}"
+        if job['status'] not in ('queued', 'running'):
+            return f"Job {job['id']} already {job['status']}"
+        getattr(job['progress'], action)()
+        if action == 'cancel':
+            return f"Cancelling job {job['id']}; it stops after its current batch (rerun the tool to resume)"
+        return f"Job {job['id']} {action}d"
+
+    def shutdown(self, cancel: bool = True):
+        """Cancel running jobs (if cancel) and wait for them to wind down"""
+        if cancel:
+            for job in self.running():
+                job['progress'].cancel()
+        self._executor.shutdown(wait=True)
+
+
+def background(function: Callable, jobs: JobManager) -> Callable:
+    """Wrap a tool so that calling it starts a background job and returns the job id"""
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def start_job(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs).arguments
+        try:
+            job_id = jobs.start(function, dict(arguments))
+        except JobConflict as e:
+            return f"Error: {e}"
+        return (f"Started {function.__name__} as background job {job_id}. Progress is streamed to the "
+                f"console; use job_status({job_id}) for updates or cancel_job({job_id}) to stop it.")
+
+    start_job.__doc__ = (function.__doc__ or "") + "\nRuns as a background job and returns its job id immediately."
+    return start_job
+
+
+def job_tools(jobs: JobManager) -> List[Callable]:
+    """Agent tools to monitor and control the background jobs"""
+
+    def list_jobs() -> str:
+        """List background jobs with their status and progress"""
+        return jobs.list_text()
+
+    def job_status(job_id: int) -> str:
+        """Progress of a background job (rows processed, rate, ETA), or its result once finished"""
+        return jobs.status_text(job_id)
+
+    def cancel_job(job_id: int) -> str:
+        """Cancel a background job. It stops after its current batch, which stays checkpointed"""
+        return jobs.control(job_id, 'cancel')
+
+    return [list_jobs, job_status, cancel_job]
+
+
+def agent_tools(tools: List[Callable], jobs: JobManager, background_tools: List[Callable]) -> List[Callable]:
+    """The agent's tools with the long ones run as background jobs, plus the job tools"""
+    return [background(f, jobs) if f in background_tools else f for f in tools] + job_tools(jobs)
+
+
+class _Console:
+    """Prints from any thread without losing the pending input prompt"""
+
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self.waiting = False
+        self.lock = threading.Lock()
+
+    def read(self) -> str:
+        self.waiting = True
+        try:
+            return input(self.prompt)
+        finally:
+            self.waiting = False
+
+    def print(self, text: str):
+        with self.lock:
+            if self.waiting:
+                # Output lands after the prompt; show the prompt again below it
+                sys.stdout.write(f"\n{text}\n{self.prompt}")
+                sys.stdout.flush()
+            else:
+                print(text)
+
+
+def _run_command(command: str, jobs: JobManager, state: Dict) -> str:
+    """Handle a / command other than /run; returns the text to print"""
+    name, _, argument = command[1:].partition(' ')
+    argument = argument.strip()
+    if name == 'jobs':
+        return jobs.list_text()
+    if name == 'status':
+        return jobs.status_text(argument)
+    if name in ('pause', 'resume', 'cancel'):
+        return jobs.control(argument, name)
+    if name == 'progress':
+        state['show_progress'] = argument != 'off'
+        return f"Progress events {'shown' if state['show_progress'] else 'hidden'}"
+    if name == 'help':
+        return COMMANDS_HELP
+    return f"Unknown command /{name}; try /help"
+
+
+async def _call_tool(function: Callable, argument: str, console: _Console):
+    try:
+        kwargs = json.loads(argument) if argument else {}
+        result = await asyncio.to_thread(function, **kwargs)
+    except Exception as e:
+        result = f"❌ Error: {e}"
+    console.print(str(result))
+
+
+async def _ask(agent, user_input: str, console: _Console, icon: str):
+    try:
+        logger.info(f"User input: {user_input}")
+        response = await asyncio.to_thread(agent, user_input)
+        logger.info(f"Agent response length: {len(str(response))} characters")
+        console.print(f"{icon} {response}")
+    except Exception as e:
+        logger.error(f"Error processing request: {e}")
+        console.print(f"❌ Error processing request: {e}")
+
+
+async def _print_events(events: asyncio.Queue, console: _Console, state: Dict):
+    while True:
+        event = await events.get()
+        if event['kind'] == 'finished':
+            console.print(f"[job {event['job_id']} {event['name']}] {event['status']} - /status {event['job_id']} for the result")
+        elif event['kind'] == 'started':
+            console.print(f"[job {event['job_id']} {event['name']}] started")
+        elif state['show_progress']:
+            console.print(format_progress(event))
+
+
+async def run_repl(agent, jobs: JobManager, tools: List[Callable], prompt: str, icon: str = ""):
+    """
+    Read requests until quit, answering each on a worker thread. One agent
+    turn runs at a time; / commands are handled immediately, even while the
+    agent is answering or jobs are running. Quitting cancels running jobs.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    jobs.subscribe(lambda event: loop.call_soon_threadsafe(events.put_nowait, event))
+    console = _Console(prompt)
+    state = {'show_progress': True}
+    tools_by_name = {f.__name__: f for f in tools}
+    printer = asyncio.create_task(_print_events(events, console, state))
+    agent_turn = None
+    calls = set()
+
+    try:
+        while True:
+            try:
+                user_input = (await loop.run_in_executor(None, console.read)).strip()
+            except EOFError:
+                break
+            if not user_input:
+                continue
+            if user_input.lower() in QUIT_COMMANDS:
+                break
+
+            if user_input.startswith('/run'):
+                name, _, argument = user_input[len('/run'):].strip().partition(' ')
+                if name not in tools_by_name:
+                    console.print(f"Unknown tool '{name}'. Tools: {', '.join(tools_by_name)}")
+                    continue
+                call = asyncio.create_task(_call_tool(tools_by_name[name], argument.strip(), console))
+                calls.add(call)
+                call.add_done_callback(calls.discard)
+            elif user_input.startswith('/'):
+                console.print(_run_command(user_input, jobs, state))
+            elif agent_turn is not None and not agent_turn.done():
+                console.print("⏳ Still answering the previous request; / commands work meanwhile (/help)")
+            else:
+                agent_turn = asyncio.create_task(_ask(agent, user_input, console, icon))
+    finally:
+        running = jobs.running()
+        if running:
+            print(f"Cancelling {len(running)} running job(s); they stop after their current batch...")
+        await loop.run_in_executor(None, jobs.shutdown)
+        printer.cancel()
+        print("👋 Goodbye!")
@@ -0,0 +1,192 @@
+"""
+Optional LLM second opinion for borderline policies.
+
+After apply_underwriting_rules has decided, policies that sit close to a
+decision threshold (TIV cap, premium range, building year, loss value) are
+sent to the model in small batches. Calls run concurrently under a semaphore,
+stop being scheduled once the token budget is spent, and anything still
+pending at the run deadline is skipped. The rule decision is never changed;
+the opinion is appended to the reasoning.
+
+The endpoint is any OpenAI-compatible chat completions API. LLM_BASE_URL
+and LLM_MODEL_ID also configure the agents' model; point LLM_BASE_URL at
+benchmarks/standin_server.py to run without the network.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.cohere.ai/compatibility/v1")
+LLM_MODEL_ID = os.getenv("LLM_MODEL_ID", "command-a-03-2025")
+
+# Relative distance to a bound that counts as borderline
+DEFAULT_MARGIN = 0.05
+BORDERLINE_YEARS = 2
+
+REVIEW_PROMPT = """You are a senior property underwriter giving a second opinion.
+Our automatic rules already classified each policy below. For every policy,
+say whether you AGREE or DISAGREE with the classification and give a one
+sentence note. Answer with a JSON array only, one object per policy:
+[{"policy_id": "...", "opinion": "AGREE" or "DISAGREE", "note": "..."}]
+
+Underwriting guidelines:
+"""
+
+
+def borderline_reasons(policy: dict, rule_set: Optional[dict] = None, margin: float = DEFAULT_MARGIN) -> List[str]:
+    """Thresholds the policy sits close to; empty if it is not borderline"""
+    from render_underwriter import CURRENT_RULE_SET
+    rules = rule_set or CURRENT_RULE_SET
+
+    def near(value, bound):
+        return value is not None and bound and abs(float(value) - bound) <= abs(bound) * margin
+
+    reasons = []
+    if near(policy.get('tiv'), rules['max_tiv']):
+        reasons.append('tiv')
+    min_premium, max_premium = rules['premium_range']
+    if near(policy.get('total_premium'), min_premium) or near(policy.get('total_premium'), max_premium):
+        reasons.append('total_premium')
+    oldest_building = policy.get('oldest_building')
+    if oldest_building is not None and abs(oldest_building - rules['min_building_year']) <= BORDERLINE_YEARS:
+        reasons.append('oldest_building')
+    if near(policy.get('loss_value'), rules['max_loss_value']):
+        reasons.append('loss_value')
+    return reasons
+
+
+def _estimate_tokens(text: str) -> int:
+    # Rough chars-per-token ratio; only used to decide whether a call fits the budget
+    return len(text) // 4 + 1
+
+
+def _parse_opinions(content: str) -> List[dict]:
+    start, end = content.find('['), content.rfind(']')
+    if start == -1 or end == -1:
+        raise ValueError("No JSON array in model response")
+    return json.loads(content[start:end + 1])
+
+
+class SecondOpinionReviewer:
+    """
+    Reviews borderline policies concurrently. One instance covers a whole run:
+    the token budget and the deadline are shared by every review() call.
+    """
+
+    def __init__(self, rules_content: str, max_concurrency: int = 4, policies_per_call: int = 10,
+                 token_budget: int = 50000, deadline_seconds: float = 60.0, max_tokens: int = 1000,
+                 api_key: Optional[str] = None, base_url: str = LLM_BASE_URL, model_id: str = LLM_MODEL_ID):
+        self.rules_content = rules_content
+        self.max_concurrency = max_concurrency
+        self.policies_per_call = policies_per_call
+        self.tokens_remaining = token_budget
+        self.deadline = time.monotonic() + deadline_seconds
+        self.max_tokens = max_tokens
+        self.api_key = api_key or os.getenv("COHERE_API_KEY")
+        self.base_url = base_url
+        self.model_id = model_id
+        self.stats = {'reviewed': 0, 'disagreements': 0, 'skipped_budget': 0,
+                      'skipped_deadline': 0, 'failed': 0, 'calls': 0, 'tokens_used': 0}
+
+    def review(self, candidates: List[dict]) -> Dict[str, dict]:
+        """
+        candidates: dicts with policy_id, decision, reasoning and the policy fields.
+        Returns policy_id -> {'opinion', 'note'} for the policies that were reviewed.
+        """
+        if not candidates:
+            return {}
+        if time.monotonic() >= self.deadline:
+            self.stats['skipped_deadline'] += len(candidates)
+            return {}
+        return asyncio.run(self._review_all(candidates))
+
+    async def _review_all(self, candidates: List[dict]) -> Dict[str, dict]:
+        from openai import AsyncOpenAI
+
+        client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        budget_lock = asyncio.Lock()
+        opinions = {}
+
+        async def review_batch(batch):
+            prompt = "\n".join(json.dumps(c, default=str) for c in batch)
+            estimate = _estimate_tokens(REVIEW_PROMPT + self.rules_content + prompt) + self.max_tokens
+            async with budget_lock:
+                if estimate > self.tokens_remaining:
+                    self.stats['skipped_budget'] += len(batch)
+                    return
+                # Reserve the estimate now; the actual usage is settled after the call
+                self.tokens_remaining -= estimate
+
+            try:
+                async with semaphore:
+                    response = await client.chat.completions.create(
+                        model=self.model_id,
+                        messages=[
+                            {"role": "system", "content": REVIEW_PROMPT + self.rules_content},
+                            {"role": "user", "content": prompt}
+                        ],
+                        max_tokens=self.max_tokens
+                    )
+            except BaseException:
+                # Failed or cancelled at the deadline: give the reservation back
+                async with budget_lock:
+                    self.tokens_remaining += estimate
+                raise
+
+            used = response.usage.total_tokens if response.usage else estimate
+            async with budget_lock:
+                self.tokens_remaining += estimate - used
+                self.stats['tokens_used'] += used
+                self.stats['calls'] += 1
+
+            for opinion in _parse_opinions(response.choices[0].message.content or ""):
+                policy_id = str(opinion.get('policy_id'))
+                opinions[policy_id] = {
+                    'opinion': str(opinion.get('opinion', '')).upper(),
+                    'note': opinion.get('note', '')
+                }
+
+        batches = [candidates[i:i + self.policies_per_call]
+                   for i in range(0, len(candidates), self.policies_per_call)]
+        tasks = [asyncio.ensure_future(review_batch(batch)) for batch in batches]
+        done, pending = await asyncio.wait(tasks, timeout=max(0.0, self.deadline - time.monotonic()))
+
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        for batch, task in zip(batches, tasks):
+            if task in pending:
+                self.stats['skipped_deadline'] += len(batch)
+            elif task.exception() is not None:
+                self.stats['failed'] += len(batch)
+                logger.error(f"Second-opinion review call failed: {task.exception()}")
+        await client.close()
+
+        self.stats['reviewed'] += len(opinions)
+        self.stats['disagreements'] += sum(1 for o in opinions.values() if o['opinion'] == 'DISAGREE')
+        return opinions
+
+
+def review_candidate(policy: dict, decision: str, reasoning: str, reasons: List[str]) -> dict:
+    """Compact description of one policy for the review prompt"""
+    fields = ['tiv', 'total_premium', 'line_of_business', 'construction_type', 'primary_risk_state',
+              'oldest_building', 'renewal_or_new_business', 'loss_value']
+    return {
+        'policy_id': str(policy.get('id')),
+        'decision': decision,
+        'borderline_on': reasons,
+        'reasoning': reasoning,
+        **{field: policy.get(field) for field in fields}
+    }
+
+
+def format_opinion(opinion: dict) -> str:
+    """Line appended to the stored reasoning"""
+    return f"\n🤖 Second opinion: {opinion['opinion']} - {opinion['note']}"
@@ -0,0 +1,312 @@
+"""
+rules.txt compiled into a rule set, reloaded while the engines run.
+
+compile_rules parses the guidelines into the rule-set dict that
+render_underwriter.apply_underwriting_rules evaluates (the shape of
+CURRENT_RULE_SET). The shipped rules.txt compiles to CURRENT_RULE_SET.
+
+get_rules() returns the current CompiledRules: the text, its compiled rule
+set and its version, a content hash that is stored with every decision. A
+watcher thread per file polls its mtime and size; when the content changes
+it is recompiled and swapped in with a single reference assignment, so a
+reload costs nothing on the scoring path and no process restart is needed.
+Engines call get_rules() once per batch and use that object for the whole
+batch: in-flight batches finish on the version they started with, the next
+batch picks up the new one. A file that no longer compiles is logged and the
+running version is kept.
+"""
+import os
+import re
+import copy
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+RULES_FILE = os.getenv("RULES_FILE", "rules.txt")
+RULES_POLL_SECONDS = float(os.getenv("RULES_POLL_SECONDS", 1.0))
+
+AMOUNT = re.compile(r"\$\s*([\d,]+(?:\.\d+)?)\s*([KkMm])?\b")
+YEAR = re.compile(r"\b(1[89]\d\d|2\d\d\d)\b")
+PERCENT = re.compile(r"(\d+(?:\.\d+)?)\s*%")
+STATE = re.compile(r"\b[A-Z]{2}\b")
+# Spellings the construction types of rules.txt also cover: joisted masonry is
+# often just "masonry", and concrete buildings are non combustible
+CONSTRUCTION_SYNONYMS = {'jm': ['masonry'], 'non combustible': ['concrete']}
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+class RulesError(ValueError):
+    """rules.txt could not be compiled into a rule set"""
+
+
+class CompiledRules:
+    """One version of rules.txt: its text, compiled rule set and content hash"""
+    __slots__ = ('content', 'rule_set', 'version', 'path', 'loaded_at')
+
+    def __init__(self, content: str, rule_set: Dict, path: Optional[str] = None):
+        self.content = content
+        self.rule_set = rule_set
+        self.version = rules_version(content)
+        self.path = path
+        self.loaded_at = time.time()
+
+
+def rules_version(content: str) -> str:
+    """Content hash identifying a version of the rules"""
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def _amounts(text: str) -> List[float]:
+    multipliers = {'k': 1000, 'm': 1000000}
+    return [float(number.replace(',', '')) * multipliers.get(suffix.lower(), 1) if suffix
+            else float(number.replace(',', '')) for number, suffix in AMOUNT.findall(text)]
+
+
+def _whole(value: float):
+    return int(value) if float(value).is_integer() else value
+
+
+def _verdict(line: str) -> str:
+    """'target', 'declined' or 'accepted', from the text after the last colon"""
+    verdict = line.rsplit(':', 1)[-1].lower()
+    if 'target' in verdict:
+        return 'target'
+    if 'not' in verdict:
+        return 'declined'
+    return 'accepted' if 'acceptable' in verdict else ''
+
+
+def _sections(content: str) -> Dict[str, List[str]]:
+    """
+    Indented entries under each unindented heading, with wrapped entries (a
+    line without a colon) joined to the line that follows
+    """
+    sections, heading, pending = {}, None, ''
+    for raw_line in content.splitlines():
+        if not raw_line.strip():
+            continue
+        if not raw_line[:1].isspace():
+            heading = raw_line.strip().lstrip('●•*- ').rstrip(':').strip().lower()
+            sections[heading], pending = [], ''
+            continue
+        if heading is None:
+            continue
+        line = f"{pending} {raw_line.strip()}".strip()
+        if ':' in line:
+            sections[heading].append(line)
+            pending = ''
+        else:
+            pending = line
+    return sections
+
+
+def _compile_submission(lines: List[str], rule_set: Dict):
+    declined = [re.sub(r'\bbusiness\b', '', line.split(':')[0], flags=re.IGNORECASE).strip().upper()
+                for line in lines if _verdict(line) == 'declined']
+    rule_set['declined_submission_types'] = declined
+
+
+def _compile_line_of_business(lines: List[str], rule_set: Dict):
+    for line in lines:
+        label = line.split(':')[0]
+        if _verdict(line) == 'accepted' and 'other' not in label.lower():
+            rule_set['required_line_of_business'] = re.sub(
+                r'\bline of business\b', '', label, flags=re.IGNORECASE).strip().upper()
+            return
+    raise RulesError("Line of Business names no acceptable line")
+
+
+def _compile_states(lines: List[str], rule_set: Dict):
+    for line in lines:
+        label, _, values = line.partition(':')
+        label = label.lower()
+        if 'not' in label:
+            continue
+        if 'target' in label:
+            rule_set['target_states'] = STATE.findall(values)
+        elif 'acceptable' in label:
+            rule_set['acceptable_states'] = STATE.findall(values)
+    if not rule_set['acceptable_states']:
+        raise RulesError("Primary Risk State lists no acceptable states")
+
+
+def _compile_tiv(lines: List[str], rule_set: Dict):
+    for line in lines:
+        amounts, verdict = _amounts(line.split(':')[0]), _verdict(line)
+        if verdict == 'target' and len(amounts) == 2:
+            rule_set['target_tiv'] = [_whole(a) for a in sorted(amounts)]
+        elif verdict == 'accepted' and len(amounts) == 1:
+            rule_set['max_tiv'] = _whole(amounts[0])
+
+
+def _compile_premium(lines: List[str], rule_set: Dict):
+    for line in lines:
+        amounts, verdict = _amounts(line.split(':')[0]), _verdict(line)
+        if len(amounts) != 2:
+            continue
+        if verdict == 'target':
+            rule_set['target_premium'] = [_whole(a) for a in sorted(amounts)]
+        elif verdict == 'accepted':
+            rule_set['premium_range'] = [_whole(a) for a in sorted(amounts)]
+
+
+def _compile_building_age(lines: List[str], rule_set: Dict):
+    for line in lines:
+        years, verdict = YEAR.findall(line.split(':')[0]), _verdict(line)
+        if len(years) != 1:
+            continue
+        if verdict == 'target':
+            rule_set['target_building_year'] = int(years[0])
+        elif verdict == 'accepted':
+            rule_set['min_building_year'] = int(years[0])
+
+
+def _compile_construction(lines: List[str], rule_set: Dict):
+    for line in lines:
+        if _verdict(line) != 'accepted':
+            continue
+        statement = line.rsplit(':', 1)[0]
+        share = PERCENT.search(statement)
+        types = re.split(r'\bare\b', statement, maxsplit=1, flags=re.IGNORECASE)[-1]
+        acceptable = []
+        for name in re.split(r'[,/]', types):
+            name = ' '.join(name.split()).lower()
+            for alias in [name] + CONSTRUCTION_SYNONYMS.get(name, []):
+                if alias and alias not in acceptable:
+                    acceptable.append(alias)
+        if not acceptable:
+            raise RulesError("Construction Type names no acceptable construction")
+        rule_set['acceptable_construction_types'] = acceptable
+        if share:
+            rule_set['min_acceptable_construction_share'] = float(share.group(1)) / 100
+        return
+
+
+def _compile_loss_value(lines: List[str], rule_set: Dict):
+    for line in lines:
+        amounts = _amounts(line.split(':')[0])
+        if _verdict(line) == 'accepted' and len(amounts) == 1:
+            rule_set['max_loss_value'] = _whole(amounts[0])
+
+
+# Heading keyword -> compiler of that section
+SECTION_COMPILERS = [
+    ('submission', _compile_submission),
+    ('line of business', _compile_line_of_business),
+    ('state', _compile_states),
+    ('tiv', _compile_tiv),
+    ('premium', _compile_premium),
+    ('building age', _compile_building_age),
+    ('construction', _compile_construction),
+    ('loss', _compile_loss_value)
+]
+
+
+def compile_rules(content: str, base: Optional[Dict] = None) -> Dict:
+    """
+    Rule set from the text of rules.txt. Thresholds of sections the text
+    does not have keep their value from base (CURRENT_RULE_SET by default).
+    Raises RulesError when a section is present but unusable.
+    """
+    if base is None:
+        from render_underwriter import CURRENT_RULE_SET
+        base = CURRENT_RULE_SET
+    rule_set = copy.deepcopy(base)
+    sections = _sections(content)
+    for keyword, compile_section in SECTION_COMPILERS:
+        heading = next((h for h in sections if keyword in h and sections[h]), None)
+        if heading is None:
+            logger.warning(f"rules.txt has no '{keyword}' section, keeping the default thresholds")
+            continue
+        compile_section(sections[heading], rule_set)
+    return rule_set
+
+
+class RulesWatcher:
+    """Keeps the compiled rules of one file current, polling it on a daemon thread"""
+
+    def __init__(self, path: str = RULES_FILE, poll_seconds: float = RULES_POLL_SECONDS):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.rules = None
+        self.reloads = 0
+        self._stat = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self) -> CompiledRules:
+        return self.rules
+
+    def reload(self, force: bool = False) -> bool:
+        """Recompile the file if it changed; returns True if a new version was swapped in"""
+        with self._lock:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature == self._stat and not force:
+                return False
+            with open(self.path, "r", encoding="utf-8") as f:
+                content = f.read()
+            self._stat = signature
+            if self.rules is not None and rules_version(content) == self.rules.version:
+                return False
+            try:
+                rules = CompiledRules(content, compile_rules(content), self.path)
+            except RulesError as e:
+                if self.rules is None:
+                    raise
+                logger.error(f"{self.path} no longer compiles, keeping rules version {self.rules.version}: {e}")
+                return False
+            previous, self.rules = self.rules, rules
+            if previous is not None:
+                self.reloads += 1
+                logger.info(f"Rules reloaded from {self.path}: version {previous.version} -> {rules.version}")
+            return True
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.reload()
+            except Exception as e:
+                logger.warning(f"Could not reload {self.path}: {e}")
+
+    def start(self):
+        if self.rules is None:
+            self.reload(force=True)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="rules-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def format_rules_versions(versions: List[str]) -> str:
+    """Summary line naming the rules versions a run used, in order"""
+    if not versions:
+        return ""
+    if len(versions) == 1:
+        return f"Rules version: {versions[0]}\n"
+    return f"Rules versions: {' -> '.join(versions)} (rules.txt reloaded during the run)\n"
+
+
+def get_rules(path: str = RULES_FILE) -> CompiledRules:
+    """Current compiled rules of path, watched for changes from the first call on"""
+    watcher = _watchers.get(path)
+    if watcher is None:
+        with _watchers_lock:
+            watcher = _watchers.get(path)
+            if watcher is None:
+                watcher = RulesWatcher(path).start()
+                _watchers[path] = watcher
+    return watcher.rules
@@ -0,0 +1,386 @@
+"""
+Sharded underwriting, so one book can be split across processes and hosts.
+
+A run (named by its run id) divides the book into shards:
+
+    state   one shard per primary_risk_state (PostgreSQL, read through the
+            state indexes)
+    hash    N shards by a hash of the policy id (PostgreSQL: N equal ranges of
+            hashtext(id), each an index range scan of idx_policies_id_hash;
+            DynamoDB: parallel-scan segments, which DynamoDB assigns by key hash)
+
+Every worker registers the same shard list, then claims shards one at a time
+through lease rows (underwriting_shards in PostgreSQL, underwritingShards in
+DynamoDB), underwrites them batch by batch and marks them done. The lease is
+renewed with the shard's position and running summary after every batch. A
+worker that dies leaves its lease to expire and the next claimant resumes
+from the saved position; a worker whose lease was taken over stops at its
+next renewal. Results are upserted by policy id, so a batch replayed after a
+takeover overwrites rather than duplicates.
+
+A worker that finds nothing left to claim reports the merged summary of all
+shards of the run:
+
+    python batch.py shard --source postgres --by state --run-id nightly-2026-10-19
+    python batch.py shard --source postgres --by hash --shards 32 --run-id nightly-2026-10-19
+    python batch.py shard --source dynamo --shards 16 --run-id nightly-2026-10-19
+    python batch.py shard-summary --source postgres --run-id nightly-2026-10-19
+"""
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from store import DynamoPolicyStore, PostgresPolicyStore, get_dynamodb_table, ID_HASH_SQL, ID_HASH_RANGE
+from rulebook import get_rules
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = int(os.getenv("SHARD_LEASE_SECONDS", 300))
+COUNTERS = ('total_processed', 'safe_count', 'not_safe_count', 'error_count')
+
+
+def _new_summary() -> Dict:
+    return {**{key: 0 for key in COUNTERS}, 'errors': [], 'rules_versions': []}
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+class PostgresShardLeases:
+    """Lease rows in underwriting_shards; lease times use the database clock"""
+
+    def __init__(self, store: PostgresPolicyStore):
+        self.store = store
+
+    def register(self, run_id: str, shard_keys: List[str]):
+        from psycopg2.extras import execute_batch
+
+        def insert(conn):
+            with conn.cursor() as cursor:
+                execute_batch(cursor, """
+                    INSERT INTO underwriting_shards (run_id, shard_key) VALUES (%s, %s)
+                    ON CONFLICT (run_id, shard_key) DO NOTHING
+                """, [(run_id, key) for key in shard_keys])
+            conn.commit()
+        self.store.run(insert)
+
+    def claim(self, run_id: str, owner: str, lease_seconds: int = LEASE_SECONDS) -> Optional[Dict]:
+        """Take a pending shard, or one whose lease expired; None when there is none"""
+        def update(conn):
+            with conn.cursor() as cursor:
+                # SKIP LOCKED lets concurrent claimants pass over a row being claimed
+                cursor.execute("""
+                    UPDATE underwriting_shards
+                    SET status = 'running', owner = %s,
+                        lease_expires_at = NOW() + %s * INTERVAL '1 second', updated_at = NOW()
+                    WHERE (run_id, shard_key) = (
+                        SELECT run_id, shard_key FROM underwriting_shards
+                        WHERE run_id = %s
+                          AND (status = 'pending' OR (status = 'running' AND lease_expires_at < NOW()))
+                        ORDER BY shard_key
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING shard_key, position, summary
+                """, (owner, lease_seconds, run_id))
+                row = cursor.fetchone()
+            conn.commit()
+            return row
+        row = self.store.run(update)
+        if row is None:
+            return None
+        shard_key, position, summary = row
+        return {'shard_key': shard_key, 'position': json.loads(position) if position else None,
+                'summary': summary}
+
+    def _update_owned(self, sql: str, params: tuple) -> bool:
+        def update(conn):
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                owned = cursor.rowcount == 1
+            conn.commit()
+            return owned
+        return self.store.run(update)
+
+    def renew(self, run_id: str, shard_key: str, owner: str, position, summary: Dict,
+              lease_seconds: int = LEASE_SECONDS) -> bool:
+        """Extend the lease and save progress; False if the lease is no longer ours"""
+        return self._update_owned("""
+            UPDATE underwriting_shards
+            SET lease_expires_at = NOW() + %s * INTERVAL '1 second', position = %s, summary = %s, updated_at = NOW()
+            WHERE run_id = %s AND shard_key = %s AND owner = %s AND status = 'running'
+        """, (lease_seconds, json.dumps(position), json.dumps(summary), run_id, shard_key, owner))
+
+    def complete(self, run_id: str, shard_key: str, owner: str, summary: Dict) -> bool:
+        return self._update_owned("""
+            UPDATE underwriting_shards
+            SET status = 'done', lease_expires_at = NULL, summary = %s, updated_at = NOW()
+            WHERE run_id = %s AND shard_key = %s AND owner = %s AND status = 'running'
+        """, (json.dumps(summary), run_id, shard_key, owner))
+
+    def shards(self, run_id: str) -> List[Dict]:
+        def select(conn):
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT shard_key, status, owner, summary FROM underwriting_shards "
+                               "WHERE run_id = %s ORDER BY shard_key", (run_id,))
+                return cursor.fetchall()
+        return [{'shard_key': key, 'status': status, 'owner': owner, 'summary': summary}
+                for key, status, owner, summary in self.store.run(select)]
+
+
+class DynamoShardLeases:
+    """
+    Lease items in a DynamoDB table, claimed with conditional updates. Lease
+    expiry uses the workers' clocks, so hosts should run NTP.
+    """
+
+    def __init__(self, table_name: str = 'underwritingShards'):
+        self.table_name = table_name
+
+    @property
+    def table(self):
+        return get_dynamodb_table(self.table_name, key_name='lease_id')
+
+    def _conditional(self, operation, **kwargs) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            operation(**kwargs)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def register(self, run_id: str, shard_keys: List[str]):
+        table = self.table
+        for key in shard_keys:
+            self._conditional(table.put_item,
+                              Item={'lease_id': f"{run_id}#{key}", 'run_id': run_id, 'shard_key': key,
+                                    'shard_status': 'pending'},
+                              ConditionExpression='attribute_not_exists(lease_id)')
+
+    def claim(self, run_id: str, owner: str, lease_seconds: int = LEASE_SECONDS) -> Optional[Dict]:
+        """Take a pending shard, or one whose lease expired; None when there is none"""
+        table = self.table
+        now = int(time.time())
+        for shard in self.shards(run_id):
+            if shard['status'] == 'done':
+                continue
+            if shard['status'] == 'running' and shard['lease_expires'] >= now:
+                continue
+            claimed = self._conditional(
+                table.update_item,
+                Key={'lease_id': f"{run_id}#{shard['shard_key']}"},
+                UpdateExpression='SET shard_status = :running, lease_owner = :owner, lease_expires = :expires',
+                ConditionExpression='shard_status = :pending OR (shard_status = :running AND lease_expires < :now)',
+                ExpressionAttributeValues={':running': 'running', ':pending': 'pending', ':owner': owner,
+                                           ':expires': now + lease_seconds, ':now': now}
+            )
+            if claimed:
+                return {'shard_key': shard['shard_key'], 'position': shard['position'], 'summary': shard['summary']}
+        return None
+
+    def renew(self, run_id: str, shard_key: str, owner: str, position, summary: Dict,
+              lease_seconds: int = LEASE_SECONDS) -> bool:
+        """Extend the lease and save progress; False if the lease is no longer ours"""
+        return self._conditional(
+            self.table.update_item,
+            Key={'lease_id': f"{run_id}#{shard_key}"},
+            UpdateExpression='SET lease_expires = :expires, shard_position = :position, shard_summary = :summary',
+            ConditionExpression='lease_owner = :owner AND shard_status = :running',
+            ExpressionAttributeValues={':expires': int(time.time()) + lease_seconds,
+                                       ':position': json.dumps(position), ':summary': json.dumps(summary),
+                                       ':owner': owner, ':running': 'running'}
+        )
+
+    def complete(self, run_id: str, shard_key: str, owner: str, summary: Dict) -> bool:
+        return self._conditional(
+            self.table.update_item,
+            Key={'lease_id': f"{run_id}#{shard_key}"},
+            UpdateExpression='SET shard_status = :done, shard_summary = :summary REMOVE lease_expires',
+            ConditionExpression='lease_owner = :owner AND shard_status = :running',
+            ExpressionAttributeValues={':done': 'done', ':summary': json.dumps(summary),
+                                       ':owner': owner, ':running': 'running'}
+        )
+
+    def shards(self, run_id: str) -> List[Dict]:
+        from boto3.dynamodb.conditions import Attr
+        table = self.table
+        scan_kwargs = {'FilterExpression': Attr('run_id').eq(run_id), 'ConsistentRead': True}
+        items = []
+        while True:
+            response = table.scan(**scan_kwargs)
+            items.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return sorted(({
+            'shard_key': item['shard_key'],
+            'status': item['shard_status'],
+            'owner': item.get('lease_owner'),
+            'lease_expires': int(item.get('lease_expires', 0)),
+            'position': json.loads(item['shard_position']) if item.get('shard_position') else None,
+            'summary': json.loads(item['shard_summary']) if item.get('shard_summary') else None
+        } for item in items), key=lambda shard: shard['shard_key'])
+
+
+def plan_shards(source: str, by: str, shard_count: int, store: Optional[PostgresPolicyStore] = None) -> List[str]:
+    """
+    Shard keys for a run: 'hash:<n>/<count>' or 'state:<state>' ('state' alone
+    holds policies without a state). Every worker computes the same list.
+    """
+    if by == 'hash':
+        return [f"hash:{n}/{shard_count}" for n in range(shard_count)]
+    if source != 'postgres':
+        raise ValueError("DynamoDB runs shard by hash (parallel-scan segments)")
+
+    def states(conn):
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT DISTINCT primary_risk_state FROM policies")
+            return [row[0] for row in cursor.fetchall()]
+    return sorted("state" if state is None else f"state:{state}" for state in store.run(states))
+
+
+def shard_store(source: str, shard_key: str, table_name: str = 'unpolishedData',
+                results_table: str = 'underwritingResults', max_connections: int = 4):
+    """PolicyStore whose iter_policies covers only the given shard"""
+    kind, separator, value = shard_key.partition(":")
+    if kind == 'hash':
+        shard, shard_count = (int(part) for part in value.split('/'))
+        if source == 'dynamo':
+            return DynamoPolicyStore(table_name, results_table, segment=shard, total_segments=shard_count)
+        # A contiguous range of the id hash rather than a modulus, so each shard
+        # reads only its own slice of the (hash, id) index
+        id_hash = ID_HASH_SQL.format(id='id')
+        lower, upper = ID_HASH_RANGE * shard // shard_count, ID_HASH_RANGE * (shard + 1) // shard_count
+        return PostgresPolicyStore(max_connections=max_connections, order_key=ID_HASH_SQL,
+                                   where=(f"{id_hash} >= %s AND {id_hash} < %s", (lower, upper)))
+    if kind == 'state' and source == 'postgres':
+        if separator:
+            return PostgresPolicyStore(max_connections=max_connections, where=("primary_risk_state = %s", (value,)))
+        return PostgresPolicyStore(max_connections=max_connections, where=("primary_risk_state IS NULL", ()))
+    raise ValueError(f"Unknown shard {shard_key} for source {source}")
+
+
+def open_leases(source: str, store: Optional[PostgresPolicyStore] = None):
+    return PostgresShardLeases(store) if source == 'postgres' else DynamoShardLeases()
+
+
+def merge_summaries(shards: List[Dict]) -> Dict:
+    """One summary for the whole run out of the per-shard ones"""
+    merged = {**_new_summary(), 'shards': len(shards), 'done': 0, 'running': 0, 'pending': 0}
+    for shard in shards:
+        merged[shard['status']] = merged.get(shard['status'], 0) + 1
+        summary = shard['summary'] or {}
+        for key in COUNTERS:
+            merged[key] += summary.get(key, 0)
+        merged['errors'].extend(summary.get('errors', [])[:max(0, 3 - len(merged['errors']))])
+        merged['rules_versions'] += [v for v in summary.get('rules_versions', []) if v not in merged['rules_versions']]
+    merged['complete'] = bool(shards) and merged['done'] == len(shards)
+    return merged
+
+
+def _underwrite_shard(policy_store, leases, run_id: str, claim: Dict, owner: str, current_rules,
+                      fields: Optional[List[str]], batch_size: int, lease_seconds: int) -> bool:
+    """
+    Underwrite one claimed shard from its saved position; False if the lease
+    was lost. current_rules() returns (apply_rules, rules_version) and is
+    called per batch, so a reload of rules.txt applies from the next batch on.
+    """
+    shard_key = claim['shard_key']
+    summary = {**_new_summary(), **(claim['summary'] or {})}
+    position = claim['position']
+    for policies, next_position in policy_store.iter_policies(batch_size, fields, position):
+        apply_rules, version = current_rules()
+        if version not in summary['rules_versions']:
+            summary['rules_versions'].append(version)
+        results = []
+        for policy in policies:
+            try:
+                decision, reasoning = apply_rules(policy)
+                results.append({'policy': policy, 'decision': decision, 'reasoning': reasoning,
+                                'rules_version': version})
+                summary['total_processed'] += 1
+                summary['safe_count' if decision == 'SAFE' else 'not_safe_count'] += 1
+            except Exception as e:
+                summary['error_count'] += 1
+                if len(summary['errors']) < 3:
+                    summary['errors'].append(f"Error processing policy {policy.get('id', 'unknown')}: {str(e)}")
+        if results:
+            policy_store.bulk_write_results(results)
+        # The last DynamoDB page has no position; keep the previous one until the shard is done
+        position = next_position or position
+        if not leases.renew(run_id, shard_key, owner, position, summary, lease_seconds):
+            logger.warning(f"Lost the lease on shard {shard_key} of run {run_id}, leaving it to its new owner")
+            return False
+    return leases.complete(run_id, shard_key, owner, summary)
+
+
+def run_shard_worker(source: str, run_id: str, by: str = 'hash', shard_count: int = 16, workers: int = 1,
+                     batch_size: int = 500, lease_seconds: int = LEASE_SECONDS,
+                     table_name: str = 'unpolishedData', results_table: str = 'underwritingResults') -> Dict:
+    """
+    Claim and underwrite shards of a run until none are left, with workers
+    claiming threads in this process. Returns this process's share of the
+    work and the merged summary of the whole run.
+    """
+    if source == 'postgres':
+        import render_underwriter
+        store = PostgresPolicyStore(max_connections=workers + 1)
+        if not store.setup():
+            raise RuntimeError("Failed to setup database tables")
+        get_rules()  # fails early on a missing or broken rules.txt
+
+        def current_rules():
+            rules = get_rules()
+            return (lambda policy: render_underwriter.apply_underwriting_rules(policy, rules.content, rules.rule_set),
+                    rules.version)
+        fields = None
+    else:
+        import underwriter
+        store = None
+        DynamoPolicyStore(table_name, results_table).results  # creates the results table up front
+
+        def current_rules():
+            rules_content, version = underwriter.current_rules()
+            return lambda policy: underwriter.apply_underwriting_rules(policy, rules_content), version
+        fields = underwriter.POLICY_FIELDS
+
+    leases = open_leases(source, store)
+    leases.register(run_id, plan_shards(source, by, shard_count, store))
+
+    def claim_loop():
+        owner = worker_name()
+        done, lost = [], []
+        while True:
+            claim = leases.claim(run_id, owner, lease_seconds)
+            if claim is None:
+                return done, lost
+            logger.info(f"{owner} claimed shard {claim['shard_key']} of run {run_id}")
+            policy_store = shard_store(source, claim['shard_key'], table_name, results_table, workers + 1)
+            finished = _underwrite_shard(policy_store, leases, run_id, claim, owner, current_rules, fields,
+                                         batch_size, lease_seconds)
+            (done if finished else lost).append(claim['shard_key'])
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        outcomes = [future.result() for future in [executor.submit(claim_loop) for _ in range(workers)]]
+
+    return {
+        'run_id': run_id,
+        'shards_completed_here': sorted(key for done, _ in outcomes for key in done),
+        'shards_lost_here': sorted(key for _, lost in outcomes for key in lost),
+        'run': merge_summaries(leases.shards(run_id))
+    }
+
+
+def run_summary(source: str, run_id: str) -> Dict:
+    store = PostgresPolicyStore() if source == 'postgres' else None
+    shards = open_leases(source, store).shards(run_id)
+    return {'run_id': run_id, 'run': merge_summaries(shards),
+            'shards': [{key: shard[key] for key in ('shard_key', 'status', 'owner')} for shard in shards]}
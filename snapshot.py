@@ -0,0 +1,416 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, Optional, Set
+
+import numpy as np
+
+from construction import MIX_FIELD, SCHEDULE_KEYS, mix_json, policy_schedule
+
+logger = logging.getLogger(__name__)
+
+# Where the memory-mapped columnar copies of the policy book live, one
+# directory per source. Each refresh writes its columns to a new version
+# directory and then swaps manifest.json to point at it.
+SNAPSHOT_DIR = os.getenv("POLICY_SNAPSHOT_DIR", ".policy_snapshot")
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = ".lock"
+POSTGRES_SOURCE = "postgres:policies"
+# Tries at mapping the columns when refreshes prune the version being read
+LOAD_ATTEMPTS = 3
+# A Postgres row's updated_at is its transaction's start time, so a row can
+# commit after a refresh with a timestamp older than that refresh's
+# watermark. Each refresh re-reads this far behind the watermark.
+SNAPSHOT_OVERLAP_SECONDS = float(os.getenv("SNAPSHOT_OVERLAP_SECONDS", 300))
+
+# Columns the rule engines read. Numeric columns are float64 with NaN for
+# missing values so every column can be memory-mapped as a plain .npy file.
+NUMERIC_COLUMNS = ['tiv', 'total_premium', 'oldest_building', 'winnability', 'loss_value']
+# construction_mix is the building schedule aggregated by construction type
+# (construction.mix_json), derived from raw_data rather than read as a column
+STRING_COLUMNS = ['id', 'line_of_business', 'construction_type', 'primary_risk_state',
+                  'renewal_or_new_business', MIX_FIELD]
+SNAPSHOT_COLUMNS = STRING_COLUMNS + NUMERIC_COLUMNS
+# What to read from the source to build a row
+SOURCE_COLUMNS = [name for name in SNAPSHOT_COLUMNS if name != MIX_FIELD]
+HASH_COLUMN = '_row_hash'
+# Rows per round trip when streaming policies out of PostgreSQL
+POSTGRES_FETCH_SIZE = 5000
+# Rows converted to dicts per column read in iter_snapshot_policies
+ITER_CHUNK_ROWS = 10000
+
+
+def source_dir(snapshot_dir: str, source: str) -> str:
+    """Directory of one source's snapshot; each source keeps its own copy of the book"""
+    safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in source)
+    return os.path.join(snapshot_dir, safe_name)
+
+
+def dynamodb_source(table_name: str) -> str:
+    return f"dynamodb:{table_name}"
+
+
+def _column_path(data_dir: str, name: str) -> str:
+    return os.path.join(data_dir, f"{name}.npy")
+
+
+def _normalize_row(policy: dict) -> dict:
+    """Reduce a policy (DynamoDB item or Postgres row) to the snapshot columns"""
+    row = {}
+    for name in STRING_COLUMNS:
+        value = policy.get(name)
+        row[name] = '' if value is None else str(value)
+    if not row[MIX_FIELD]:
+        row[MIX_FIELD] = mix_json(policy_schedule(policy))
+    for name in NUMERIC_COLUMNS:
+        value = policy.get(name)
+        try:
+            row[name] = float(value) if value is not None else float('nan')
+        except (TypeError, ValueError):
+            row[name] = float('nan')
+    return row
+
+
+def _row_hash(row: dict) -> bytes:
+    # repr of the tuple is unambiguous (strings are quoted, floats round-trip) and cheaper than JSON
+    payload = repr(tuple(row[name] for name in SNAPSHOT_COLUMNS))
+    # Hex digest: numpy 'S' arrays strip trailing NUL bytes from raw digests
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest().encode('ascii')
+
+
+@contextmanager
+def _refresh_lock(directory: str):
+    """Exclusive lock on a source's snapshot, held for the whole of a refresh"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "a+") as f:
+        try:
+            import fcntl
+        except ImportError:
+            # Windows: lock the first byte instead
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            return
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_manifest(directory: str) -> Optional[Dict]:
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _latest_source_dir(snapshot_dir: str) -> Optional[str]:
+    """The source directory refreshed most recently"""
+    if not os.path.isdir(snapshot_dir):
+        return None
+    refreshed = []
+    for name in os.listdir(snapshot_dir):
+        manifest = _read_manifest(os.path.join(snapshot_dir, name))
+        if manifest is not None:
+            refreshed.append((manifest.get('refreshed_at', ''), os.path.join(snapshot_dir, name)))
+    return max(refreshed)[1] if refreshed else None
+
+
+def load_snapshot(snapshot_dir: str = SNAPSHOT_DIR, source: Optional[str] = None) -> Optional[Dict]:
+    """
+    Memory-map the snapshot of source (the most recently refreshed source when
+    None). Returns None if there is no snapshot yet. The columns are those of
+    the version the manifest pointed to when it was read, whatever refreshes
+    happen meanwhile.
+    """
+    directory = source_dir(snapshot_dir, source) if source else _latest_source_dir(snapshot_dir)
+    if directory is None:
+        return None
+
+    for attempt in range(LOAD_ATTEMPTS):
+        manifest = _read_manifest(directory)
+        if manifest is None:
+            return None
+        if manifest.get('columns') != SNAPSHOT_COLUMNS or 'data_dir' not in manifest:
+            # Written with other columns or layout; treated as missing so the next refresh rebuilds it in full
+            logger.info(f"Snapshot in {directory} has a different layout, ignoring it")
+            return None
+        data_dir = os.path.join(directory, manifest['data_dir'])
+        try:
+            columns = {name: np.load(_column_path(data_dir, name), mmap_mode='r')
+                       for name in SNAPSHOT_COLUMNS + [HASH_COLUMN]}
+        except FileNotFoundError:
+            # Pruned by refreshes between reading the manifest and the columns; read the new manifest
+            if attempt == LOAD_ATTEMPTS - 1:
+                raise
+            continue
+        return {'manifest': manifest, 'columns': columns}
+
+
+def iter_snapshot_policies(snapshot: Dict, chunk_size: int = ITER_CHUNK_ROWS) -> Iterator[dict]:
+    """
+    Yield policy dicts from a loaded snapshot in the shape the rule engines
+    expect. The dicts are copies, built a chunk of rows at a time; vectorized
+    callers (whatif) read snapshot['columns'] directly instead.
+    """
+    columns = snapshot['columns']
+    row_count = snapshot['manifest']['row_count']
+    for start in range(0, row_count, chunk_size):
+        stop = min(start + chunk_size, row_count)
+        strings = [(name, columns[name][start:stop].tolist()) for name in STRING_COLUMNS]
+        numbers = [(name, columns[name][start:stop].tolist()) for name in NUMERIC_COLUMNS]
+        for i in range(stop - start):
+            # Missing values are left out so the engines' .get() defaults apply,
+            # exactly as they do for sparse DynamoDB items
+            policy = {}
+            for name, values in strings:
+                if values[i]:
+                    policy[name] = values[i]
+            for name, values in numbers:
+                value = values[i]
+                if value != value:
+                    continue
+                policy[name] = int(value) if value.is_integer() else value
+            yield policy
+
+
+def _column_array(name: str, values: list) -> np.ndarray:
+    if name in NUMERIC_COLUMNS:
+        return np.array(values, dtype=np.float64)
+    if name == HASH_COLUMN:
+        return np.array(values, dtype='S32')
+    return np.array(values, dtype=f"U{max([len(v) for v in values] + [1])}")
+
+
+def _new_data_dir(directory: str, version: int) -> str:
+    # Unique even if a crashed refresh left a directory for this version behind
+    return tempfile.mkdtemp(prefix=f"v{version:06d}-", dir=directory)
+
+
+def _write_manifest(directory: str, manifest: dict):
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def _prune_versions(directory: str, keep: Set[str]):
+    """
+    Remove the version directories a refresh left behind. The one before the
+    current version is kept too, for readers that read the manifest just
+    before it was swapped.
+    """
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith('v') and name not in keep and os.path.isdir(path):
+            # Readers that still map the files keep them alive (and Windows refuses to delete them)
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def refresh_snapshot(policies: Iterable[dict], snapshot_dir: str = SNAPSHOT_DIR,
+                     source: str = 'unknown', watermark: Optional[str] = None,
+                     complete: bool = False, live_ids: Optional[Iterable[str]] = None,
+                     live_count: Optional[int] = None) -> Dict:
+    """
+    Merge policies into the snapshot of source. Only incoming policies are
+    normalized and hashed; existing rows are never materialized. The merged
+    columns are written to a new version directory with NumPy (slice,
+    patch, append) from the mapped arrays, reusing the stored hashes and
+    hard-linking the columns no change touches, and readers are switched
+    over by replacing the manifest. Refreshes of a source are serialized
+    by a file lock.
+    complete means policies is the whole book, so rows missing from it were
+    deleted at the source; live_ids does the same for incremental sources by
+    streaming every id the source still has. It is not read when live_count,
+    the number of rows at the source, shows nothing was deleted.
+    """
+    directory = source_dir(snapshot_dir, source)
+    with _refresh_lock(directory):
+        return _refresh(policies, directory, source, watermark, complete, live_ids, live_count)
+
+
+def _refresh(policies: Iterable[dict], directory: str, source: str, watermark: Optional[str],
+             complete: bool, live_ids: Optional[Iterable[str]], live_count: Optional[int]) -> Dict:
+    """refresh_snapshot with the source's lock held"""
+    stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+    previous = _read_manifest(directory)
+    snapshot = load_snapshot(os.path.dirname(directory), source)
+
+    if snapshot is None:
+        rows = [_normalize_row(p) for p in policies]
+        stats['inserted'] = len(rows)
+        manifest = {
+            'version': previous['version'] + 1 if previous and 'version' in previous else 1,
+            'columns': SNAPSHOT_COLUMNS,
+            'source': source,
+            'row_count': len(rows),
+            'watermark': watermark,
+            'refreshed_at': datetime.now().isoformat()
+        }
+        data_dir = _new_data_dir(directory, manifest['version'])
+        for name in SNAPSHOT_COLUMNS:
+            np.save(_column_path(data_dir, name), _column_array(name, [r[name] for r in rows]))
+        np.save(_column_path(data_dir, HASH_COLUMN), _column_array(HASH_COLUMN, [_row_hash(r) for r in rows]))
+        manifest['data_dir'] = os.path.basename(data_dir)
+        _write_manifest(directory, manifest)
+        _prune_versions(directory, {manifest['data_dir']})
+        return stats
+
+    manifest = snapshot['manifest']
+    columns = snapshot['columns']
+    row_count = manifest['row_count']
+    old_data_dir = os.path.join(directory, manifest['data_dir'])
+    # Whole-column reads: indexing the memory map element by element is far slower
+    ids = columns['id'][:row_count].tolist()
+    positions = dict(zip(ids, range(row_count)))
+    stored_hashes = columns[HASH_COLUMN][:row_count].tolist()
+
+    # Changed existing rows by position and new rows by id, each as (row, hash)
+    updates, inserts = {}, {}
+    seen = set()
+    for policy in policies:
+        row = _normalize_row(policy)
+        row_hash = _row_hash(row)
+        seen.add(row['id'])
+        position = positions.get(row['id'])
+        if position is None:
+            inserts[row['id']] = (row, row_hash)
+        elif stored_hashes[position] != row_hash:
+            updates[position] = (row, row_hash)
+    stats['inserted'] = len(inserts)
+    stats['updated'] = len(updates)
+    stats['unchanged'] = len(seen) - len(inserts) - len(updates)
+
+    deleted = []
+    if complete:
+        deleted = [i for i, policy_id in enumerate(ids) if policy_id not in seen]
+    elif live_ids is not None and live_count != row_count + len(inserts):
+        # Streamed, so only a flag per snapshot row is held, not the source's ids
+        alive = np.zeros(row_count, dtype=bool)
+        for policy_id in live_ids:
+            position = positions.get(str(policy_id))
+            if position is not None:
+                alive[position] = True
+        deleted = [i for i, policy_id in enumerate(ids) if not alive[i] and policy_id not in seen]
+    stats['deleted'] = len(deleted)
+
+    def patch_values(name):
+        return [row[name] for row, _ in updates.values()]
+
+    def hash_values(entries):
+        return [row_hash for _, row_hash in entries]
+
+    if updates or inserts or deleted:
+        manifest['version'] += 1
+        data_dir = _new_data_dir(directory, manifest['version'])
+        update_positions = np.fromiter(updates, dtype=np.int64, count=len(updates))
+        keep_mask = np.ones(row_count, dtype=bool)
+        keep_mask[deleted] = False
+        for name in SNAPSHOT_COLUMNS + [HASH_COLUMN]:
+            if name == HASH_COLUMN:
+                patched = _column_array(name, hash_values(updates.values()))
+                appended = _column_array(name, hash_values(inserts.values()))
+            else:
+                patched = _column_array(name, patch_values(name))
+                appended = _column_array(name, [row[name] for row, _ in inserts.values()])
+            existing = columns[name][:row_count]
+            if not inserts and not deleted and np.array_equal(existing[update_positions], patched,
+                                                             equal_nan=name in NUMERIC_COLUMNS):
+                # No change touches this column: share the file with the previous version
+                os.link(_column_path(old_data_dir, name), _column_path(data_dir, name))
+                continue
+            dtype = np.result_type(existing.dtype, patched.dtype, appended.dtype)
+            merged = existing.astype(dtype)
+            merged[update_positions] = patched
+            np.save(_column_path(data_dir, name), np.concatenate([merged[keep_mask], appended]))
+        manifest['data_dir'] = os.path.basename(data_dir)
+        row_count = row_count - len(deleted) + len(inserts)
+    del snapshot, columns
+
+    manifest['row_count'] = row_count
+    manifest['watermark'] = watermark or manifest.get('watermark')
+    manifest['refreshed_at'] = datetime.now().isoformat()
+    _write_manifest(directory, manifest)
+    _prune_versions(directory, {manifest['data_dir'], os.path.basename(old_data_dir)})
+
+    logger.info(f"Snapshot of {source} refreshed to version {manifest['version']}: {stats}")
+    return stats
+
+
+def refresh_snapshot_from_dynamodb(table, snapshot_dir: str = SNAPSHOT_DIR) -> Dict:
+    """Refresh the table's snapshot from DynamoDB (full scan of the snapshot
+    columns and building schedules only, only changed rows are written).
+    Policies no longer in the table are removed from the snapshot."""
+    from dynamo_scan import scan_pages
+
+    def scan_items():
+        for items, _ in scan_pages(table, SOURCE_COLUMNS + SCHEDULE_KEYS):
+            yield from items
+
+    return refresh_snapshot(scan_items(), snapshot_dir, source=dynamodb_source(table.name), complete=True)
+
+
+def refresh_snapshot_from_postgres(conn, snapshot_dir: str = SNAPSHOT_DIR) -> Dict:
+    """Refresh the snapshot from PostgreSQL, reading only rows updated since
+    SNAPSHOT_OVERLAP_SECONDS before the last watermark. Everything is read
+    in one REPEATABLE READ transaction, so the watermark, the row count and
+    the rows agree. Rows and, when the count shows deletions, ids are
+    streamed through server-side cursors rather than fetched at once."""
+    directory = source_dir(snapshot_dir, POSTGRES_SOURCE)
+    with _refresh_lock(directory):
+        snapshot = load_snapshot(snapshot_dir, POSTGRES_SOURCE)
+        watermark = snapshot['manifest'].get('watermark') if snapshot else None
+        snapshot_exists = snapshot is not None
+        del snapshot
+
+        # Start a transaction of our own; SET TRANSACTION must be its first statement
+        conn.commit()
+        cursor = conn.cursor()
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        cursor.execute("SELECT MAX(updated_at), COUNT(*) FROM policies")
+        latest_updated, live_count = cursor.fetchone()
+        latest = latest_updated.isoformat() if latest_updated is not None else watermark
+        cursor.close()
+
+        column_list = ", ".join(SOURCE_COLUMNS + ['raw_data'])
+        where, params = "", []
+        if watermark:
+            where = " WHERE updated_at > %s"
+            params.append(datetime.fromisoformat(watermark) - timedelta(seconds=SNAPSHOT_OVERLAP_SECONDS))
+
+        cursor = conn.cursor(name="snapshot_refresh")
+        cursor.itersize = POSTGRES_FETCH_SIZE
+        cursor.execute(f"SELECT {column_list} FROM policies{where}", params)
+
+        def rows():
+            for record in cursor:
+                yield dict(zip(SOURCE_COLUMNS + ['raw_data'], record))
+            cursor.close()
+
+        def ids():
+            # Deleted rows leave no updated_at behind, so compare ids instead (an index-only scan)
+            id_cursor = conn.cursor(name="snapshot_refresh_ids")
+            id_cursor.itersize = POSTGRES_FETCH_SIZE * 4
+            id_cursor.execute("SELECT id FROM policies")
+            for record in id_cursor:
+                yield record[0]
+            id_cursor.close()
+
+        try:
+            return _refresh(rows(), directory, POSTGRES_SOURCE, latest, False,
+                            ids() if snapshot_exists else None, live_count)
+        finally:
+            conn.rollback()
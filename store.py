@@ -0,0 +1,886 @@
+"""
+Data access shared by the agents, the batch jobs and read.py.
+
+Connection settings, table creation, Decimal conversion, the PostgreSQL
+schema and the result formats live here, along with a PolicyStore
+interface with DynamoDB and PostgreSQL backends:
+
+    iter_policies(batch_size)     batches of policies plus a resumable position
+    bulk_upsert(policies)         write policies in batches
+    bulk_write_results(results)   write underwriting decisions in batches
+
+The backends own connection reuse (one boto3 resource per thread, a shared
+low-level client, a PostgreSQL connection pool), batching and retries
+(DynamoDB calls are paced and retried by throughput.py, PostgreSQL
+operations are retried on dropped connections).
+
+Connection settings come from the environment (DYNAMODB_ENDPOINT_URL,
+AWS_REGION, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, POSTGRES_URL) and
+default to the local DynamoDB used during development.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, date
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from logging_setup import PolicyErrorLog
+from throughput import get_controller, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+DYNAMODB_ENDPOINT_URL = os.getenv("DYNAMODB_ENDPOINT_URL", "http://localhost:8123")
+AWS_REGION = os.getenv("AWS_REGION", "us-west-2")
+AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID", "fakeMyKeyId")
+AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", "fakeSecretAccessKey")
+# Enough HTTP connections for the batch workers and parallel scan segments
+DYNAMODB_MAX_POOL_CONNECTIONS = int(os.getenv("DYNAMODB_MAX_POOL_CONNECTIONS", 50))
+POSTGRES_URL = os.getenv("POSTGRES_URL")
+POSTGRES_RETRIES = 3
+# Seconds a caller waits for a pooled connection while other jobs hold them all
+POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", 300))
+# underwriting_results is partitioned by underwritten_at month; partitions
+# older than this are detached by apply_result_retention
+RESULTS_RETENTION_MONTHS = int(os.getenv("RESULTS_RETENTION_MONTHS", 24))
+RESULT_PARTITIONS_AHEAD = 2
+# Bumped with every change to migrate_schema
+SCHEMA_VERSION = 1
+
+_local = threading.local()
+_client = None
+_client_lock = threading.Lock()
+_known_tables = set()
+
+
+def _boto_config():
+    from botocore.config import Config
+    return Config(max_pool_connections=DYNAMODB_MAX_POOL_CONNECTIONS, tcp_keepalive=True,
+                  retries={'mode': 'standard'})
+
+
+def _session():
+    import boto3
+    return boto3.Session(
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_REGION
+    )
+
+
+def get_dynamodb_resource():
+    """DynamoDB resource for the calling thread (boto3 resources are not thread-safe)"""
+    resource = getattr(_local, 'dynamodb', None)
+    if resource is None:
+        resource = _local.dynamodb = _session().resource(
+            'dynamodb', endpoint_url=DYNAMODB_ENDPOINT_URL, config=_boto_config()
+        )
+    return resource
+
+
+def get_dynamodb_client():
+    """Shared low-level DynamoDB client (clients are thread-safe)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = _session().client('dynamodb', endpoint_url=DYNAMODB_ENDPOINT_URL, config=_boto_config())
+        return _client
+
+
+def get_dynamodb_streams_client():
+    """Low-level DynamoDB Streams client with the same connection settings"""
+    return _session().client('dynamodbstreams', endpoint_url=DYNAMODB_ENDPOINT_URL, config=_boto_config())
+
+
+def get_dynamodb_table(table_name: str = 'unpolishedData', key_name: Optional[str] = None):
+    """DynamoDB table for the calling thread. With key_name, the table is
+    created (on-demand billing, string hash key) if it does not exist."""
+    dynamodb = get_dynamodb_resource()
+    if key_name and table_name not in _known_tables:
+        client = get_dynamodb_client()
+        try:
+            client.describe_table(TableName=table_name)
+        except client.exceptions.ResourceNotFoundException:
+            try:
+                dynamodb.create_table(
+                    TableName=table_name,
+                    KeySchema=[{'AttributeName': key_name, 'KeyType': 'HASH'}],
+                    AttributeDefinitions=[{'AttributeName': key_name, 'AttributeType': 'S'}],
+                    BillingMode='PAY_PER_REQUEST'
+                )
+            except client.exceptions.ResourceInUseException:
+                # Another process created it first
+                pass
+            dynamodb.Table(table_name).wait_until_exists()
+        _known_tables.add(table_name)
+    return dynamodb.Table(table_name)
+
+
+def get_results_table(results_table: str = 'underwritingResults'):
+    """Get the underwriting results table, creating it if it does not exist"""
+    return get_dynamodb_table(results_table, key_name='policy_id')
+
+
+def convert_decimals(obj):
+    """Convert DynamoDB Decimal values to floats"""
+    if isinstance(obj, dict):
+        return {k: convert_decimals(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_decimals(v) for v in obj]
+    elif isinstance(obj, Decimal):
+        return float(obj)
+    else:
+        return obj
+
+
+# Conversion function for DynamoDB compatibility
+def convert_floats_to_decimals(obj):
+    if isinstance(obj, dict):
+        return {k: convert_floats_to_decimals(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_floats_to_decimals(v) for v in obj]
+    elif isinstance(obj, float):
+        return Decimal(str(obj))
+    elif isinstance(obj, str):
+        try:
+            if '.' in obj and obj.replace('.', '').replace('-', '').isdigit():
+                return Decimal(obj)
+        except:
+            pass
+        return obj
+    else:
+        return obj
+
+
+def build_result_item(policy_id: str, policy_data: dict, decision: str, reasoning: str,
+                      rules_version: Optional[str] = None) -> dict:
+    """Build the results-table item for one underwriting decision"""
+    item = {
+        'policy_id': policy_id,
+        'policy_data': json.dumps(policy_data, default=str),
+        'classification': decision,
+        'reasoning': reasoning,
+        'timestamp': datetime.now().isoformat(),
+        'rules_applied': 'Automatic rule-based assessment'
+    }
+    if rules_version:
+        item['rules_version'] = rules_version
+    return item
+
+
+def get_postgres_connection():
+    """Get PostgreSQL connection to Render database"""
+    import psycopg2
+    try:
+        conn = psycopg2.connect(POSTGRES_URL)
+        return conn
+    except Exception as e:
+        logger.error(f"Error connecting to PostgreSQL: {e}")
+        raise
+
+
+def setup_database_tables():
+    """
+    Bring the schema up to SCHEMA_VERSION and create the coming months' result
+    partitions. When both are already in place this is a few catalog reads and
+    takes no locks, so every job can call it on start; otherwise the DDL runs
+    under a transaction-level advisory lock, so concurrent starts migrate once.
+    """
+    try:
+        conn = get_postgres_connection()
+        cursor = conn.cursor()
+        
+        if schema_version(cursor) == SCHEMA_VERSION and not missing_result_partitions(cursor):
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return True
+        
+        # Held until commit; whoever waited re-reads the version the holder left behind
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('setup_database_tables'))")
+        version = schema_version(cursor)
+        if version < SCHEMA_VERSION:
+            logger.info(f"Migrating the database schema from version {version} to {SCHEMA_VERSION}")
+            migrate_schema(cursor)
+        ensure_result_partitions(cursor)
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        logger.info("Database tables created/verified successfully")
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error setting up database tables: {e}")
+        return False
+
+
+def schema_version(cursor) -> int:
+    """Version recorded by migrate_schema; 0 for databases set up before versioning"""
+    # A pg_tables query rather than to_regclass: after waiting on the advisory lock,
+    # to_regclass can still resolve through a catalog cache that predates the table
+    cursor.execute("SELECT COUNT(*) FROM pg_tables WHERE schemaname = current_schema() AND tablename = 'schema_version'")
+    if cursor.fetchone()[0] == 0:
+        return 0
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    return cursor.fetchone()[0] or 0
+
+
+def migrate_schema(cursor):
+    """All the DDL, idempotent; run by setup_database_tables under its advisory lock"""
+    # Create policies table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS policies (
+            id VARCHAR(50) PRIMARY KEY,
+            tiv BIGINT,
+            total_premium DECIMAL(15,2),
+            line_of_business VARCHAR(100),
+            construction_type VARCHAR(50),
+            primary_risk_state VARCHAR(10),
+            oldest_building INTEGER,
+            winnability INTEGER,
+            renewal_or_new_business VARCHAR(20),
+            loss_value DECIMAL(15,2),
+            created_at TIMESTAMP,
+            effective_date TIMESTAMP,
+            expiration_date TIMESTAMP,
+            account_name VARCHAR(200),
+            raw_data JSONB,
+            inserted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    # Older databases were created before updated_at existed
+    cursor.execute("ALTER TABLE policies ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;")
+
+    # Results from before partitioning are copied into the partitioned table
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('underwriting_results')")
+    existing = cursor.fetchone()
+    unpartitioned = existing is not None and existing[0] == 'r'
+    if unpartitioned:
+        cursor.execute("CREATE TEMP TABLE underwriting_results_copy ON COMMIT DROP AS "
+                       "SELECT * FROM underwriting_results")
+        cursor.execute("DROP TABLE underwriting_results")
+
+    # Create underwriting results table, one partition per underwritten_at month.
+    # The partition key has to be part of the primary key, so "one row per
+    # policy" is kept by RESULT_UPSERT_SQL under RESULT_LOCK_SQL rather than by
+    # a unique constraint.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS underwriting_results (
+            id BIGSERIAL,
+            policy_id VARCHAR(50) NOT NULL REFERENCES policies(id),
+            classification VARCHAR(20) NOT NULL,
+            reasoning TEXT,
+            tiv BIGINT,
+            total_premium DECIMAL(15,2),
+            line_of_business VARCHAR(100),
+            construction_type VARCHAR(50),
+            primary_risk_state VARCHAR(10),
+            oldest_building INTEGER,
+            renewal_or_new_business VARCHAR(20),
+            rules_version VARCHAR(50),
+            underwritten_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (policy_id, underwritten_at)
+        ) PARTITION BY RANGE (underwritten_at);
+    """)
+    cursor.execute("CREATE TABLE IF NOT EXISTS underwriting_results_default "
+                   "PARTITION OF underwriting_results DEFAULT")
+
+    # Create indexes for better performance. The results indexes cover the
+    # summary aggregates and the recent-results listing (index-only scans)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_policies_state ON policies(primary_risk_state);
+        CREATE INDEX IF NOT EXISTS idx_policies_state_id ON policies(primary_risk_state, id);
+        CREATE INDEX IF NOT EXISTS idx_policies_tiv ON policies(tiv);
+        CREATE INDEX IF NOT EXISTS idx_policies_line_of_business ON policies(line_of_business);
+        CREATE INDEX IF NOT EXISTS idx_policies_updated_at ON policies(updated_at);
+        CREATE INDEX IF NOT EXISTS idx_policies_id_hash ON policies ((hashtext(id) & 2147483647), id);
+        CREATE INDEX IF NOT EXISTS idx_results_classification_covering
+            ON underwriting_results (classification) INCLUDE (tiv, total_premium);
+        CREATE INDEX IF NOT EXISTS idx_results_recent
+            ON underwriting_results (underwritten_at DESC) INCLUDE (policy_id, classification, primary_risk_state, tiv);
+    """)
+
+    # New and changed policies are announced on policy_changes for streaming
+    # underwriting (see streaming.py); unchanged upserts stay silent
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION notify_policy_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('policy_changes', NEW.id);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS policies_notify_insert ON policies;
+        CREATE TRIGGER policies_notify_insert AFTER INSERT ON policies
+            FOR EACH ROW EXECUTE FUNCTION notify_policy_change();
+        DROP TRIGGER IF EXISTS policies_notify_update ON policies;
+        CREATE TRIGGER policies_notify_update AFTER UPDATE ON policies
+            FOR EACH ROW WHEN (OLD.raw_data IS DISTINCT FROM NEW.raw_data)
+            EXECUTE FUNCTION notify_policy_change();
+    """)
+
+    # Shard leases of sharded underwriting runs (see sharding.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS underwriting_shards (
+            run_id VARCHAR(100) NOT NULL,
+            shard_key VARCHAR(100) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            owner VARCHAR(200),
+            lease_expires_at TIMESTAMP,
+            position TEXT,
+            summary JSONB,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (run_id, shard_key)
+        );
+    """)
+
+    first_month = None
+    if unpartitioned:
+        cursor.execute("SELECT MIN(underwritten_at) FROM underwriting_results_copy")
+        first_month = cursor.fetchone()[0]
+    ensure_result_partitions(cursor, first_month)
+    if unpartitioned:
+        cursor.execute("""
+            INSERT INTO underwriting_results (
+                policy_id, classification, reasoning, tiv, total_premium, line_of_business,
+                construction_type, primary_risk_state, oldest_building, renewal_or_new_business,
+                rules_version, underwritten_at
+            )
+            SELECT policy_id, classification, reasoning, tiv, total_premium, line_of_business,
+                   construction_type, primary_risk_state, oldest_building, renewal_or_new_business,
+                   rules_version, COALESCE(underwritten_at, CURRENT_TIMESTAMP)
+            FROM underwriting_results_copy
+            WHERE policy_id IS NOT NULL
+        """)
+        logger.info(f"Moved {cursor.rowcount} underwriting results into the partitioned table")
+
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    cursor.execute("DELETE FROM schema_version")
+    cursor.execute("INSERT INTO schema_version (version) VALUES (%s)", (SCHEMA_VERSION,))
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def result_partition_name(month: date) -> str:
+    return f"underwriting_results_{month:%Y_%m}"
+
+
+def missing_result_partitions(cursor, months_ahead: int = RESULT_PARTITIONS_AHEAD) -> bool:
+    """True when a partition ensure_result_partitions would create for this month onwards is missing"""
+    current = date.today().replace(day=1)
+    names = [result_partition_name(_add_months(current, n)) for n in range(months_ahead + 1)]
+    cursor.execute("SELECT COUNT(*) FROM pg_tables WHERE schemaname = current_schema() AND tablename = ANY(%s)",
+                   (names,))
+    return cursor.fetchone()[0] < len(names)
+
+
+def ensure_result_partitions(cursor, first_month=None, months_ahead: int = RESULT_PARTITIONS_AHEAD):
+    """Create the monthly underwriting_results partitions from first_month
+    (default: this month) through months_ahead months from now. Rows that
+    landed in the default partition for a new month are moved into it."""
+    current = date.today().replace(day=1)
+    month = first_month.replace(day=1) if first_month else current
+    if isinstance(month, datetime):
+        month = month.date()
+    last = _add_months(current, months_ahead)
+    while month <= last:
+        name = result_partition_name(month)
+        upper = _add_months(month, 1)
+        # pg_tables, not to_regclass, for the same reason as in schema_version
+        cursor.execute("SELECT COUNT(*) FROM pg_tables WHERE schemaname = current_schema() AND tablename = %s",
+                       (name,))
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(f"CREATE TABLE {name} (LIKE underwriting_results INCLUDING DEFAULTS)")
+            cursor.execute(f"""
+                WITH moved AS (
+                    DELETE FROM underwriting_results_default
+                    WHERE underwritten_at >= %s AND underwritten_at < %s
+                    RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+            """, (month, upper))
+            cursor.execute(f"ALTER TABLE underwriting_results ATTACH PARTITION {name} "
+                           f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')")
+            logger.info(f"Created partition {name}")
+        month = upper
+
+
+def apply_result_retention(conn, retention_months: int = RESULTS_RETENTION_MONTHS, drop: bool = False) -> List[str]:
+    """Detach (or drop) the underwriting_results partitions for months older
+    than retention_months. Detached partitions stay as plain tables, so the
+    history can still be archived or queried. Returns the partition names."""
+    cutoff = _add_months(date.today().replace(day=1), -retention_months)
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'underwriting_results'::regclass
+            ORDER BY c.relname
+        """)
+        expired = [name for (name,) in cursor.fetchall()
+                   if name != 'underwriting_results_default' and name < result_partition_name(cutoff)]
+        for name in expired:
+            cursor.execute(f"ALTER TABLE underwriting_results DETACH PARTITION {name}")
+            if drop:
+                cursor.execute(f"DROP TABLE {name}")
+    conn.commit()
+    if expired:
+        logger.info(f"{'Dropped' if drop else 'Detached'} result partitions: {', '.join(expired)}")
+    return expired
+
+
+# Non-negative hash of a policy id (hashtext is signed); hash shards are ranges
+# of it, read through idx_policies_id_hash
+ID_HASH_SQL = "(hashtext({id}) & 2147483647)"
+ID_HASH_RANGE = 2 ** 31
+
+
+POLICY_UPSERT_SQL = """
+    INSERT INTO policies (
+        id, tiv, total_premium, line_of_business, construction_type,
+        primary_risk_state, oldest_building, winnability, 
+        renewal_or_new_business, loss_value, created_at, 
+        effective_date, expiration_date, account_name, raw_data
+    ) VALUES (
+        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+    ) ON CONFLICT (id) DO UPDATE SET
+        tiv = EXCLUDED.tiv,
+        total_premium = EXCLUDED.total_premium,
+        line_of_business = EXCLUDED.line_of_business,
+        construction_type = EXCLUDED.construction_type,
+        primary_risk_state = EXCLUDED.primary_risk_state,
+        oldest_building = EXCLUDED.oldest_building,
+        winnability = EXCLUDED.winnability,
+        renewal_or_new_business = EXCLUDED.renewal_or_new_business,
+        loss_value = EXCLUDED.loss_value,
+        created_at = EXCLUDED.created_at,
+        effective_date = EXCLUDED.effective_date,
+        expiration_date = EXCLUDED.expiration_date,
+        account_name = EXCLUDED.account_name,
+        raw_data = EXCLUDED.raw_data,
+        updated_at = CURRENT_TIMESTAMP
+    -- Unchanged policies keep their updated_at, so snapshot refreshes skip them
+    WHERE (policies.tiv, policies.total_premium, policies.line_of_business, policies.construction_type,
+           policies.primary_risk_state, policies.oldest_building, policies.winnability,
+           policies.renewal_or_new_business, policies.loss_value, policies.created_at,
+           policies.effective_date, policies.expiration_date, policies.account_name, policies.raw_data)
+        IS DISTINCT FROM
+          (EXCLUDED.tiv, EXCLUDED.total_premium, EXCLUDED.line_of_business, EXCLUDED.construction_type,
+           EXCLUDED.primary_risk_state, EXCLUDED.oldest_building, EXCLUDED.winnability,
+           EXCLUDED.renewal_or_new_business, EXCLUDED.loss_value, EXCLUDED.created_at,
+           EXCLUDED.effective_date, EXCLUDED.expiration_date, EXCLUDED.account_name, EXCLUDED.raw_data)
+"""
+
+
+# Per-policy advisory locks for a batch of results, taken in key order so
+# concurrent batches cannot deadlock. Without them two writers could both
+# delete nothing and both insert, since no unique constraint spans partitions.
+# A statement of its own: RESULT_UPSERT_SQL's delete must run with a snapshot
+# taken after the locks are granted, or it misses the other writer's row.
+RESULT_LOCK_SQL = """
+    SELECT pg_advisory_xact_lock(lock_key)
+    FROM (SELECT DISTINCT hashtext(policy_id) AS lock_key FROM unnest(%s::TEXT[]) AS policy_id
+          ORDER BY lock_key) AS keys
+"""
+
+
+# Replaces the policy's previous result, which may sit in an older month's partition
+RESULT_UPSERT_SQL = """
+    WITH new_result (
+        policy_id, classification, reasoning, tiv, total_premium,
+        line_of_business, construction_type, primary_risk_state,
+        oldest_building, renewal_or_new_business, rules_version
+    ) AS (VALUES (
+        %s::VARCHAR, %s::VARCHAR, %s::TEXT, %s::BIGINT, %s::DECIMAL, %s::VARCHAR,
+        %s::VARCHAR, %s::VARCHAR, %s::INTEGER, %s::VARCHAR, %s::VARCHAR
+    )), replaced AS (
+        DELETE FROM underwriting_results r USING new_result n WHERE r.policy_id = n.policy_id
+    )
+    INSERT INTO underwriting_results (
+        policy_id, classification, reasoning, tiv, total_premium,
+        line_of_business, construction_type, primary_risk_state,
+        oldest_building, renewal_or_new_business, rules_version
+    ) SELECT * FROM new_result
+"""
+
+
+# Attributes policy_row reads, for scans that skip the rest of the item
+POLICY_COLUMNS = ['id', 'tiv', 'total_premium', 'line_of_business', 'construction_type', 'primary_risk_state',
+                  'oldest_building', 'winnability', 'renewal_or_new_business', 'loss_value', 'created_at',
+                  'effective_date', 'expiration_date', 'account_name']
+
+
+def policy_row(policy_data: dict) -> tuple:
+    """Parameters for POLICY_UPSERT_SQL from a Decimal-free policy dict"""
+    return (
+        str(policy_data.get('id')),
+        policy_data.get('tiv'),
+        policy_data.get('total_premium'),
+        policy_data.get('line_of_business'),
+        policy_data.get('construction_type'),
+        policy_data.get('primary_risk_state'),
+        policy_data.get('oldest_building'),
+        policy_data.get('winnability'),
+        policy_data.get('renewal_or_new_business'),
+        policy_data.get('loss_value'),
+        policy_data.get('created_at'),
+        policy_data.get('effective_date'),
+        policy_data.get('expiration_date'),
+        policy_data.get('account_name'),
+        json.dumps(policy_data)
+    )
+
+
+def result_rules_version(result: dict) -> str:
+    """The rules version a result dict was decided under; every stored decision must name one"""
+    version = result.get('rules_version')
+    if not version:
+        raise ValueError(f"Underwriting result for policy {result['policy'].get('id')} has no rules_version")
+    return version
+
+
+def result_row(policy: dict, decision: str, reasoning: str, rules_version: str) -> tuple:
+    """Parameters for RESULT_UPSERT_SQL for one underwriting decision"""
+    if not rules_version:
+        raise ValueError(f"Underwriting result for policy {policy.get('id')} has no rules_version")
+    return (
+        str(policy['id']), decision, reasoning, policy.get('tiv'), 
+        policy.get('total_premium'), policy.get('line_of_business'),
+        policy.get('construction_type'), policy.get('primary_risk_state'),
+        policy.get('oldest_building'), policy.get('renewal_or_new_business'),
+        rules_version
+    )
+
+
+def write_policy_batch(conn, policies: list, error_log: Optional[PolicyErrorLog] = None) -> tuple:
+    """Upsert a batch of DynamoDB policies in one transaction. If the batch
+    fails, fall back to row-by-row commits so one bad policy does not sink
+    the rest. Returns (migrated_count, error_messages)."""
+    from psycopg2.extras import execute_batch
+    rows = [policy_row(convert_decimals(policy)) for policy in policies]
+    try:
+        with conn.cursor() as cursor:
+            execute_batch(cursor, POLICY_UPSERT_SQL, rows, page_size=len(rows) or 1)
+        conn.commit()
+        return len(rows), []
+    except Exception:
+        conn.rollback()
+
+    migrated_count = 0
+    errors = []
+    for policy, row in zip(policies, rows):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(POLICY_UPSERT_SQL, row)
+            conn.commit()
+            migrated_count += 1
+        except Exception as e:
+            conn.rollback()
+            error_msg = f"Error migrating policy {policy.get('id')}: {str(e)}"
+            errors.append(error_msg)
+            if error_log:
+                error_log.error(error_msg, e)
+            else:
+                logger.error(error_msg)
+    return migrated_count, errors
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class BlockingConnectionPool:
+    """
+    psycopg2's ThreadedConnectionPool, except that getconn waits for a free
+    connection instead of raising PoolError once all are out. Stores of the
+    same size share a pool, so concurrent jobs take turns rather than fail.
+    """
+
+    def __init__(self, max_connections: int, url: str, timeout: float = POSTGRES_POOL_TIMEOUT):
+        from psycopg2.pool import ThreadedConnectionPool
+        self._pool = ThreadedConnectionPool(1, max_connections, url)
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self.timeout = timeout
+
+    @property
+    def closed(self) -> bool:
+        return self._pool.closed
+
+    def getconn(self):
+        from psycopg2.pool import PoolError
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(f"No pooled connection free after {self.timeout:.0f}s")
+        try:
+            return self._pool.getconn()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close: bool = False):
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+def get_postgres_pool(max_connections: int = 4, url: Optional[str] = None, readonly: bool = False):
+    """Shared blocking connection pool per database URL, size and access mode"""
+    key = (url or POSTGRES_URL, max_connections, readonly)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.closed:
+            pool = _pools[key] = BlockingConnectionPool(max_connections, key[0])
+        return pool
+
+
+def close_postgres_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            if not pool.closed:
+                pool.closeall()
+        _pools.clear()
+
+
+class PolicyStore:
+    """
+    Where policies are read from and where decisions are written. Backends
+    are interchangeable for the batch jobs and benchmarks.
+    """
+    name = None
+
+    def iter_policies(self, batch_size: int = 500, fields: Optional[List[str]] = None,
+                      start_after: Any = None) -> Iterator[Tuple[List[dict], Any]]:
+        """
+        Yield (policies, position) one batch at a time, policies as plain dicts
+        limited to fields (all attributes when None). Passing a position
+        back as start_after resumes after that batch; None marks the last batch
+        for stores that cannot tell otherwise.
+        """
+        raise NotImplementedError
+
+    def bulk_upsert(self, policies: List[dict], error_log: Optional[PolicyErrorLog] = None) -> Tuple[int, List[str]]:
+        """Insert or replace policies; returns (written_count, error_messages)"""
+        raise NotImplementedError
+
+    def bulk_write_results(self, results: List[dict]) -> int:
+        """
+        Store underwriting decisions, one dict per policy with 'policy',
+        'decision', 'reasoning' and 'rules_version' (ValueError without one).
+        Returns the number written.
+        """
+        raise NotImplementedError
+
+    def estimate_count(self) -> Optional[int]:
+        """Approximate number of policies, cheap to get (no scan); None if unknown"""
+        return None
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DynamoPolicyStore(PolicyStore):
+    """Policies and results in DynamoDB; calls are paced to the tables' capacity"""
+    name = 'dynamo'
+
+    def __init__(self, table_name: str = 'unpolishedData', results_table: str = 'underwritingResults',
+                 segment: Optional[int] = None, total_segments: int = 1):
+        self.table_name = table_name
+        self.results_table = results_table
+        self.segment = segment
+        self.total_segments = total_segments
+
+    @property
+    def table(self):
+        return get_dynamodb_table(self.table_name)
+
+    @property
+    def results(self):
+        return get_results_table(self.results_table)
+
+    def iter_policies(self, batch_size: int = 500, fields: Optional[List[str]] = None,
+                      start_after: Any = None) -> Iterator[Tuple[List[dict], Any]]:
+        # Positions are DynamoDB LastEvaluatedKeys; the last page has none
+        from dynamo_scan import scan_pages
+        yield from scan_pages(self.table, fields, batch_size, start_after,
+                              self.segment, self.total_segments, get_dynamodb_client())
+
+    def bulk_upsert(self, policies: List[dict], error_log: Optional[PolicyErrorLog] = None) -> Tuple[int, List[str]]:
+        items = [{**convert_floats_to_decimals(policy), 'id': str(policy['id'])} for policy in policies]
+        table = get_dynamodb_table(self.table_name, key_name='id')
+        return get_controller(table).batch_write(table, items, ['id']), []
+
+    def bulk_write_results(self, results: List[dict]) -> int:
+        items = [build_result_item(str(r['policy'].get('id', 'unknown')), r['policy'], r['decision'], r['reasoning'],
+                                   result_rules_version(r))
+                 for r in results]
+        table = self.results
+        return get_controller(table).batch_write(table, items, ['policy_id'])
+
+    def estimate_count(self) -> Optional[int]:
+        # DynamoDB refreshes ItemCount about every six hours
+        try:
+            return get_dynamodb_client().describe_table(TableName=self.table_name)['Table'].get('ItemCount')
+        except Exception as e:
+            logger.warning(f"Could not read the item count of {self.table_name}: {e}")
+            return None
+
+    def capacity_stats(self) -> Dict:
+        return {
+            self.table_name: get_controller(self.table).stats(),
+            self.results_table: get_controller(self.results).stats()
+        }
+
+
+class PostgresPolicyStore(PolicyStore):
+    """
+    Policies and results in PostgreSQL through a shared connection pool.
+    Operations that fail on a dropped connection are retried on a fresh one.
+    """
+    name = 'postgres'
+
+    def __init__(self, url: Optional[str] = None, max_connections: int = 4,
+                 where: Optional[Tuple[str, tuple]] = None, readonly: bool = False,
+                 order_key: Optional[str] = None):
+        self.url = url or POSTGRES_URL
+        self.max_connections = max_connections
+        # Read-only stores get a pool of their own, so queries never wait behind a running job
+        self.readonly = readonly
+        # (condition, params) limiting iter_policies to part of the book, e.g. one shard
+        self.where = where
+        # Expression of {id} that iter_policies pages by ahead of id, for conditions
+        # served by an index on (expression, id) such as ID_HASH_SQL ranges
+        self.order_key = order_key
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = get_postgres_pool(self.max_connections, self.url, self.readonly)
+        return self._pool
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection; broken connections are discarded, not returned"""
+        import psycopg2
+        conn = self.pool.getconn()
+        broken = False
+        try:
+            if self.readonly and not conn.readonly:
+                conn.set_session(readonly=True)
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if not broken and not conn.closed:
+                conn.rollback()
+            self.pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def run(self, operation):
+        """Call operation(conn) on a pooled connection, retrying dropped connections"""
+        import psycopg2
+        for attempt in range(POSTGRES_RETRIES + 1):
+            try:
+                with self.connection() as conn:
+                    return operation(conn)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if attempt == POSTGRES_RETRIES:
+                    raise
+                logger.warning(f"PostgreSQL connection lost ({e}), retrying")
+                time.sleep(backoff_delay(attempt))
+
+    def setup(self) -> bool:
+        return setup_database_tables()
+
+    def estimate_count(self) -> Optional[int]:
+        # The planner's estimate, kept current by autovacuum; negative before the first ANALYZE
+        def query(conn):
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT reltuples::BIGINT FROM pg_class WHERE oid = to_regclass('policies')")
+                row = cursor.fetchone()
+            return int(row[0]) if row and row[0] is not None and row[0] > 0 else None
+        try:
+            return self.run(query)
+        except Exception as e:
+            logger.warning(f"Could not estimate the number of policies: {e}")
+            return None
+
+    def iter_policies(self, batch_size: int = 500, fields: Optional[List[str]] = None,
+                      start_after: Any = None) -> Iterator[Tuple[List[dict], Any]]:
+        # Keyset pagination over the primary key (or order_key, id); positions are the last policy id
+        from psycopg2.extras import RealDictCursor
+        columns = "*"
+        if fields:
+            columns = ", ".join(['id'] + [f for f in fields if f != 'id' and f in POLICY_COLUMNS])
+
+        def fetch(last_id):
+            conditions, params = [], []
+            if self.where:
+                conditions.append(self.where[0])
+                params.extend(self.where[1])
+            if last_id is not None and self.order_key:
+                conditions.append(f"({self.order_key.format(id='id')}, id) > ({self.order_key.format(id='%s')}, %s)")
+                params.extend([last_id, last_id])
+            elif last_id is not None:
+                conditions.append("id > %s")
+                params.append(last_id)
+            where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+            order = f"{self.order_key.format(id='id')}, id" if self.order_key else "id"
+
+            def query(conn):
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute(f"SELECT {columns} FROM policies {where}ORDER BY {order} LIMIT %s",
+                                   (*params, batch_size))
+                    return [dict(row) for row in cursor.fetchall()]
+            return self.run(query)
+
+        last_id = start_after
+        while True:
+            policies = fetch(last_id)
+            if not policies:
+                break
+            last_id = str(policies[-1]['id'])
+            yield policies, last_id
+
+    def bulk_upsert(self, policies: List[dict], error_log: Optional[PolicyErrorLog] = None) -> Tuple[int, List[str]]:
+        return self.run(lambda conn: write_policy_batch(conn, policies, error_log))
+
+    def bulk_write_results(self, results: List[dict]) -> int:
+        from psycopg2.extras import execute_batch
+        rows = [result_row(r['policy'], r['decision'], r['reasoning'], result_rules_version(r))
+                for r in results]
+
+        def write(conn):
+            with conn.cursor() as cursor:
+                cursor.execute(RESULT_LOCK_SQL, ([row[0] for row in rows],))
+                execute_batch(cursor, RESULT_UPSERT_SQL, rows, page_size=len(rows) or 1)
+            conn.commit()
+            return len(rows)
+        return self.run(write)
+
+
+def open_store(backend: str, **kwargs) -> PolicyStore:
+    """PolicyStore for 'dynamo' or 'postgres'"""
+    stores = {'dynamo': DynamoPolicyStore, 'postgres': PostgresPolicyStore}
+    if backend not in stores:
+        raise ValueError(f"Unknown policy store: {backend}")
+    return stores[backend](**kwargs)
@@ -0,0 +1,289 @@
+"""
+Streaming underwriting: score policies as they arrive instead of waiting for
+the next full run.
+
+    dynamo    reads the policies table's DynamoDB Stream (enabled with
+              NEW_IMAGE if the table has none), every shard polled in turn
+    postgres  LISTENs on policy_changes, which the policies triggers
+              notify on inserts and on updates that change raw_data
+
+Each new or changed policy is scored with the rule engine of its batch path
+(underwriter.py for DynamoDB, render_underwriter.py for PostgreSQL) using
+the rules current when its batch of changes arrived, so edits to rules.txt
+apply without restarting the consumer (see rulebook.py). Decisions go to a ResultSink that writes them
+with bulk_write_results once flush_size are pending or the oldest has waited
+flush_ms, so latency stays sub-second without one write per policy.
+
+NOTIFY is not durable and streams start at the latest record, so policies
+that arrive while no consumer is running are picked up by the next batch
+run (or by --from-start on DynamoDB, within the stream's 24h retention).
+
+    python batch.py stream --source dynamo
+    python batch.py stream --source postgres --flush-ms 100
+"""
+import time
+import logging
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from store import DynamoPolicyStore, PostgresPolicyStore, get_dynamodb_client, get_dynamodb_streams_client
+from throughput import backoff_delay
+from rulebook import get_rules
+
+logger = logging.getLogger(__name__)
+
+POLICY_CHANNEL = 'policy_changes'
+POLL_SECONDS = 0.2
+SHARD_REFRESH_SECONDS = 10.0
+LATENCY_SAMPLES = 10000
+
+
+class ResultSink:
+    """
+    Buffers decisions and writes them through a PolicyStore in batches. A
+    policy scored twice before a flush is written once, with its latest
+    decision.
+    """
+
+    def __init__(self, policy_store, flush_size: int = 100, flush_ms: int = 200):
+        self.policy_store = policy_store
+        self.flush_size = flush_size
+        self.flush_seconds = flush_ms / 1000
+        self.pending = {}
+        self.oldest = None
+        self.flushes = 0
+        self.written = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def add(self, policy: dict, decision: str, reasoning: str, received_at: float,
+            rules_version: Optional[str] = None):
+        if not self.pending:
+            self.oldest = received_at
+        self.pending[str(policy.get('id'))] = ({'policy': policy, 'decision': decision, 'reasoning': reasoning,
+                                                'rules_version': rules_version}, received_at)
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+
+    def due(self) -> bool:
+        return bool(self.pending) and time.monotonic() - self.oldest >= self.flush_seconds
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = list(self.pending.values()), {}
+        self.written += self.policy_store.bulk_write_results([result for result, _ in pending])
+        self.flushes += 1
+        written_at = time.monotonic()
+        self.latencies.extend(written_at - received_at for _, received_at in pending)
+
+    def latency_ms(self) -> Dict:
+        """Time from a change arriving to its decision being stored"""
+        if not self.latencies:
+            return {}
+        ordered = sorted(self.latencies)
+
+        def percentile(p):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 1)
+        return {'p50': percentile(0.5), 'p95': percentile(0.95), 'max': round(ordered[-1] * 1000, 1)}
+
+
+def enable_stream(table_name: str) -> str:
+    """Stream ARN of the table, enabling a NEW_IMAGE stream if it has none"""
+    client = get_dynamodb_client()
+    description = client.describe_table(TableName=table_name)['Table']
+    specification = description.get('StreamSpecification') or {}
+    if not specification.get('StreamEnabled'):
+        logger.info(f"Enabling a NEW_IMAGE stream on {table_name}")
+        description = client.update_table(
+            TableName=table_name,
+            StreamSpecification={'StreamEnabled': True, 'StreamViewType': 'NEW_IMAGE'}
+        )['TableDescription']
+    elif specification.get('StreamViewType') not in ('NEW_IMAGE', 'NEW_AND_OLD_IMAGES'):
+        raise RuntimeError(f"The stream on {table_name} is {specification.get('StreamViewType')}; "
+                           f"streaming underwriting needs NEW_IMAGE or NEW_AND_OLD_IMAGES")
+    stream_arn = description['LatestStreamArn']
+    streams = get_dynamodb_streams_client()
+    while streams.describe_stream(StreamArn=stream_arn)['StreamDescription']['StreamStatus'] != 'ENABLED':
+        time.sleep(1)
+    return stream_arn
+
+
+def _list_shards(streams, stream_arn: str) -> List[dict]:
+    shards, kwargs = [], {'StreamArn': stream_arn}
+    while True:
+        description = streams.describe_stream(**kwargs)['StreamDescription']
+        shards.extend(description['Shards'])
+        if not description.get('LastEvaluatedShardId'):
+            return shards
+        kwargs['ExclusiveStartShardId'] = description['LastEvaluatedShardId']
+
+
+def dynamo_stream_changes(table_name: str, from_start: bool = False,
+                          poll_seconds: float = POLL_SECONDS) -> Iterator[List[Tuple[dict, float]]]:
+    """
+    Yield the (policy, received_at) pairs of each polling round, possibly
+    none, so the caller can flush on time. Shards that open later (splits,
+    rollover) are read from their start, so no record is skipped.
+    """
+    from dynamo_scan import deserialize_item
+
+    streams = get_dynamodb_streams_client()
+    stream_arn = enable_stream(table_name)
+    iterators, last_sequence, known = {}, {}, set()
+    refreshed = None
+    first_listing = True
+
+    def refresh():
+        nonlocal first_listing
+        for shard in _list_shards(streams, stream_arn):
+            shard_id = shard['ShardId']
+            if shard_id in known:
+                continue
+            known.add(shard_id)
+            closed = 'EndingSequenceNumber' in shard['SequenceNumberRange']
+            if first_listing and closed and not from_start:
+                continue
+            iterator_type = 'LATEST' if first_listing and not from_start else 'TRIM_HORIZON'
+            iterators[shard_id] = streams.get_shard_iterator(
+                StreamArn=stream_arn, ShardId=shard_id, ShardIteratorType=iterator_type)['ShardIterator']
+        first_listing = False
+
+    while True:
+        if refreshed is None or time.monotonic() - refreshed >= SHARD_REFRESH_SECONDS:
+            refresh()
+            refreshed = time.monotonic()
+        changes = []
+        for shard_id in list(iterators):
+            for attempt in range(8):
+                try:
+                    response = streams.get_records(ShardIterator=iterators[shard_id], Limit=1000)
+                    break
+                except streams.exceptions.ExpiredIteratorException:
+                    kwargs = {'ShardIteratorType': 'TRIM_HORIZON'}
+                    if shard_id in last_sequence:
+                        kwargs = {'ShardIteratorType': 'AFTER_SEQUENCE_NUMBER',
+                                  'SequenceNumber': last_sequence[shard_id]}
+                    iterators[shard_id] = streams.get_shard_iterator(
+                        StreamArn=stream_arn, ShardId=shard_id, **kwargs)['ShardIterator']
+                except streams.exceptions.LimitExceededException:
+                    time.sleep(backoff_delay(attempt))
+            else:
+                continue
+            received_at = time.monotonic()
+            for record in response['Records']:
+                last_sequence[shard_id] = record['dynamodb']['SequenceNumber']
+                if record['eventName'] in ('INSERT', 'MODIFY') and 'NewImage' in record['dynamodb']:
+                    changes.append((deserialize_item(record['dynamodb']['NewImage']), received_at))
+            if response.get('NextShardIterator'):
+                iterators[shard_id] = response['NextShardIterator']
+            else:
+                # Closed shard fully read; its children turn up on the next refresh
+                del iterators[shard_id]
+                refreshed = None
+        yield changes
+        if not changes:
+            time.sleep(poll_seconds)
+
+
+def postgres_changes(policy_store: PostgresPolicyStore,
+                     poll_seconds: float = POLL_SECONDS) -> Iterator[List[Tuple[dict, float]]]:
+    """
+    Yield the (policy, received_at) pairs notified on policy_changes since
+    the last round, possibly none. Notified ids are looked up in one query.
+    """
+    import select
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
+    listener = psycopg2.connect(policy_store.url)
+    listener.autocommit = True
+    try:
+        with listener.cursor() as cursor:
+            cursor.execute(f"LISTEN {POLICY_CHANNEL}")
+        while True:
+            received = {}
+            if select.select([listener], [], [], poll_seconds) != ([], [], []):
+                listener.poll()
+                received_at = time.monotonic()
+                for notification in listener.notifies:
+                    received.setdefault(notification.payload, received_at)
+                listener.notifies.clear()
+            if not received:
+                yield []
+                continue
+
+            def fetch(conn):
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute("SELECT * FROM policies WHERE id = ANY(%s)", (list(received),))
+                    return [dict(row) for row in cursor.fetchall()]
+            yield [(policy, received[str(policy['id'])]) for policy in policy_store.run(fetch)]
+    finally:
+        listener.close()
+
+
+def run_stream(source: str, table_name: str = 'unpolishedData', results_table: str = 'underwritingResults',
+               flush_size: int = 100, flush_ms: int = 200, from_start: bool = False,
+               max_events: Optional[int] = None, duration: Optional[float] = None,
+               poll_seconds: float = POLL_SECONDS) -> Dict:
+    """
+    Score policy changes as they arrive until max_events have been scored,
+    duration seconds have passed, or the process is interrupted. Returns
+    counts and the change-to-stored latency.
+    """
+    if source == 'postgres':
+        import render_underwriter
+        policy_store = PostgresPolicyStore()
+        if not policy_store.setup():
+            raise RuntimeError("Failed to setup database tables")
+        get_rules()  # fails early on a missing or broken rules.txt
+
+        def current_rules():
+            rules = get_rules()
+            return (lambda policy: render_underwriter.apply_underwriting_rules(policy, rules.content, rules.rule_set),
+                    rules.version)
+        changes = postgres_changes(policy_store, poll_seconds)
+    else:
+        import underwriter
+        policy_store = DynamoPolicyStore(table_name, results_table)
+        policy_store.results  # creates the results table up front
+
+        def current_rules():
+            rules_content, version = underwriter.current_rules()
+            return lambda policy: underwriter.apply_underwriting_rules(policy, rules_content), version
+        changes = dynamo_stream_changes(table_name, from_start, poll_seconds)
+
+    sink = ResultSink(policy_store, flush_size, flush_ms)
+    stats = {'command': 'stream', 'source': source, 'total_processed': 0, 'safe_count': 0,
+             'not_safe_count': 0, 'error_count': 0, 'errors': [], 'rules_versions': []}
+    started = time.monotonic()
+    logger.info(f"Streaming underwriting on {source} started")
+    try:
+        for batch in changes:
+            # Edits to rules.txt apply from the next batch of changes on
+            apply_rules, version = current_rules()
+            if version not in stats['rules_versions']:
+                stats['rules_versions'].append(version)
+            for policy, received_at in batch:
+                try:
+                    decision, reasoning = apply_rules(policy)
+                    sink.add(policy, decision, reasoning, received_at, version)
+                    stats['total_processed'] += 1
+                    stats['safe_count' if decision == 'SAFE' else 'not_safe_count'] += 1
+                except Exception as e:
+                    stats['error_count'] += 1
+                    if len(stats['errors']) < 3:
+                        stats['errors'].append(f"Error processing policy {policy.get('id', 'unknown')}: {str(e)}")
+            if sink.due():
+                sink.flush()
+            if max_events is not None and stats['total_processed'] >= max_events:
+                break
+            if duration is not None and time.monotonic() - started >= duration:
+                break
+    except KeyboardInterrupt:
+        logger.info("Streaming underwriting interrupted")
+    finally:
+        sink.flush()
+        changes.close()
+
+    stats.update(written=sink.written, flushes=sink.flushes, latency_ms=sink.latency_ms())
+    return stats
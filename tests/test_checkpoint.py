@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from checkpoint import clear_checkpoint, load_checkpoint, save_checkpoint
+
+
+def test_save_load_clear(tmp_path):
+    directory = str(tmp_path)
+    assert load_checkpoint('scan', directory) is None
+    save_checkpoint('scan', {'last_key': {'id': {'S': 'P1'}}, 'processed': 10}, directory)
+    state = load_checkpoint('scan', directory)
+    assert state['last_key'] == {'id': {'S': 'P1'}}
+    assert state['processed'] == 10
+    assert 'saved_at' in state
+    clear_checkpoint('scan', directory)
+    assert load_checkpoint('scan', directory) is None
+
+
+def test_save_replaces_atomically(tmp_path):
+    directory = str(tmp_path)
+    save_checkpoint('scan', {'processed': 1}, directory)
+    save_checkpoint('scan', {'processed': 2}, directory)
+    assert load_checkpoint('scan', directory)['processed'] == 2
+    assert not [name for name in os.listdir(directory) if name.endswith('.tmp')]
+
+
+def test_failed_write_keeps_previous_state(tmp_path):
+    directory = str(tmp_path)
+    save_checkpoint('scan', {'processed': 1}, directory)
+    with pytest.raises(TypeError):
+        save_checkpoint('scan', {'processed': Unserializable()}, directory)
+    assert load_checkpoint('scan', directory)['processed'] == 1
+
+
+class Unserializable:
+    def __str__(self):
+        raise TypeError("not serializable")
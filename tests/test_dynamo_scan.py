@@ -0,0 +1,19 @@
+from decimal import Decimal
+
+from dynamo_scan import deserialize_item, typed_key
+
+
+def test_numeric_ids_round_trip():
+    item = deserialize_item({'id': {'N': '5'}, 'tiv': {'N': '1500000.5'}})
+    assert str(item['id']) == '5'
+    assert item['tiv'] == 1500000.5
+    assert typed_key({'id': item['id']}) == {'id': {'N': '5'}}
+
+
+def test_checkpointed_keys_become_typed():
+    assert typed_key({'id': 'P0000001'}) == {'id': {'S': 'P0000001'}}
+    assert typed_key({'id': {'N': '12'}}) == {'id': {'N': '12'}}
+    # Resource-API checkpoints hold Decimals, older lean-scan ones integral floats
+    assert typed_key({'id': Decimal('12')}) == {'id': {'N': '12'}}
+    assert typed_key({'id': 12.0}) == {'id': {'N': '12'}}
+    assert typed_key(None) is None
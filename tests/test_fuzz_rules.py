@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+import fuzz_rules
+
+SEED = 20261019
+
+
+def assert_agree(run):
+    assert not run['mismatches'], run['mismatches'][:5]
+
+
+def test_backends_agree_with_scalar_engine():
+    run = fuzz_rules.compare_backends(cases=4000, rule_set_count=4, seed=SEED)
+    assert set(run['results']) == {'scalar', 'vectorized', 'snapshot-scalar', 'snapshot-vectorized', 'sqlite'}
+    assert_agree(run)
+
+
+def test_cases_include_building_schedules():
+    run = fuzz_rules.compare_backends(cases=500, rule_set_count=0, seed=SEED)
+    assert any('raw_data' in policy for policy in run['policies'])
+
+
+@pytest.mark.skipif(not os.getenv("POSTGRES_URL"), reason="POSTGRES_URL not set")
+def test_postgres_agrees_with_scalar_engine():
+    assert_agree(fuzz_rules.compare_backends(cases=2000, rule_set_count=2, seed=SEED, postgres=True))
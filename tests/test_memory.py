@@ -0,0 +1,56 @@
+from memory import MemoryProfile, budget_note, would_exceed
+
+
+def test_unknown_estimate_streams_and_is_reported():
+    assert would_exceed(None, max_memory_mb=1024)
+    assert "size estimate unavailable" in budget_note(None, max_memory_mb=1024)
+
+
+def test_known_estimate_or_no_budget_has_no_note():
+    assert not would_exceed(None, max_memory_mb=None)
+    assert budget_note(None, max_memory_mb=None) == ""
+    assert budget_note(10.0, max_memory_mb=1024) == ""
+
+
+def test_stage_around_consuming_loop():
+    profile = MemoryProfile(sample_seconds=60)
+    with profile:
+        with profile.stage('underwrite'):
+            for chunk in (list(range(10000)) for _ in range(3)):
+                sum(chunk)
+    stage, = profile.summary()['stages']
+    assert stage['stage'] == 'underwrite'
+    assert stage['traced_peak_mb'] >= stage['traced_mb']
+
+
+def test_concurrent_profiles_share_tracing():
+    import tracemalloc
+
+    first = MemoryProfile(sample_seconds=60).start()
+    second = MemoryProfile(sample_seconds=60).start()
+    with second.stage('second'):
+        with first.stage('first'):
+            data = [0] * 1000000
+        del data
+        # Stopping one profile leaves tracing on for the other
+        first.stop()
+        assert tracemalloc.is_tracing()
+        data = [0] * 100000
+    second.stop()
+    assert not tracemalloc.is_tracing()
+    first_stage, = first.stages
+    second_stage, = second.stages
+    # The inner stage began after the outer one reset the peak, so neither peak is the traced one
+    assert first_stage['peak_sampled'] and second_stage['peak_sampled']
+    assert "sampled" in second.format_summary()
+
+
+def test_lone_stage_keeps_the_exact_peak():
+    profile = MemoryProfile(sample_seconds=60)
+    with profile:
+        with profile.stage('spike'):
+            data = [0] * 2000000
+            del data
+    stage, = profile.stages
+    assert 'peak_sampled' not in stage
+    assert stage['traced_peak_mb'] >= 15
@@ -0,0 +1,38 @@
+import threading
+import time
+
+from repl import JobManager, background
+
+
+def wait_for(jobs: JobManager, job_id: int):
+    deadline = time.monotonic() + 5
+    while jobs.get(job_id)['status'] in ('queued', 'running') and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_second_job_of_the_same_tool_is_refused():
+    release = threading.Event()
+
+    def auto_underwrite():
+        release.wait(5)
+        return "done"
+
+    def compare():
+        return "compared"
+
+    jobs = JobManager(max_jobs=2)
+    try:
+        start = background(auto_underwrite, jobs)
+        assert start().startswith("Started auto_underwrite as background job 1")
+        assert start() == "Error: auto_underwrite is already running as job 1"
+        # Other tools still run alongside
+        assert background(compare, jobs)().startswith("Started compare as background job 2")
+        release.set()
+        wait_for(jobs, 1)
+        assert jobs.get(1)['result'] == "done"
+        # Once it has finished, the tool can run again
+        assert start().startswith("Started auto_underwrite as background job 3")
+        wait_for(jobs, 3)
+    finally:
+        release.set()
+        jobs.shutdown()
@@ -0,0 +1,96 @@
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('openai')
+
+from review import SecondOpinionReviewer
+
+STANDIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'standin_server.py')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_standin(*extra) -> tuple:
+    port = free_port()
+    server = subprocess.Popen([sys.executable, STANDIN, '--port', str(port), '--policies', '10', *extra],
+                              stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.startswith("Stand-in serving"):
+        server.kill()
+        pytest.fail(f"Stand-in server did not start: {line}")
+    return server, f"http://127.0.0.1:{port}/v1"
+
+
+@pytest.fixture(scope='module')
+def standin():
+    server, base_url = start_standin()
+    yield base_url
+    server.terminate()
+    server.wait()
+
+
+@pytest.fixture(scope='module')
+def slow_standin():
+    server, base_url = start_standin('--llm-latency-ms', '1000')
+    yield base_url
+    server.terminate()
+    server.wait()
+
+
+def candidates(count: int) -> list:
+    return [{'policy_id': f"P{i:07d}", 'decision': 'SAFE', 'borderline_on': ['tiv'],
+             'reasoning': "TIV near the limit", 'tiv': 149000000} for i in range(count)]
+
+
+def reviewer(base_url: str, **kwargs) -> SecondOpinionReviewer:
+    return SecondOpinionReviewer("rules", api_key='test', base_url=base_url, model_id='standin', **kwargs)
+
+
+def test_reviews_every_candidate(standin):
+    second_opinion = reviewer(standin, policies_per_call=4)
+    opinions = second_opinion.review(candidates(10))
+    assert sorted(opinions) == [f"P{i:07d}" for i in range(10)]
+    assert {o['opinion'] for o in opinions.values()} == {'AGREE'}
+    stats = second_opinion.stats
+    assert stats['calls'] == 3
+    assert stats['reviewed'] == 10
+    assert stats['skipped_budget'] == stats['skipped_deadline'] == stats['failed'] == 0
+    assert 0 < stats['tokens_used'] < 50000
+
+
+def test_budget_is_shared_across_calls(standin):
+    # Room for one call of four candidates, not for the rest
+    second_opinion = reviewer(standin, policies_per_call=4, max_tokens=100, token_budget=600,
+                              max_concurrency=1)
+    opinions = second_opinion.review(candidates(4))
+    assert len(opinions) == 4
+    assert second_opinion.review(candidates(8)) == {}
+    assert second_opinion.stats['skipped_budget'] == 8
+    assert second_opinion.tokens_remaining >= 0
+
+
+def test_deadline_skips_unfinished_calls(slow_standin):
+    second_opinion = reviewer(slow_standin, policies_per_call=5, deadline_seconds=0.3)
+    assert second_opinion.review(candidates(10)) == {}
+    assert second_opinion.stats['skipped_deadline'] == 10
+    # Cancelled calls give their reservation back
+    assert second_opinion.tokens_remaining == 50000
+    assert second_opinion.review(candidates(3)) == {}
+    assert second_opinion.stats['skipped_deadline'] == 13
+
+
+def test_failed_calls_are_counted():
+    # Nothing listens on the port, so every call fails
+    second_opinion = reviewer(f"http://127.0.0.1:{free_port()}/v1", policies_per_call=5)
+    assert second_opinion.review(candidates(10)) == {}
+    assert second_opinion.stats['failed'] == 10
+    assert second_opinion.stats['calls'] == 0
+    assert second_opinion.tokens_remaining == 50000
@@ -0,0 +1,19 @@
+import os
+
+from render_underwriter import CURRENT_RULE_SET
+from rulebook import compile_rules
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rules.txt')
+
+
+def test_rules_txt_compiles_to_current_rule_set():
+    # An empty base, so every threshold has to come from the text
+    base = {key: None for key in CURRENT_RULE_SET}
+    base['name'] = CURRENT_RULE_SET['name']
+    with open(RULES_PATH, encoding='utf-8') as f:
+        compiled = compile_rules(f.read(), base)
+    for key, expected in CURRENT_RULE_SET.items():
+        if isinstance(expected, list) and key.startswith(('acceptable', 'declined')):
+            assert sorted(compiled[key]) == sorted(expected), key
+        else:
+            assert compiled[key] == expected, key
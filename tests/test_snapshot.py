@@ -0,0 +1,137 @@
+import os
+import threading
+
+import numpy as np
+
+from snapshot import (HASH_COLUMN, SNAPSHOT_COLUMNS, _normalize_row, _row_hash, iter_snapshot_policies,
+                      load_snapshot, refresh_snapshot, source_dir)
+
+
+def policy(i: int, **fields) -> dict:
+    return {'id': f"P{i:07d}", 'line_of_business': 'PROPERTY', 'primary_risk_state': 'OH',
+            'construction_type': 'Masonry', 'renewal_or_new_business': 'NEW_BUSINESS',
+            'tiv': 1000000 + i, 'total_premium': 80000.5, 'oldest_building': 2000,
+            'winnability': 50, 'loss_value': 0, **fields}
+
+
+def contents(snapshot_dir: str) -> dict:
+    snapshot = load_snapshot(snapshot_dir)
+    return {p['id']: p for p in iter_snapshot_policies(snapshot, chunk_size=3)}
+
+
+def assert_same_as_fresh_build(snapshot_dir: str, book: list, tmp_path):
+    """A refreshed snapshot holds the same rows and hashes as one built from scratch"""
+    fresh_dir = str(tmp_path / 'fresh')
+    refresh_snapshot(book, fresh_dir)
+    assert contents(snapshot_dir) == contents(fresh_dir)
+    refreshed, fresh = load_snapshot(snapshot_dir), load_snapshot(fresh_dir)
+    order = np.argsort(refreshed['columns']['id'][:refreshed['manifest']['row_count']])
+    for name in SNAPSHOT_COLUMNS + [HASH_COLUMN]:
+        expected = fresh['columns'][name][:fresh['manifest']['row_count']]
+        assert np.array_equal(refreshed['columns'][name][order], expected), name
+
+
+def test_refresh_counts_inserts_updates_and_unchanged(tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshot')
+    book = [policy(i) for i in range(10)]
+    assert refresh_snapshot(book, snapshot_dir)['inserted'] == 10
+
+    book[2] = policy(2, tiv=5)
+    stats = refresh_snapshot([book[1], book[2], policy(10)], snapshot_dir)
+    assert stats == {'inserted': 1, 'updated': 1, 'unchanged': 1, 'deleted': 0}
+    book.append(policy(10))
+    assert contents(snapshot_dir)['P0000002']['tiv'] == 5
+    assert_same_as_fresh_build(snapshot_dir, book, tmp_path)
+
+
+def test_update_writes_a_new_version(tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshot')
+    refresh_snapshot([policy(i) for i in range(5)], snapshot_dir)
+    before = load_snapshot(snapshot_dir)
+    stats = refresh_snapshot([policy(3, loss_value=250000)], snapshot_dir)
+    assert stats['updated'] == 1
+    assert contents(snapshot_dir)['P0000003']['loss_value'] == 250000
+    # A reader that mapped the previous version still sees it whole
+    assert before['columns']['loss_value'][3] == 0
+    assert load_snapshot(snapshot_dir)['manifest']['version'] == before['manifest']['version'] + 1
+    directory = source_dir(snapshot_dir, 'unknown')
+    assert not [name for name in os.listdir(directory) if name.endswith('.tmp')]
+
+
+def test_sources_keep_separate_snapshots(tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshot')
+    refresh_snapshot([policy(i) for i in range(3)], snapshot_dir, source='postgres:policies', watermark='2026-01-01')
+    refresh_snapshot([policy(i, tiv=1) for i in range(5)], snapshot_dir, source='dynamodb:book', complete=True)
+    postgres = load_snapshot(snapshot_dir, 'postgres:policies')
+    dynamo = load_snapshot(snapshot_dir, 'dynamodb:book')
+    assert postgres['manifest']['row_count'] == 3
+    assert dynamo['manifest']['row_count'] == 5
+    assert dynamo['manifest']['watermark'] is None
+    # Without a source, the most recently refreshed one
+    assert load_snapshot(snapshot_dir)['manifest']['source'] == 'dynamodb:book'
+
+
+def test_concurrent_refreshes_and_readers_stay_consistent(tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshot')
+    refresh_snapshot([policy(i) for i in range(200)], snapshot_dir)
+    errors = []
+
+    def refresher(offset):
+        try:
+            for round_number in range(15):
+                book = [policy(i, tiv=offset * 1000 + round_number) for i in range(offset, 200 + offset * 10, 2)]
+                refresh_snapshot(book, snapshot_dir)
+        except Exception as e:
+            errors.append(e)
+
+    def reader():
+        try:
+            for _ in range(40):
+                snapshot = load_snapshot(snapshot_dir)
+                rows = list(iter_snapshot_policies(snapshot))
+                assert len(rows) == snapshot['manifest']['row_count']
+                hashes = snapshot['columns'][HASH_COLUMN][:len(rows)].tolist()
+                assert [_row_hash(_normalize_row(row)) for row in rows] == hashes
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=refresher, args=(offset,)) for offset in (1, 2)]
+    threads += [threading.Thread(target=reader) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors
+
+
+def test_complete_refresh_prunes_missing_rows(tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshot')
+    refresh_snapshot([policy(i) for i in range(10)], snapshot_dir)
+    book = [policy(i) for i in range(10) if i not in (0, 4, 9)]
+    stats = refresh_snapshot(book, snapshot_dir, complete=True)
+    assert stats['deleted'] == 3
+    assert stats['unchanged'] == 7
+    assert load_snapshot(snapshot_dir)['manifest']['row_count'] == 7
+    assert_same_as_fresh_build(snapshot_dir, book, tmp_path)
+
+
+def test_partial_refresh_keeps_rows_unless_live_ids_say_otherwise(tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshot')
+    refresh_snapshot([policy(i) for i in range(6)], snapshot_dir)
+    assert refresh_snapshot([policy(1, tiv=7)], snapshot_dir)['deleted'] == 0
+    assert len(contents(snapshot_dir)) == 6
+
+    live_ids = {f"P{i:07d}" for i in (0, 1, 2)}
+    stats = refresh_snapshot([policy(3, tiv=9)], snapshot_dir, live_ids=live_ids)
+    assert stats['deleted'] == 2
+    assert sorted(contents(snapshot_dir)) == ['P0000000', 'P0000001', 'P0000002', 'P0000003']
+    assert_same_as_fresh_build(snapshot_dir, [policy(0), policy(1, tiv=7), policy(2), policy(3, tiv=9)], tmp_path)
+
+
+def test_update_widens_string_columns(tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshot')
+    refresh_snapshot([policy(i) for i in range(4)], snapshot_dir)
+    wide = policy(2, construction_type='Masonry Non Combustible')
+    assert refresh_snapshot([wide], snapshot_dir)['updated'] == 1
+    assert contents(snapshot_dir)['P0000002']['construction_type'] == 'Masonry Non Combustible'
+    assert_same_as_fresh_build(snapshot_dir, [policy(0), policy(1), wide, policy(3)], tmp_path)
@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+
+import pytest
+
+from store import result_row, result_rules_version
+
+requires_postgres = pytest.mark.skipif(not os.getenv("POSTGRES_URL"), reason="POSTGRES_URL not set")
+
+
+def test_results_must_name_their_rules_version():
+    policy = {'id': 'P0000001', 'tiv': 1000000}
+    assert result_row(policy, 'SAFE', 'ok', 'heuristics-v1')[-1] == 'heuristics-v1'
+    with pytest.raises(ValueError):
+        result_row(policy, 'SAFE', 'ok', None)
+    with pytest.raises(ValueError):
+        result_rules_version({'policy': policy, 'decision': 'SAFE', 'reasoning': 'ok'})
+
+
+@requires_postgres
+def test_pool_waits_for_a_free_connection_instead_of_failing():
+    from store import BlockingConnectionPool
+
+    pool = BlockingConnectionPool(2, os.environ["POSTGRES_URL"], timeout=10)
+    held = [pool.getconn(), pool.getconn()]
+    borrowed = []
+
+    def borrow():
+        conn = pool.getconn()
+        borrowed.append(conn)
+        pool.putconn(conn)
+
+    waiter = threading.Thread(target=borrow)
+    waiter.start()
+    time.sleep(0.2)
+    assert not borrowed
+    pool.putconn(held.pop())
+    waiter.join(5)
+    assert len(borrowed) == 1
+    pool.putconn(held.pop())
+    pool.closeall()
+
+
+@requires_postgres
+def test_pool_gives_up_after_its_timeout():
+    from psycopg2.pool import PoolError
+    from store import BlockingConnectionPool
+
+    pool = BlockingConnectionPool(1, os.environ["POSTGRES_URL"], timeout=0.1)
+    conn = pool.getconn()
+    with pytest.raises(PoolError):
+        pool.getconn()
+    pool.putconn(conn)
+    pool.closeall()
+
+
+@requires_postgres
+def test_concurrent_stores_share_a_pool_without_exhausting_it():
+    from store import PostgresPolicyStore
+
+    def query(conn):
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_sleep(0.05)")
+        return True
+
+    stores = [PostgresPolicyStore(), PostgresPolicyStore()]
+    results, errors = [], []
+
+    def job(store):
+        try:
+            for _ in range(3):
+                results.append(store.run(query))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=job, args=(stores[i % 2],)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors
+    assert len(results) == 30
@@ -0,0 +1,44 @@
+import copy
+import random
+
+import numpy as np
+
+import fuzz_rules
+from render_underwriter import CURRENT_RULE_SET, apply_underwriting_rules
+from whatif import extract_features, rule_set_mask
+
+SEED = 20261019
+
+
+def scalar_safe(policies, rule_set):
+    return np.array([apply_underwriting_rules(p, '', rule_set)[0] == 'SAFE' for p in policies])
+
+
+def test_rule_set_mask_matches_scalar_engine():
+    rng = random.Random(SEED)
+    policies = [fuzz_rules.random_policy(rng, i, CURRENT_RULE_SET) for i in range(2000)]
+    rule_sets = [CURRENT_RULE_SET] + [fuzz_rules.random_rule_set(rng, i) for i in range(3)]
+    columns = fuzz_rules.to_columns(policies)
+    features = extract_features(columns, len(policies))
+    for rule_set in rule_sets:
+        expected = scalar_safe(policies, rule_set)
+        assert np.array_equal(rule_set_mask(features, rule_set), expected), rule_set['name']
+
+
+def test_thresholds_are_inclusive_like_scalar_engine():
+    base = {'id': 'P1', 'renewal_or_new_business': 'NEW_BUSINESS', 'line_of_business': 'PROPERTY',
+            'primary_risk_state': 'OH', 'construction_type': 'Masonry'}
+    rule_set = copy.deepcopy(CURRENT_RULE_SET)
+    min_premium, max_premium = rule_set['premium_range']
+    policies = [
+        {**base, 'tiv': rule_set['max_tiv'], 'total_premium': min_premium,
+         'oldest_building': rule_set['min_building_year'], 'loss_value': rule_set['max_loss_value']},
+        {**base, 'tiv': rule_set['max_tiv'] + 1, 'total_premium': max_premium,
+         'oldest_building': 2000, 'loss_value': 0},
+        {**base, 'tiv': 1000000, 'total_premium': max_premium + 0.01,
+         'oldest_building': rule_set['min_building_year'] - 1, 'loss_value': 0},
+        {**base, 'renewal_or_new_business': 'RENEWAL', 'tiv': 1000000, 'total_premium': 80000,
+         'oldest_building': 2000, 'loss_value': 0},
+    ]
+    features = extract_features(fuzz_rules.to_columns(policies), len(policies))
+    assert np.array_equal(rule_set_mask(features, rule_set), scalar_safe(policies, rule_set))
@@ -0,0 +1,274 @@
+"""
+Capacity-aware rate control for DynamoDB calls.
+
+Every scan and write goes through a per-table CapacityController that asks
+for ReturnConsumedCapacity and paces calls with a token bucket, refilled at
+DYNAMODB_TARGET_UTILIZATION of the table's provisioned capacity. A call
+reserves the capacity it is expected to use (a running average per
+operation) and settles the difference once the actual ConsumedCapacity is
+known, so the bucket tracks real usage rather than request counts.
+
+Throttling (ProvisionedThroughputExceededException, unprocessed batch items,
+or botocore having retried internally) cuts the rate; it then climbs back
+slowly to the target, which keeps throughput just under the provisioned
+capacity instead of oscillating around it. Throttled calls are retried with
+full-jitter exponential backoff. Parallel scans take a segment slot per
+page; the number of slots follows the current read rate divided by what one
+segment is observed to consume.
+
+On-demand tables are not paced unless DYNAMODB_READ_CAPACITY /
+DYNAMODB_WRITE_CAPACITY give a ceiling; after a throttle they are paced at
+the throughput observed so far.
+"""
+import os
+import math
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TARGET_UTILIZATION = float(os.getenv("DYNAMODB_TARGET_UTILIZATION", 0.9))
+THROTTLE_ERROR_CODES = {'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'}
+# Rate multiplier after a throttle, and share of the target regained per second afterwards
+DECREASE_FACTOR = 0.75
+RECOVERY_PER_SECOND = 0.05
+MIN_RATE_SHARE = 0.1
+MAX_RETRIES = 8
+BACKOFF_BASE_SECONDS = 0.05
+BACKOFF_CAP_SECONDS = 5.0
+BATCH_WRITE_LIMIT = 25
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def is_throttle_error(exc: BaseException) -> bool:
+    response = getattr(exc, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full jitter: uniform between zero and the capped exponential delay"""
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _consumed_units(response: dict) -> Optional[float]:
+    consumed = response.get('ConsumedCapacity')
+    if consumed is None:
+        return None
+    if isinstance(consumed, list):
+        return sum(entry.get('CapacityUnits', 0) for entry in consumed)
+    return consumed.get('CapacityUnits', 0)
+
+
+class TokenBucket:
+    """
+    Capacity units per second with a one-second burst. rate None means
+    unlimited. Settling can drive the balance negative, which makes the next
+    callers wait until the debt is paid off.
+    """
+
+    def __init__(self, name: str, target_rate: Optional[float]):
+        self.name = name
+        self.target_rate = target_rate
+        self.rate = target_rate
+        self.tokens = target_rate or 0.0
+        self.updated = time.monotonic()
+        self.last_adjusted = self.updated
+        self.estimates = {}
+        self.consumed_total = 0.0
+        self.started = self.updated
+        self.throttles = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if self.rate is not None:
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def estimate(self, operation: str) -> float:
+        return self.estimates.get(operation, 1.0)
+
+    def acquire(self, units: float):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.rate is None or self.tokens >= min(units, self.rate):
+                    self.tokens -= units
+                    return
+                wait = (min(units, self.rate) - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def refund(self, units: float):
+        with self.lock:
+            self.tokens += units
+
+    def settle(self, operation: str, reserved: float, actual: float):
+        with self.lock:
+            self.tokens += reserved - actual
+            self.consumed_total += actual
+            previous = self.estimates.get(operation)
+            self.estimates[operation] = actual if previous is None else 0.8 * previous + 0.2 * actual
+            self._recover(time.monotonic())
+
+    def _recover(self, now: float):
+        if self.rate is not None and self.target_rate is not None and self.rate < self.target_rate:
+            self.rate = min(self.target_rate, self.rate + self.target_rate * RECOVERY_PER_SECOND * (now - self.last_adjusted))
+        self.last_adjusted = now
+
+    def throttled(self):
+        with self.lock:
+            now = time.monotonic()
+            self.throttles += 1
+            if self.target_rate is None:
+                # On-demand: pace at what was sustained before the throttle
+                observed = self.consumed_total / max(now - self.started, 1.0)
+                self.target_rate = max(observed, 1.0)
+                self.rate = self.target_rate
+            self.rate = max(self.target_rate * MIN_RATE_SHARE, self.rate * DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 0.0)
+            self.last_adjusted = now
+        logger.info(f"{self.name} throttled, pacing at {self.rate:.1f} units/s")
+
+
+class CapacityController:
+    """
+    Paced, retried access to one DynamoDB table. The controller is shared by
+    every thread, so it keeps only the table name; each call takes the
+    caller's own Table object (boto3 resources are per thread).
+    """
+
+    def __init__(self, table, read_capacity: Optional[float] = None, write_capacity: Optional[float] = None,
+                 target_utilization: float = TARGET_UTILIZATION, max_segments: int = 16):
+        self.table_name = table.name
+        if read_capacity is None and write_capacity is None:
+            read_capacity, write_capacity = self._provisioned_capacity(table)
+        self.read = TokenBucket(f"{table.name} reads", read_capacity * target_utilization if read_capacity else None)
+        self.write = TokenBucket(f"{table.name} writes", write_capacity * target_utilization if write_capacity else None)
+        self.max_segments = max_segments
+        self.active_segments = 0
+        self.segment_rate = None
+        self.segments_changed = threading.Condition()
+
+    def _provisioned_capacity(self, table):
+        read_env, write_env = os.getenv("DYNAMODB_READ_CAPACITY"), os.getenv("DYNAMODB_WRITE_CAPACITY")
+        if read_env or write_env:
+            return (float(read_env) if read_env else None), (float(write_env) if write_env else None)
+        try:
+            description = table.meta.client.describe_table(TableName=self.table_name)['Table']
+        except Exception as e:
+            logger.warning(f"Could not read provisioned capacity of {self.table_name}, not pacing: {e}")
+            return None, None
+        if description.get('BillingModeSummary', {}).get('BillingMode') == 'PAY_PER_REQUEST':
+            return None, None
+        throughput = description.get('ProvisionedThroughput', {})
+        return throughput.get('ReadCapacityUnits') or None, throughput.get('WriteCapacityUnits') or None
+
+    def _call(self, bucket: TokenBucket, operation: str, method, **kwargs) -> dict:
+        kwargs['ReturnConsumedCapacity'] = 'TOTAL'
+        for attempt in range(MAX_RETRIES + 1):
+            reserved = bucket.estimate(operation)
+            bucket.acquire(reserved)
+            try:
+                response = method(**kwargs)
+            except Exception as e:
+                bucket.refund(reserved)
+                if not is_throttle_error(e) or attempt == MAX_RETRIES:
+                    raise
+                bucket.throttled()
+                time.sleep(backoff_delay(attempt))
+                continue
+            actual = _consumed_units(response)
+            bucket.settle(operation, reserved, reserved if actual is None else actual)
+            if response.get('ResponseMetadata', {}).get('RetryAttempts'):
+                # botocore already retried this call, most likely on a throttle
+                bucket.throttled()
+            return response
+
+    def scan(self, table, **kwargs) -> dict:
+        return self._call(self.read, 'scan', table.scan, **kwargs)
+
+    def scan_client(self, client, **kwargs) -> dict:
+        """Scan through a low-level client (typed attribute values)"""
+        return self._call(self.read, 'scan', client.scan, TableName=self.table_name, **kwargs)
+
+    def put_item(self, table, **kwargs) -> dict:
+        return self._call(self.write, 'put_item', table.put_item, **kwargs)
+
+    def batch_write(self, table, items: List[dict], key_names: List[str]) -> int:
+        """
+        Put items in BatchWriteItem calls of 25. Later items win over earlier
+        ones with the same key, like batch_writer(overwrite_by_pkeys=...).
+        Unprocessed items are retried with backoff. Returns the number written.
+        """
+        unique = {tuple(str(item[k]) for k in key_names): item for item in items}
+        pending = [{'PutRequest': {'Item': item}} for item in unique.values()]
+        client = table.meta.client
+        written = 0
+        for start in range(0, len(pending), BATCH_WRITE_LIMIT):
+            requests = pending[start:start + BATCH_WRITE_LIMIT]
+            for attempt in range(MAX_RETRIES + 1):
+                response = self._call(self.write, 'batch_write_item', client.batch_write_item,
+                                      RequestItems={self.table_name: requests})
+                unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                written += len(requests) - len(unprocessed)
+                if not unprocessed:
+                    break
+                if attempt == MAX_RETRIES:
+                    raise RuntimeError(f"{len(unprocessed)} items still unprocessed after {MAX_RETRIES} retries")
+                self.write.throttled()
+                time.sleep(backoff_delay(attempt))
+                requests = unprocessed
+        return written
+
+    def allowed_segments(self) -> int:
+        """Concurrent scan segments that fit the current read rate"""
+        if self.read.rate is None or not self.segment_rate:
+            return self.max_segments
+        return max(1, min(self.max_segments, math.ceil(self.read.rate / self.segment_rate)))
+
+    @contextmanager
+    def segment_slot(self):
+        """Hold one of allowed_segments() slots for a single parallel-scan page"""
+        with self.segments_changed:
+            while self.active_segments >= self.allowed_segments():
+                self.segments_changed.wait(timeout=1.0)
+            self.active_segments += 1
+        started = time.monotonic()
+        consumed_before = self.read.consumed_total
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self.segments_changed:
+                self.active_segments -= 1
+                if elapsed > 0:
+                    # Rough per-segment demand: what this page consumed over its duration,
+                    # shared with the other segments that ran at the same time
+                    rate = (self.read.consumed_total - consumed_before) / elapsed / (self.active_segments + 1)
+                    self.segment_rate = rate if self.segment_rate is None else 0.8 * self.segment_rate + 0.2 * rate
+                self.segments_changed.notify_all()
+
+    def stats(self) -> Dict:
+        return {
+            'read_rate': self.read.rate,
+            'write_rate': self.write.rate,
+            'read_units': round(self.read.consumed_total, 1),
+            'write_units': round(self.write.consumed_total, 1),
+            'throttles': self.read.throttles + self.write.throttles,
+            'segments': self.allowed_segments()
+        }
+
+
+def get_controller(table) -> CapacityController:
+    """Shared controller per table name, so all threads pace against the same capacity"""
+    with _controllers_lock:
+        controller = _controllers.get(table.name)
+        if controller is None:
+            controller = _controllers[table.name] = CapacityController(table)
+        return controller
@@ -1,42 +1,51 @@
-from strands import Agent, tool
-from strands.models.openai import OpenAIModel
+# Heavy dependencies (strands, boto3) are imported where they are used so that
+# batch jobs can import the rule engine without paying for the agent stack.
 import os
 from dotenv import load_dotenv
-import boto3
 from typing import Optional, Dict, List
-from decimal import Decimal
 import logging
-import json
 import traceback
 from datetime import datetime
+from itertools import islice
+from checkpoint import load_checkpoint, save_checkpoint, clear_checkpoint
+from logging_setup import setup_logging, PolicyErrorLog
+from throughput import get_controller
+from memory import MemoryProfile, would_exceed, budget_note, estimate_dynamodb_mb, estimate_snapshot_mb
+import progress
+from rulebook import get_rules, RulesError, format_rules_versions
+# Connection and conversion helpers live in store; re-exported here for existing callers
+from store import get_dynamodb_table, get_results_table, convert_decimals, build_result_item, DynamoPolicyStore
 
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('auto_underwriter.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
 # API KEYS
 load_dotenv()
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+# Results listed by get_underwriting_summary when it has to stream them
+SUMMARY_DETAIL_LIMIT = 100
+# Attributes apply_underwriting_rules reads; scans fetch only these
+POLICY_FIELDS = ['id', 'tiv', 'total_premium', 'line_of_business', 'construction_type',
+                 'primary_risk_state', 'oldest_building', 'winnability']
+# apply_underwriting_rules is hard-coded and does not evaluate rules.txt, so
+# its decisions are stamped with this rather than the rulebook hash. Bump it
+# whenever the heuristics change.
+HEURISTICS_VERSION = "heuristics-v1"
 
-def get_dynamodb_table(table_name: str = 'unpolishedData'):
-    """Get DynamoDB table connection"""
-    session = boto3.Session(
-        aws_access_key_id='fakeMyKeyId',
-        aws_secret_access_key='fakeSecretAccessKey',
-        region_name="us-west-2"
-    )
-    dynamodb = session.resource(
-        'dynamodb',
-        endpoint_url='http://localhost:8123'
-    )
-    return dynamodb.Table(table_name)
+def read_rules_content(file_path: str = "rules.txt") -> str:
+    """Read the underwriting rules, falling back to the default description"""
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return "Default rules: Basic risk assessment applied"
+
+def current_rules() -> tuple:
+    """(text, version) for apply_underwriting_rules: the live rules.txt, reloaded
+    when it changes, and HEURISTICS_VERSION, since the decisions do not depend on the text"""
+    try:
+        return get_rules().content, HEURISTICS_VERSION
+    except (FileNotFoundError, RulesError):
+        return read_rules_content(), HEURISTICS_VERSION
 
 def apply_underwriting_rules(policy_data: dict, rules_content: str) -> tuple:
     """Apply underwriting rules to a policy and return (decision, reasoning)"""
@@ -135,49 +144,55 @@ def apply_underwriting_rules(policy_data: dict, rules_content: str) -> tuple:
     
     return decision, reasoning
 
-@tool
-def auto_underwrite_all_policies(table_name: str = 'unpolishedData', results_table: str = 'underwritingResults') -> str:
-    """Automatically underwrite all policies and save decisions to database"""
+def auto_underwrite_all_policies(table_name: str = 'unpolishedData', results_table: str = 'underwritingResults',
+                                 use_snapshot: bool = False, batch_size: int = 500, restart: bool = False,
+                                 max_memory_mb: Optional[float] = None, profile_memory: bool = False) -> str:
+    """Automatically underwrite all policies and save decisions to database.
+    The table is scanned one page at a time and the scan position is
+    checkpointed after each page's results are written, so rerunning after a
+    failure resumes where it stopped; restart ignores the checkpoint.
+    Only POLICY_FIELDS are scanned, so the stored policy_data holds those.
+    With use_snapshot, the table's local memory-mapped snapshot is refreshed
+    (only changed policies are rewritten) and the book read from it; when
+    the book would not fit in max_memory_mb (default MAX_MEMORY_MB) it is read
+    from the snapshot in chunks rather than all at once. profile_memory
+    appends RSS and tracemalloc figures to the summary."""
+    profile = MemoryProfile(enabled=profile_memory, max_memory_mb=max_memory_mb)
     try:
-        # Get all policies
-        table = get_dynamodb_table(table_name)
-        response = table.scan()
-        policies = response['Items']
+        job = f"auto_underwrite_all_policies-{table_name}"
+        checkpoint = None if (restart or use_snapshot) else load_checkpoint(job)
         
-        while 'LastEvaluatedKey' in response:
-            response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-            policies.extend(response['Items'])
+        # Get policies one page at a time
+        store = DynamoPolicyStore(table_name, results_table)
+        def policy_pages():
+            if use_snapshot:
+                from snapshot import load_snapshot, iter_snapshot_policies, refresh_snapshot_from_dynamodb, dynamodb_source
+                # Incremental: only changed policies are rewritten, deleted ones dropped
+                snapshot_stats = refresh_snapshot_from_dynamodb(store.table)
+                logger.info(f"Policy snapshot refresh: {snapshot_stats}")
+                snapshot = load_snapshot(source=dynamodb_source(table_name))
+                # Sized from the manifest and column widths, not the remote table
+                if would_exceed(estimate_snapshot_mb(snapshot), max_memory_mb):
+                    rows = iter_snapshot_policies(snapshot)
+                    while True:
+                        policies = list(islice(rows, batch_size))
+                        if not policies:
+                            return
+                        yield policies, None
+                policies = list(iter_snapshot_policies(snapshot))
+                for start in range(0, len(policies), batch_size):
+                    yield policies[start:start + batch_size], None
+                return
+            
+            # Typed scan of the rule engine's attributes only, already in native types
+            start_key = checkpoint['last_evaluated_key'] if checkpoint else None
+            yield from store.iter_policies(batch_size, POLICY_FIELDS, start_key)
         
-        if not policies:
-            return f"No policies found in table {table_name}"
-        
-        # Read underwriting rules
-        try:
-            with open("rules.txt", "r", encoding="utf-8") as f:
-                rules_content = f.read()
-        except FileNotFoundError:
-            rules_content = "Default rules: Basic risk assessment applied"
+        rules_versions = []
         
         # Set up results table
-        session = boto3.Session(
-            aws_access_key_id='fakeMyKeyId',
-            aws_secret_access_key='fakeSecretAccessKey',
-            region_name="us-west-2"
-        )
-        dynamodb = session.resource('dynamodb', endpoint_url='http://localhost:8123')
-        
         try:
-            existing_tables = [t.name for t in dynamodb.tables.all()]
-            if results_table not in existing_tables:
-                results_table_obj = dynamodb.create_table(
-                    TableName=results_table,
-                    KeySchema=[{'AttributeName': 'policy_id', 'KeyType': 'HASH'}],
-                    AttributeDefinitions=[{'AttributeName': 'policy_id', 'AttributeType': 'S'}],
-                    BillingMode='PAY_PER_REQUEST'
-                )
-                results_table_obj.wait_until_exists()
-            else:
-                results_table_obj = dynamodb.Table(results_table)
+            store.results
         except Exception as e:
             return f"Error setting up results table: {e}"
         
@@ -188,48 +203,66 @@ def auto_underwrite_all_policies(table_name: str = 'unpolishedData', results_tab
             'not_safe_count': 0,
             'errors': []
         }
+        if checkpoint:
+            results_summary.update(checkpoint['summary'])
+            results_summary['errors'] = []
+        error_log = PolicyErrorLog(logger)
+        job_progress = progress.current()
+        job_progress.expect(store.estimate_count(), results_summary['total_processed'])
+        
+        profile.start()
+        with profile.stage('underwrite'):
+            for policies, last_key in policy_pages():
+                # Rules fetched per page; the version names the heuristics engine, not rules.txt
+                rules_content, version = current_rules()
+                if version not in rules_versions:
+                    rules_versions.append(version)
+                page_results = []
+                for policy in policies:
+                    try:
+                        policy_id = str(policy.get('id', 'unknown'))
+                    
+                        # Scan pages and snapshot rows already hold floats, not Decimals
+                        policy_data = policy
+                    
+                        # Apply underwriting rules automatically
+                        decision, reasoning = apply_underwriting_rules(policy_data, rules_content)
+                        page_results.append({'policy': policy_data, 'decision': decision, 'reasoning': reasoning,
+                                             'rules_version': version})
+                    
+                        # Update counters
+                        results_summary['total_processed'] += 1
+                        if decision == 'SAFE':
+                            results_summary['safe_count'] += 1
+                        else:
+                            results_summary['not_safe_count'] += 1
+                    
+                        logger.debug(f"Policy {policy_id}: {decision}")
+                    
+                    except Exception as e:
+                        error_msg = f"Error processing policy {policy.get('id', 'unknown')}: {str(e)}"
+                        results_summary['errors'].append(error_msg)
+                        error_log.error(error_msg, e)
+            
+                # Save the page's decisions in paced BatchWriteItem calls
+                store.bulk_write_results(page_results)
+            
+                if last_key:
+                    save_checkpoint(job, {
+                        'last_evaluated_key': last_key,
+                        'summary': {k: v for k, v in results_summary.items() if k != 'errors'}
+                    })
+                # Pauses and cancellations of a background job take effect here, after the checkpoint
+                job_progress.advance(len(policies))
+        
+        if not use_snapshot:
+            # Snapshot runs neither read nor write the scan checkpoint
+            clear_checkpoint(job)
+        error_log.log_summary()
         
-        for policy in policies:
-            try:
-                policy_id = str(policy.get('id', 'unknown'))
-                
-                # Convert Decimal objects
-                def convert_decimals(obj):
-                    if isinstance(obj, dict):
-                        return {k: convert_decimals(v) for k, v in obj.items()}
-                    elif isinstance(obj, Decimal):
-                        return float(obj)
-                    else:
-                        return obj
-                
-                policy_data = convert_decimals(policy)
-                
-                # Apply underwriting rules automatically
-                decision, reasoning = apply_underwriting_rules(policy_data, rules_content)
-                
-                # Save decision to database
-                results_table_obj.put_item(Item={
-                    'policy_id': policy_id,
-                    'policy_data': json.dumps(policy_data, default=str),
-                    'classification': decision,
-                    'reasoning': reasoning,
-                    'timestamp': datetime.now().isoformat(),
-                    'rules_applied': 'Automatic rule-based assessment'
-                })
-                
-                # Update counters
-                results_summary['total_processed'] += 1
-                if decision == 'SAFE':
-                    results_summary['safe_count'] += 1
-                else:
-                    results_summary['not_safe_count'] += 1
-                
-                print(f"Policy {policy_id}: {decision}")
-                
-            except Exception as e:
-                error_msg = f"Error processing policy {policy.get('id', 'unknown')}: {str(e)}"
-                results_summary['errors'].append(error_msg)
-                logger.error(error_msg)
+        profile.stop()
+        if results_summary['total_processed'] == 0 and not results_summary['errors']:
+            return f"No policies found in table {table_name}"
         
         # Generate summary
         summary = f"""
@@ -242,32 +275,52 @@ Total Policies Processed: {results_summary['total_processed']}
 
 Results saved to table: {results_table}
 """
+        summary += format_rules_versions(rules_versions)
+        if checkpoint:
+            summary += "Resumed from checkpoint\n"
         
         if results_summary['errors']:
             summary += "\nErrors encountered:\n" + "\n".join(results_summary['errors'][:3])
         
+        summary += profile.format_summary()
         return summary
         
     except Exception as e:
-        return f"Error in automatic underwriting: {str(e)}"
+        profile.stop()
+        return f"Error in automatic underwriting (progress is checkpointed, rerun to resume): {str(e)}"
 
-@tool
-def get_underwriting_summary(results_table: str = 'underwritingResults') -> str:
-    """Get a summary of all underwriting decisions"""
+def refresh_policy_snapshot(table_name: str = 'unpolishedData') -> str:
+    """Refresh the local policy snapshot from DynamoDB, rewriting only changed policies"""
     try:
-        session = boto3.Session(
-            aws_access_key_id='fakeMyKeyId',
-            aws_secret_access_key='fakeSecretAccessKey',
-            region_name="us-west-2"
-        )
-        dynamodb = session.resource('dynamodb', endpoint_url='http://localhost:8123')
-        table = dynamodb.Table(results_table)
+        from snapshot import load_snapshot, refresh_snapshot_from_dynamodb, dynamodb_source
+        stats = refresh_snapshot_from_dynamodb(get_dynamodb_table(table_name))
+        snapshot = load_snapshot(source=dynamodb_source(table_name))
+        return f"""
+POLICY SNAPSHOT REFRESHED
+=========================
+Snapshot version: {snapshot['manifest']['version']}
+Policies in snapshot: {snapshot['manifest']['row_count']}
+Inserted: {stats['inserted']} | Updated: {stats['updated']} | Unchanged: {stats['unchanged']} | Deleted: {stats['deleted']}
+"""
+    except Exception as e:
+        return f"Error refreshing policy snapshot: {str(e)}"
+
+def get_underwriting_summary(results_table: str = 'underwritingResults', max_memory_mb: Optional[float] = None) -> str:
+    """Get a summary of all underwriting decisions. When the results would not
+    fit in max_memory_mb (default MAX_MEMORY_MB), they are counted page by
+    page and only the first SUMMARY_DETAIL_LIMIT are listed."""
+    try:
+        table = get_dynamodb_table(results_table)
+        estimated_mb = estimate_dynamodb_mb(table)
+        if would_exceed(estimated_mb, max_memory_mb):
+            return _streamed_underwriting_summary(table, results_table) + budget_note(estimated_mb, max_memory_mb)
         
-        response = table.scan()
+        controller = get_controller(table)
+        response = controller.scan(table)
         results = response['Items']
         
         while 'LastEvaluatedKey' in response:
-            response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+            response = controller.scan(table, ExclusiveStartKey=response['LastEvaluatedKey'])
             results.extend(response['Items'])
         
         if not results:
@@ -299,56 +352,109 @@ DETAILED RESULTS:
     except Exception as e:
         return f"Error getting underwriting summary: {str(e)}"
 
-# Check if required environment variable is set
-if not COHERE_API_KEY:
-    logger.error("COHERE_API_KEY not found in environment variables")
-    print("Error: COHERE_API_KEY not found in environment variables")
-    exit(1)
+def _streamed_underwriting_summary(table, results_table: str) -> str:
+    """get_underwriting_summary's output without holding all results at once"""
+    controller = get_controller(table)
+    counts = {'SAFE': 0, 'NOT SAFE': 0}
+    total = 0
+    details = ""
+    scan_kwargs = {}
+    while True:
+        response = controller.scan(table, **scan_kwargs)
+        for result in response['Items']:
+            classification = result.get('classification', 'UNKNOWN')
+            counts[classification] = counts.get(classification, 0) + 1
+            total += 1
+            if total <= SUMMARY_DETAIL_LIMIT:
+                emoji = "✅" if classification == "SAFE" else "❌"
+                details += f"\n{emoji} Policy {result.get('policy_id')}: {classification}"
+                if result.get('reasoning'):
+                    details += f"\n   {result.get('reasoning', '')[:80]}..."
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    if not total:
+        return f"No underwriting results found in table {results_table}"
+    
+    summary = f"""
+UNDERWRITING SUMMARY
+===================
+Total Policies: {total}
+✅ SAFE: {counts['SAFE']} ({counts['SAFE']/total*100:.1f}%)
+❌ NOT SAFE: {counts['NOT SAFE']} ({counts['NOT SAFE']/total*100:.1f}%)
 
-try:
-    logger.info("Initializing Automatic Underwriting Agent...")
-    model = OpenAIModel(
-        client_args={
-            "api_key": COHERE_API_KEY,
-            "base_url": "https://api.cohere.ai/compatibility/v1"
-        },
-        model_id="command-a-03-2025",
-        params={
-            "max_tokens": 1000
-        }
-    )
+DETAILED RESULTS:
+"""
+    summary += details
+    if total > SUMMARY_DETAIL_LIMIT:
+        summary += f"\n... and {total - SUMMARY_DETAIL_LIMIT} more results"
+    return summary
 
-    agent = Agent(model=model, tools=[
-        auto_underwrite_all_policies,
-        get_underwriting_summary
-    ])
+# Functions exposed to the agent; wrapped with strands' tool() when the agent is built
+TOOLS = [
+    auto_underwrite_all_policies,
+    refresh_policy_snapshot,
+    get_underwriting_summary
+]
+# Started as background jobs by the REPL, so the console stays responsive
+BACKGROUND_TOOLS = [auto_underwrite_all_policies]
 
-    print("🤖 AUTOMATIC Insurance Underwriting Agent Ready!")
-    print("\nThis agent will automatically make SAFE/NOT SAFE decisions")
-    print("\nAvailable commands:")
-    print("- 'Underwrite all policies automatically'")
-    print("- 'Show underwriting summary'")
-    
-    logger.info("Automatic underwriting agent ready")
-    
-    while True:
-        user_input = input("\n🤖 Auto-underwriter command (or 'quit' to exit): ")
-        if user_input.lower() in ['quit', 'exit', 'q']:
-            logger.info("User requested exit")
-            print("👋 Goodbye!")
-            break
+def main():
+    """Start the interactive automatic underwriting agent"""
+    import asyncio
+    from strands import Agent, tool
+    from strands.models.openai import OpenAIModel
+    from repl import JobManager, agent_tools, run_repl
+    from review import LLM_BASE_URL, LLM_MODEL_ID
+
+    # Logging setup
+    setup_logging('auto_underwriter.log')
+
+    # Check if required environment variable is set
+    if not COHERE_API_KEY:
+        logger.error("COHERE_API_KEY not found in environment variables")
+        print("Error: COHERE_API_KEY not found in environment variables")
+        exit(1)
+
+    try:
+        logger.info("Initializing Automatic Underwriting Agent...")
+        model = OpenAIModel(
+            client_args={
+                "api_key": COHERE_API_KEY,
+                "base_url": LLM_BASE_URL
+            },
+            model_id=LLM_MODEL_ID,
+            params={
+                "max_tokens": 1000
+            }
+        )
+
+        jobs = JobManager()
+        tools = agent_tools(TOOLS, jobs, BACKGROUND_TOOLS)
+        agent = Agent(model=model, tools=[tool(f) for f in tools])
+
+        print("🤖 AUTOMATIC Insurance Underwriting Agent Ready!")
+        print("\nThis agent will automatically make SAFE/NOT SAFE decisions")
+        print("\nAvailable commands:")
+        print("- 'Underwrite all policies automatically'")
+        print("- 'Refresh the policy snapshot'")
+        print("- 'Show underwriting summary'")
+        print("\nUnderwriting runs as a background job; type /help for job commands")
         
-        try:
-            logger.info(f"User input: {user_input}")
-            response = agent(user_input)
-            logger.info(f"Agent response length: {len(str(response))} characters")
-            print(f"🤖 {response}")
-        except Exception as e:
-            error_msg = f"Error processing request: {e}"
-            logger.error(f"{error_msg}")
-            print(f"❌ {error_msg}")
+        logger.info("Automatic underwriting agent ready")
+        
+        asyncio.run(run_repl(agent, jobs, tools, "\n🤖 Auto-underwriter command (or 'quit' to exit): ", "🤖"))
+
+    except Exception as e:
+        error_msg = f"Error initializing agent: {e}"
+        logger.error(f"{error_msg}")
+        print(f"❌ {error_msg}")
 
-except Exception as e:
-    error_msg = f"Error initializing agent: {e}"
-    logger.error(f"{error_msg}")
-    print(f"❌ {error_msg}")
\ No newline at end of file
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1:
+        # `python -m underwriter run --source dynamo ...` runs headless, without the LLM
+        import batch
+        sys.exit(batch.main(sys.argv[1:]))
+    main()
@@ -0,0 +1,258 @@
+"""
+What-if evaluation of several rule sets over the whole policy book.
+
+Features are extracted once from the memory-mapped snapshot columns, then
+each rule set is reduced to a boolean SAFE mask with NumPy. Nothing is
+written to underwriting_results, so proposed guidelines can be compared
+against the current ones as often as needed.
+
+The masks follow render_underwriter.apply_underwriting_rules exactly,
+including its defaults for missing values. Building schedules come from the
+snapshot's construction_mix column, factorized like the other strings so
+each distinct mix is decoded once per book.
+"""
+import copy
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from construction import schedule_from_mix
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_COLUMNS = ['renewal_or_new_business', 'line_of_business', 'primary_risk_state', 'construction_type',
+                    'construction_mix']
+# Same defaults as the scalar engine's policy_data.get(...) calls
+NUMERIC_DEFAULTS = {'tiv': 0.0, 'total_premium': 0.0, 'oldest_building': 2024.0, 'loss_value': 0.0}
+
+
+def build_rule_sets(overrides: List[dict]) -> List[dict]:
+    """Current rules (as compiled from rules.txt) first, then one rule set per override dict"""
+    from render_underwriter import CURRENT_RULE_SET
+    from rulebook import get_rules, RulesError
+
+    try:
+        current = get_rules().rule_set
+    except (FileNotFoundError, RulesError):
+        current = CURRENT_RULE_SET
+    rule_sets = [copy.deepcopy(current)]
+    for i, override in enumerate(overrides):
+        unknown = set(override) - set(current)
+        if unknown:
+            raise ValueError(f"Unknown rule set keys: {', '.join(sorted(unknown))}")
+        rule_set = {**copy.deepcopy(current), **override}
+        rule_set['name'] = override.get('name', f"what-if-{i + 1}")
+        rule_sets.append(rule_set)
+    return rule_sets
+
+
+def extract_features(columns: Dict[str, np.ndarray], row_count: int) -> Dict:
+    """
+    Shared per-book features. String columns are factorized so the string
+    predicates of each rule set run once per distinct value, not once per policy.
+    """
+    features = {}
+    for name in CATEGORY_COLUMNS:
+        uniques, inverse = np.unique(np.asarray(columns[name][:row_count]), return_inverse=True)
+        features[name] = (uniques, inverse)
+    features['construction_schedules'] = _schedule_features(features['construction_mix'][0])
+    for name, default in NUMERIC_DEFAULTS.items():
+        values = np.asarray(columns[name][:row_count], dtype=np.float64)
+        features[name] = np.where(np.isnan(values), default, values)
+    return features
+
+
+def _schedule_features(mixes: np.ndarray) -> Dict:
+    """
+    Every distinct mix's (construction type, weight) pairs flattened into one
+    array, with the mix each pair belongs to, so a rule set's shares come out
+    of two bincounts instead of a loop over the mixes.
+    """
+    schedules = [schedule_from_mix(str(mix)) for mix in mixes]
+    present = [(i, schedule) for i, schedule in enumerate(schedules) if schedule is not None]
+    owners = np.concatenate([np.full(len(schedule['types']), i) for i, schedule in present]
+                            + [np.empty(0, dtype=np.int64)])
+    labels = np.concatenate([schedule['types'] for _, schedule in present] + [np.empty(0, dtype='U1')])
+    weights = np.concatenate([schedule['weights'] for _, schedule in present] + [np.empty(0)])
+    return {
+        'has_schedule': np.array([schedule is not None for schedule in schedules], dtype=bool),
+        'owners': owners,
+        'labels': np.unique(labels, return_inverse=True),
+        'weights': weights,
+        'totals': np.bincount(owners, weights=weights, minlength=len(mixes))
+    }
+
+
+def _category_mask(feature, predicate) -> np.ndarray:
+    uniques, inverse = feature
+    lookup = np.fromiter((predicate(str(value)) for value in uniques), dtype=bool, count=len(uniques))
+    return lookup[inverse]
+
+
+def rule_set_mask(features: Dict, rule_set: dict) -> np.ndarray:
+    """Boolean array, True where the policy would be SAFE under rule_set"""
+    declined_types = set(rule_set['declined_submission_types'])
+    required_line = rule_set['required_line_of_business']
+    acceptable_states = set(rule_set['acceptable_states'])
+    construction_types = rule_set['acceptable_construction_types']
+    min_premium, max_premium = rule_set['premium_range']
+
+    safe = ~_category_mask(features['renewal_or_new_business'], lambda v: v.upper() in declined_types)
+    safe &= _category_mask(features['line_of_business'], lambda v: required_line in v.upper())
+    safe &= _category_mask(features['primary_risk_state'], lambda v: v in acceptable_states)
+    safe &= features['tiv'] <= rule_set['max_tiv']
+    safe &= (features['total_premium'] >= min_premium) & (features['total_premium'] <= max_premium)
+    safe &= features['oldest_building'] > rule_set['min_building_year']
+    # Policies with a building schedule are judged on its mix, the others on construction_type
+    type_ok = _category_mask(features['construction_type'],
+                             lambda v: any(t in v.lower() for t in construction_types))
+    _, mix_inverse = features['construction_mix']
+    schedules = features['construction_schedules']
+    lowered_types = [t.lower() for t in construction_types]
+    acceptable = _category_mask(schedules['labels'], lambda v: any(t in v for t in lowered_types))
+    acceptable_weight = np.bincount(schedules['owners'], weights=schedules['weights'] * acceptable,
+                                    minlength=len(schedules['totals']))
+    # float output: bincount returns integers when no policy has a schedule
+    share = np.divide(acceptable_weight, schedules['totals'], out=np.zeros(len(schedules['totals'])),
+                      where=schedules['totals'] > 0)
+    mix_ok = share > rule_set['min_acceptable_construction_share']
+    safe &= np.where(schedules['has_schedule'][mix_inverse], mix_ok[mix_inverse], type_ok)
+    safe &= features['loss_value'] <= rule_set['max_loss_value']
+    return safe
+
+
+def rule_set_sql_condition(rule_set: dict, placeholder: str = '%s', schedule_table: Optional[str] = None) -> tuple:
+    """
+    SQL boolean expression that is true where a policies row would be SAFE,
+    plus its parameters. Missing values get the scalar engine's defaults via
+    COALESCE. Works on PostgreSQL (placeholder '%s') and SQLite ('?').
+    Without schedule_table construction is judged on the construction_type
+    column only, so rows whose raw_data carries a building schedule may differ
+    from the engine. schedule_table names a table of parsed schedules,
+    (policy_id, construction_type, weight) with one row per distinct
+    lowercased type as in construction.parse_schedule; policies found there
+    are judged on their acceptable share, like the engine.
+    """
+    def values_list(values):
+        return ", ".join([placeholder] * len(values)) if values else "NULL"
+
+    def like_pattern(text):
+        escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f"%{escaped}%"
+
+    declined_types = list(rule_set['declined_submission_types'])
+    acceptable_states = list(rule_set['acceptable_states'])
+    construction_types = list(rule_set['acceptable_construction_types'])
+    min_premium, max_premium = rule_set['premium_range']
+
+    type_condition = "(" + (" OR ".join([f"LOWER(COALESCE(construction_type, '')) LIKE {placeholder} ESCAPE '\\'"]
+                                        * len(construction_types)) or "FALSE") + ")"
+    type_params = [like_pattern(t) for t in construction_types]
+    if schedule_table:
+        acceptable = " OR ".join([f"s.construction_type LIKE {placeholder} ESCAPE '\\'"] * len(construction_types)) or "FALSE"
+        # Same share as rule_set_mask: 0 when the schedule carries no weight
+        share = (f"COALESCE((SELECT SUM(CASE WHEN {acceptable} THEN s.weight ELSE 0 END) / NULLIF(SUM(s.weight), 0) "
+                 f"FROM {schedule_table} s WHERE s.policy_id = id), 0)")
+        type_condition = (f"(CASE WHEN EXISTS (SELECT 1 FROM {schedule_table} s WHERE s.policy_id = id) "
+                          f"THEN {share} > {placeholder} ELSE {type_condition} END)")
+        type_params = ([like_pattern(t.lower()) for t in construction_types]
+                       + [rule_set['min_acceptable_construction_share']] + type_params)
+
+    conditions = [
+        # NOT IN (NULL) is never true, so an empty decline list must drop the condition
+        f"UPPER(COALESCE(renewal_or_new_business, '')) NOT IN ({values_list(declined_types)})"
+        if declined_types else "1 = 1",
+        f"UPPER(COALESCE(line_of_business, '')) LIKE {placeholder} ESCAPE '\\'",
+        f"COALESCE(primary_risk_state, '') IN ({values_list(acceptable_states)})",
+        f"COALESCE(tiv, 0) <= {placeholder}",
+        f"COALESCE(total_premium, 0) >= {placeholder}",
+        f"COALESCE(total_premium, 0) <= {placeholder}",
+        f"COALESCE(oldest_building, 2024) > {placeholder}",
+        type_condition,
+        f"COALESCE(loss_value, 0) <= {placeholder}"
+    ]
+    params = (declined_types
+              + [like_pattern(rule_set['required_line_of_business'])]
+              + acceptable_states
+              + [rule_set['max_tiv'], min_premium, max_premium, rule_set['min_building_year']]
+              + type_params
+              + [rule_set['max_loss_value']])
+    return " AND ".join(conditions), params
+
+
+def evaluate_rule_sets(snapshot: Dict, rule_sets: List[dict], sample_size: int = 5) -> Dict:
+    """
+    Evaluate every rule set over the snapshot in one pass.
+
+    Returns the decision matrix (policies x rule sets, True = SAFE), the
+    pairwise diff matrix (number of policies whose decision differs between
+    two rule sets) and, per rule set, the policies that flip against the
+    first (current) rule set.
+    """
+    row_count = snapshot['manifest']['row_count']
+    columns = snapshot['columns']
+    features = extract_features(columns, row_count)
+
+    decisions = np.empty((row_count, len(rule_sets)), dtype=bool)
+    for j, rule_set in enumerate(rule_sets):
+        decisions[:, j] = rule_set_mask(features, rule_set)
+
+    # |a != b| = |a| + |b| - 2|a & b|, computed for all pairs with one matmul
+    as_int = decisions.astype(np.int64)
+    safe_counts = as_int.sum(axis=0)
+    overlap = as_int.T @ as_int
+    diff_matrix = safe_counts[:, None] + safe_counts[None, :] - 2 * overlap
+
+    ids = columns['id']
+    baseline = decisions[:, 0]
+    per_rule_set = []
+    for j, rule_set in enumerate(rule_sets):
+        newly_safe = np.flatnonzero(decisions[:, j] & ~baseline)
+        newly_declined = np.flatnonzero(~decisions[:, j] & baseline)
+        per_rule_set.append({
+            'name': rule_set['name'],
+            'safe_count': int(safe_counts[j]),
+            'not_safe_count': int(row_count - safe_counts[j]),
+            'newly_safe': int(len(newly_safe)),
+            'newly_declined': int(len(newly_declined)),
+            'newly_safe_sample': [str(ids[i]) for i in newly_safe[:sample_size]],
+            'newly_declined_sample': [str(ids[i]) for i in newly_declined[:sample_size]]
+        })
+
+    return {
+        'row_count': row_count,
+        'snapshot_version': snapshot['manifest']['version'],
+        'rule_sets': [rule_set['name'] for rule_set in rule_sets],
+        'decisions': decisions,
+        'diff_matrix': diff_matrix,
+        'summary': per_rule_set
+    }
+
+
+def format_comparison(result: Dict) -> str:
+    """Text report in the style of the agent summaries"""
+    report = f"""
+WHAT-IF RULE SET COMPARISON
+===========================
+Policies evaluated: {result['row_count']} (snapshot v{result['snapshot_version']})
+Nothing was written to underwriting_results.
+
+"""
+    for entry in result['summary']:
+        report += f"{entry['name']}: ✅ SAFE {entry['safe_count']} | ❌ NOT SAFE {entry['not_safe_count']}"
+        if entry is not result['summary'][0]:
+            report += f" | +{entry['newly_safe']} newly safe, -{entry['newly_declined']} newly declined"
+            if entry['newly_safe_sample']:
+                report += f"\n   e.g. now safe: {', '.join(entry['newly_safe_sample'])}"
+            if entry['newly_declined_sample']:
+                report += f"\n   e.g. now declined: {', '.join(entry['newly_declined_sample'])}"
+        report += "\n"
+
+    names = result['rule_sets']
+    width = max(len(name) for name in names) + 2
+    report += "\nDECISION DIFF MATRIX (policies with different decisions):\n"
+    report += " " * width + "".join(f"{name:>{width}}" for name in names) + "\n"
+    for i, name in enumerate(names):
+        report += f"{name:<{width}}" + "".join(f"{int(v):>{width}}" for v in result['diff_matrix'][i]) + "\n"
+    return report